@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+import argparse
+import sys
+from benchmarks import BENCHMARKS
+from benchmarks.corpus import DEFAULT_THRESHOLD
+
+parser = argparse.ArgumentParser(description='Run surfboard benchmarks')
+parser.add_argument('benchmarks', metavar='BENCHMARK', nargs='*',
+                    help='Benchmarks to run (default: all of {})'.format(
+                        ', '.join(sorted(BENCHMARKS))))
+parser.add_argument('--runs', '-n', type=int, default=20,
+                    help='Runs per measurement')
+parser.add_argument('--concurrency', '-c', type=int,
+                    help='Concurrent fetches (load benchmark)')
+parser.add_argument('--save-baseline', metavar='FILE',
+                    help='Save corpus results as a baseline')
+parser.add_argument('--baseline', metavar='FILE',
+                    help='Flag corpus stages slower than this baseline')
+parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                    help='Slowdown (fraction of baseline p50) flagged as a'
+                         ' regression')
+
+def main():
+    args = parser.parse_args()
+    regressions = []
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark {!r}'.format(name))
+        print "---{}---".format(name.upper())
+        regressions.extend(BENCHMARKS[name](args) or [])
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
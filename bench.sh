@@ -0,0 +1,6 @@
+#!/bin/bash
+
+# Wrapper to execute bench.py in venv
+
+cd $(dirname "${0}") || exit1
+./venv/bin/python2 ./bench.py "${@}"
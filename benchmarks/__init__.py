@@ -0,0 +1,54 @@
+from os.path import abspath, dirname, join
+
+__all__ = (
+    'ROOT', 'TESTDATA', 'BENCHMARKS', 'benchmark',
+    'percentile', 'summarize', 'format_summary',
+)
+
+ROOT = abspath(join(dirname(__file__), '..'))
+TESTDATA = join(ROOT, 'testdata')
+
+# name -> function(args), filled in by @benchmark
+BENCHMARKS = {}
+
+def benchmark(func):
+    """Register func as a benchmark (named after it's module).
+
+    Benchmarks are called with bench.py's args, and may return a list of
+    regressions (bench.py then exits non-zero).
+    """
+    BENCHMARKS[func.__module__.rsplit('.', 1)[-1]] = func
+    return func
+
+def percentile(values, pct):
+    """pct percentile (0-100) of values, nearest rank."""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+def summarize(times):
+    """Summary stats (seconds) of a list of timings."""
+    return {
+        'runs': len(times),
+        'min': min(times),
+        'p50': percentile(times, 50),
+        'p90': percentile(times, 90),
+        'p99': percentile(times, 99),
+        'max': max(times),
+    }
+
+def format_summary(name, summary):
+    return ('{name:<32} p50 {p50:8.2f}ms  p90 {p90:8.2f}ms'
+            '  max {max:8.2f}ms  (n={runs})').format(
+                name=name, **dict((k, v * 1000 if k != 'runs' else v)
+                                  for k, v in summary.items()))
+
+# Import benchmarks so they register
+import corpus
+import load
+import memory
+import rates
+import startup
+import xpath
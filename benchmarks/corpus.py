@@ -0,0 +1,130 @@
+"""Per stage timings over every capture in testdata/.
+
+Stages: load (read file), parse (scan of the raw page for the tables'
+fields, see scan.py, or lxml when it falls back), extract (the lxml
+fallback: parse_html() and extract_tables(), as SignalData(fast=False)
+does), snapshot (building a Snapshot of the scanned fields), config
+(rendered, not from the config cache) and values rendering.  Reports
+percentiles, throughput and peak memory, and compares against a saved
+baseline to flag regressions.
+
+extract is an alternative to parse, it isn't part of the total.
+"""
+import json
+import resource
+import time
+from glob import glob
+from os.path import getsize, join
+from benchmarks import TESTDATA, benchmark, format_summary, summarize
+from surfboard import values
+from surfboard.graph import Layout, config_graph, graphs
+from surfboard.parse import SignalData, extract_tables, parse_html, read_data
+from surfboard.spool import layout_of
+
+STAGES = 'load', 'parse', 'extract', 'snapshot', 'config', 'values'
+
+# Not part of a run (parse is), timed for comparison
+ALTERNATIVE_STAGES = 'extract',
+
+# Changes when a stage measures something else, older baselines aren't
+# compared against (save a new one)
+BASELINE_VERSION = 4
+
+# p50 slowdown (fraction) reported as a regression
+DEFAULT_THRESHOLD = 0.2
+
+def corpus():
+    paths = sorted(glob(join(TESTDATA, 'orig', 'cmSignalData.htm*')))
+    paths.extend(sorted(glob(join(TESTDATA, '*.htm'))))
+    return [path for path in paths if getsize(path)]
+
+def run_stages(path):
+    """Seconds spent in each stage for path."""
+    times = {}
+    start = time.time()
+    content = read_data(path)
+    times['load'] = time.time() - start
+
+    start = time.time()
+    data = SignalData(content=content)
+    data.extracted # Lazy
+    times['parse'] = time.time() - start
+
+    start = time.time()
+    extract_tables(parse_html(content), SignalData.tables)
+    times['extract'] = time.time() - start
+
+    start = time.time()
+    data.snapshot()
+    times['snapshot'] = time.time() - start
+
+    # Rendered, as config() does for a layout it hasn't seen (it's
+    # served from a cache after that)
+    start = time.time()
+    layout = Layout(layout_of(data))
+    '\n\n'.join(config_graph(layout, graph) for graph in graphs)
+    times['config'] = time.time() - start
+
+    start = time.time()
+    values(data)
+    times['values'] = time.time() - start
+    return times
+
+def peak_rss():
+    """Peak resident memory of this process, in bytes (Linux: KB units)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def compare(results, baseline, threshold):
+    """Stages whose p50 is more than threshold slower than baseline."""
+    regressions = []
+    for stage in STAGES + ('total', ):
+        old = baseline.get(stage, {}).get('p50')
+        new = results[stage]['p50']
+        if old and new > old * (1 + threshold):
+            regressions.append((stage, old, new))
+    return regressions
+
+@benchmark
+def corpus_stages(args):
+    paths = corpus()
+    times = dict((stage, []) for stage in STAGES)
+    totals = []
+    for i in range(args.runs):
+        for path in paths:
+            stage_times = run_stages(path)
+            for stage, seconds in stage_times.items():
+                times[stage].append(seconds)
+            totals.append(sum(seconds for stage, seconds
+                              in stage_times.items()
+                              if stage not in ALTERNATIVE_STAGES))
+
+    results = {}
+    for stage in STAGES + ('total', ):
+        stage_times = totals if stage == 'total' else times[stage]
+        results[stage] = summarize(stage_times)
+        results[stage]['throughput'] = len(stage_times) / sum(stage_times)
+        print "{}  {:8.0f}/s".format(format_summary(stage, results[stage]),
+                                      results[stage]['throughput'])
+    print "{:<32} {:.1f}MB".format('peak rss', peak_rss() / 1024.0 ** 2)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(dict(results, version=BASELINE_VERSION), f, indent=2,
+                      sort_keys=True)
+        print "baseline saved to {}".format(args.save_baseline)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('version') != BASELINE_VERSION:
+            print ("{} is from an older version of this benchmark, save a new"
+                   " baseline").format(args.baseline)
+            return regressions
+        regressions = compare(results, baseline, args.threshold)
+        for stage, old, new in regressions:
+            print "REGRESSION {}: p50 {:.2f}ms -> {:.2f}ms (+{:.0f}%)".format(
+                stage, old * 1000, new * 1000, (new / old - 1) * 100)
+        if not regressions:
+            print "no regressions against {}".format(args.baseline)
+    return regressions
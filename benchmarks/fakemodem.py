@@ -0,0 +1,228 @@
+"""Stand-in SB6121 web server, serving testdata/ captures with faults.
+
+Used by the load benchmark and the fetch tests, or run on its own to point
+the plugin at:
+
+    python -m benchmarks.fakemodem --port 8080 --latency 0.5 --stall 5
+
+Faults (attributes of FakeModem, change them between requests):
+
+* latency: seconds before the response headers
+* chunk_size / chunk_delay: write the body in chunk_size pieces, sleeping
+  chunk_delay seconds between them (a trickle)
+* chunked: Transfer-Encoding: chunked instead of a Content-Length
+* stall: seconds to stop sending halfway through the body
+* truncate: bytes sent before the connection is dropped (the headers
+  promise the whole page)
+
+Every request gets the next capture (rotating snapshots), or always the
+same one with rotate=False.
+"""
+import argparse
+import socket
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+__all__ = (
+    'FAULTS', 'FakeModem', 'testdata_pages',
+)
+
+# Fault attributes and their defaults (no faults)
+FAULTS = {
+    'latency': 0,
+    'chunk_size': None,
+    'chunk_delay': 0,
+    'chunked': False,
+    'stall': 0,
+    'truncate': None,
+}
+
+PATH = '/cmSignalData.htm'
+
+def testdata_pages():
+    """Contents of every (non empty) capture in testdata/."""
+    from benchmarks.corpus import corpus
+    pages = []
+    for path in corpus():
+        with open(path, 'rb') as f:
+            pages.append(f.read())
+    return pages
+
+def pieces(body, size):
+    if not size:
+        return [body]
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+class FakeModemHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive, like the modem
+
+    def do_GET(self):
+        modem = self.server
+        if self.path.split('?', 1)[0] not in ('/', PATH):
+            self.send_error(404)
+            return
+        page = modem.next_page()
+        if modem.latency:
+            modem.sleep(modem.latency)
+
+        body = page
+        if modem.truncate is not None:
+            body = page[:modem.truncate]
+            self.close_connection = 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        if modem.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(len(page)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+
+        stall_at = len(body) // 2 if modem.stall else None
+        sent = 0
+        try:
+            for piece in pieces(body, modem.chunk_size):
+                if stall_at is not None and sent + len(piece) > stall_at:
+                    self.write(piece[:stall_at - sent])
+                    modem.sleep(modem.stall)
+                    piece = piece[stall_at - sent:]
+                    stall_at = None
+                self.write(piece)
+                sent += len(piece)
+                if modem.chunk_delay and sent < len(body):
+                    modem.sleep(modem.chunk_delay)
+            if modem.chunked and modem.truncate is None:
+                self.wfile.write('0\r\n\r\n')
+            self.wfile.flush()
+        except socket.error:
+            self.close_connection = 1 # Client gave up (timed out)
+
+    def write(self, data):
+        if not data:
+            return
+        if self.server.chunked:
+            data = '{:x}\r\n{}\r\n'.format(len(data), data)
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeModem(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server serving pages at url, with faults (see FAULTS
+    and the module docstring).  start() serves in a daemon thread."""
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128 # Concurrent connects aren't refused
+
+    def __init__(self, pages, host='127.0.0.1', port=0, rotate=True,
+                 **faults):
+        unknown = set(faults) - set(FAULTS)
+        if unknown:
+            raise TypeError("unknown faults {}".format(sorted(unknown)))
+        HTTPServer.__init__(self, (host, port), FakeModemHandler)
+        self.pages = pages
+        self.rotate = rotate
+        for fault, default in FAULTS.items():
+            setattr(self, fault, faults.get(fault, default))
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._handlers = []
+        self._stopping = threading.Event()
+
+    def __repr__(self):
+        return 'FakeModem(url={!r}, pages={})'.format(self.url,
+                                                      len(self.pages))
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}{}'.format(host, port, PATH)
+
+    def next_page(self):
+        with self._lock:
+            page = self.pages[self.requests % len(self.pages)
+                              if self.rotate else 0]
+            self.requests += 1
+        return page
+
+    def start(self):
+        # Short poll interval, stop() returns quickly
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        args=(.05, ))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def sleep(self, seconds):
+        """Sleep for a fault, cut short by stop()."""
+        self._stopping.wait(seconds)
+
+    def process_request(self, request, client_address):
+        thread = threading.Thread(target=self.process_request_thread,
+                                  args=(request, client_address))
+        thread.daemon = True
+        with self._lock:
+            self._handlers = [(handler, sock)
+                              for handler, sock in self._handlers
+                              if handler.is_alive()]
+            self._handlers.append((thread, request))
+        thread.start()
+
+    def handle_error(self, request, client_address):
+        pass # Clients giving up on faults is expected
+
+    def stop(self):
+        """Stop serving, and wait for requests being handled (idle
+        keep-alive connections are closed)."""
+        self._stopping.set()
+        self.shutdown()
+        self.server_close()
+        with self._lock:
+            handlers = list(self._handlers)
+        for handler, sock in handlers:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass # Already closed
+            handler.join()
+
+parser = argparse.ArgumentParser(
+    description='Serve testdata/ captures like an SB6121, with faults')
+parser.add_argument('--host', default='127.0.0.1')
+parser.add_argument('--port', type=int, default=8080)
+parser.add_argument('--same', action='store_true',
+                    help="Don't rotate captures, always serve the first")
+parser.add_argument('--latency', type=float, default=0,
+                    help='Seconds before the response headers')
+parser.add_argument('--chunk-size', type=int,
+                    help='Send the body in pieces of this many bytes')
+parser.add_argument('--chunk-delay', type=float, default=0,
+                    help='Seconds between pieces')
+parser.add_argument('--chunked', action='store_true',
+                    help='Transfer-Encoding: chunked')
+parser.add_argument('--stall', type=float, default=0,
+                    help='Seconds to stall halfway through the body')
+parser.add_argument('--truncate', type=int,
+                    help='Drop the connection after this many body bytes')
+
+def main():
+    args = parser.parse_args()
+    modem = FakeModem(testdata_pages(), args.host, args.port,
+                      rotate=not args.same, latency=args.latency,
+                      chunk_size=args.chunk_size,
+                      chunk_delay=args.chunk_delay, chunked=args.chunked,
+                      stall=args.stall, truncate=args.truncate)
+    print "serving {}".format(modem.url)
+    try:
+        modem.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        modem.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Fetch latency and failures against a stand-in modem (see fakemodem.py).
+
+Each scenario serves the rotating testdata/ captures with some faults,
+and runs --runs fetch + extract cycles (--concurrency at a time, sharing
+a Fetcher), then --runs plugin processes.  Faults that should fail
+(stalls past the read timeout, truncated pages) are reported as
+failures, not errors.
+"""
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+from Queue import Empty, Queue
+from threading import Thread
+from benchmarks import ROOT, benchmark, format_summary, summarize
+from benchmarks.fakemodem import FakeModem, testdata_pages
+from surfboard.fetch import Fetcher
+from surfboard.parse import SignalData
+
+DEFAULT_CONCURRENCY = 8
+
+# Read timeout of the fetcher (and plugin runs), below the stall
+READ_TIMEOUT = 1
+
+# (name, faults)
+SCENARIOS = (
+    ('clean', {}),
+    ('latency 200ms', {'latency': .2}),
+    ('trickle 256B/10ms', {'chunk_size': 256, 'chunk_delay': .01}),
+    ('chunked', {'chunked': True, 'chunk_size': 512}),
+    ('stall 2s', {'stall': 2}),
+    ('truncated', {'truncate': 1000}),
+)
+
+def fetch_once(url, fetcher, stream):
+    data = SignalData(url, stream=stream, fetcher=fetcher)
+    for table in SignalData.tables:
+        getattr(data, '{}_by_column'.format(table))()
+
+def plugin_once(url):
+    argv = [sys.executable, os.path.join(ROOT, 'surfboard.py'), url,
+            '--read-timeout', str(READ_TIMEOUT), '--retries', '0']
+    env = dict(os.environ)
+    env.pop('MUNIN_PLUGSTATE', None)
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(argv, cwd=ROOT, env=env, stdout=devnull,
+                              stderr=devnull)
+
+def drive(func, runs, concurrency):
+    """Call func() runs times from concurrency threads.
+
+    Returns (seconds of each successful call, Counter of failures by
+    exception type).
+    """
+    jobs = Queue()
+    for i in range(runs):
+        jobs.put(i)
+    times, failures = [], Counter()
+
+    def worker():
+        while True:
+            try:
+                jobs.get_nowait()
+            except Empty:
+                return
+            start = time.time()
+            try:
+                func()
+            except Exception as e:
+                failures[type(e).__name__] += 1
+            else:
+                times.append(time.time() - start)
+
+    threads = [Thread(target=worker) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return times, failures
+
+def report(name, runs, times, failures):
+    if times:
+        print format_summary(name, summarize(times))
+    if failures:
+        print "{:<32} {} of {} failed: {}".format(
+            name, sum(failures.values()), runs,
+            ', '.join('{} {}'.format(count, error)
+                      for error, count in sorted(failures.items())))
+
+@benchmark
+def load(args):
+    concurrency = args.concurrency or DEFAULT_CONCURRENCY
+    pages = testdata_pages()
+    for name, faults in SCENARIOS:
+        modem = FakeModem(pages, **faults).start()
+        try:
+            for stream in False, True:
+                fetcher = Fetcher(read_timeout=READ_TIMEOUT, retries=0)
+                label = '{} ({})'.format(name, 'stream' if stream
+                                         else 'fetch')
+                times, failures = drive(
+                    lambda: fetch_once(modem.url, fetcher, stream),
+                    args.runs, concurrency)
+                fetcher.close()
+                report(label, args.runs, times, failures)
+            times, failures = drive(lambda: plugin_once(modem.url),
+                                    args.runs, concurrency)
+            report('{} (plugin)'.format(name), args.runs, times, failures)
+        finally:
+            modem.stop()
@@ -0,0 +1,98 @@
+"""Resident memory of long lived samples: dict per column vs Snapshot,
+and kept SignalData (with it's parse trees) vs Snapshot.scrape().
+
+Each variant is built in a fresh process, so they don't share memory.
+Counter values differ per sample like a real history would.
+"""
+import gc
+import os
+from multiprocessing import Process, Queue
+from benchmarks import TESTDATA, benchmark
+from surfboard.parse import SignalData
+from surfboard.snapshot import Snapshot
+
+# Samples kept, ~a day of 20 second polls for 3 modems
+SAMPLES = 3 * 24 * 60 * 3
+
+# Pages kept, parse trees are much bigger than samples
+PAGES = 200
+
+COUNTERS = 'unerrored', 'correctable', 'uncorrectable'
+
+PAGE = os.path.join(TESTDATA, 'working.htm')
+
+def rss():
+    """Current resident set size in bytes (Linux)."""
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+def by_columns(data, i):
+    """data's *_by_column() dicts, with counters bumped by i."""
+    columns = {}
+    for table in SignalData.tables:
+        columns[table] = getattr(data, '{}_by_column'.format(table))()
+    for column in columns['stats']:
+        for counter in COUNTERS:
+            if column.get(counter) is not None:
+                column[counter] += i
+    return columns
+
+def build_dicts(data, i):
+    return by_columns(data, i)
+
+def build_snapshots(data, i):
+    return Snapshot.from_by_columns(i, by_columns(data, i))
+
+def scraped(data, **kwargs):
+    """SignalData of the page, every table extracted (as a plugin run
+    does)."""
+    data = SignalData(PAGE, **kwargs)
+    for table in SignalData.tables:
+        getattr(data, '{}_by_column'.format(table))()
+    return data
+
+def build_lxml(data, i):
+    data = scraped(data)
+    data.elements # The tree *_table()/*_row() use
+    return data
+
+def build_soup(data, i):
+    return scraped(data, soup=True)
+
+def build_scraped(data, i):
+    return Snapshot.scrape(PAGE, i)
+
+def measure(build, samples, queue):
+    data = SignalData(PAGE)
+    build(data, 0) # Warm up imports, caches
+    gc.collect()
+    before = rss()
+    kept = [build(data, i) for i in xrange(samples)]
+    gc.collect()
+    queue.put(rss() - before)
+
+def compare(variants, samples):
+    """Print each variant's memory, the last compared to the others."""
+    results = []
+    for name, build in variants:
+        queue = Queue()
+        process = Process(target=measure, args=(build, samples, queue))
+        process.start()
+        used = queue.get()
+        process.join()
+        results.append((name, used))
+        print "{:<32} {:8.1f}MB  {:6.0f} bytes/sample  (n={})".format(
+            name, used / 1024.0 ** 2, float(used) / samples, samples)
+    name, least = results[-1]
+    for other, used in results[:-1]:
+        print "{:<32} {:.1f}x smaller than {}".format(
+            name, float(used) / least, other)
+
+@benchmark
+def memory(args):
+    compare((('dict per column', build_dicts),
+             ('Snapshot', build_snapshots)), SAMPLES)
+    compare((('SignalData (lxml tree)', build_lxml),
+             ('SignalData (soup=True)', build_soup),
+             ('Snapshot.scrape()', build_scraped)), PAGES)
@@ -0,0 +1,73 @@
+"""Error ratio/rate computation (rates.error_rates()) over a fleet's
+histories.
+
+rates.py loops over array('d') in plain Python, channel by channel.
+This times it for the daemon's 5 minute window, and for a whole day of
+history, to show where that stops being cheap.
+"""
+import time
+from shutil import rmtree
+from tempfile import mkdtemp
+from benchmarks import benchmark, format_summary, summarize
+from surfboard.history import DEFAULT_SLOTS, History
+from surfboard.rates import WINDOW, error_rates
+from surfboard.spool import Sample
+
+# Modems in the fleet
+MODEMS = 64
+
+# Stats channels per modem (the SB6121 bonds 4)
+CHANNELS = 4
+
+# Seconds between samples, the daemon's default interval
+INTERVAL = 20
+
+def stats_sample(timestamp, i):
+    """Sample with CHANNELS stats channels, counters grown by i polls."""
+    columns = [{'channel': channel, 'unerrored': 1000 * i,
+                'correctable': 10 * i + channel, 'uncorrectable': i}
+               for channel in range(CHANNELS)]
+    return Sample.from_by_columns(timestamp, {'down': [], 'up': [],
+                                              'stats': columns})
+
+def fleet_histories(directory, modems=MODEMS, samples=DEFAULT_SLOTS):
+    """modems Histories, each with the same samples (a copy of the
+    first's map, appending them all takes far longer than the timing)."""
+    start = int(time.time()) - samples * INTERVAL
+    histories = []
+    for modem in range(modems):
+        history = History(directory, 'http://10.0.{}.{}/'.format(
+            modem // 256, modem % 256))
+        if histories:
+            history.map[:] = histories[0].map[:]
+        else:
+            for i in range(samples):
+                history.append(stats_sample(start + i * INTERVAL, i))
+        histories.append(history)
+    return histories
+
+def time_rates(histories, runs, **kwargs):
+    times = []
+    for i in range(runs):
+        start = time.time()
+        error_rates(histories, **kwargs)
+        times.append(time.time() - start)
+    return times
+
+@benchmark
+def rates(args):
+    directory = mkdtemp()
+    try:
+        histories = fleet_histories(directory)
+        try:
+            for name, kwargs in (
+                    ('window', {'since': time.time() - WINDOW}),
+                    ('day', {'n': DEFAULT_SLOTS})):
+                times = time_rates(histories, args.runs, **kwargs)
+                print format_summary('{} x {} modems'.format(name, MODEMS),
+                                     summarize(times))
+        finally:
+            for history in histories:
+                history.close()
+    finally:
+        rmtree(directory)
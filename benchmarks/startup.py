@@ -0,0 +1,63 @@
+"""Interpreter + import time and cold start of plugin runs.
+
+Each run is a fresh python process, like every munin invocation.
+"""
+import os
+import subprocess
+import sys
+import time
+from shutil import rmtree
+from tempfile import mkdtemp
+from benchmarks import ROOT, TESTDATA, benchmark, format_summary, summarize
+
+# Slow imports surfboard defers until a page is actually parsed/fetched
+DEFERRED = 'lxml.html', 'bs4', 'decimal', 'httplib', 'multiprocessing'
+
+IMPORT_TIMER = ('import time; t = time.time(); {}; '
+                'import sys; sys.stdout.write(repr(time.time() - t))')
+
+def import_times(statement, runs):
+    """In process time of statement, in fresh interpreters."""
+    code = IMPORT_TIMER.format(statement)
+    return [float(subprocess.check_output([sys.executable, '-c', code],
+                                          cwd=ROOT))
+            for i in range(runs)]
+
+def run_times(argv, runs, env=None):
+    """Wall time of fresh surfboard.py processes."""
+    argv = [sys.executable, os.path.join(ROOT, 'surfboard.py')] + argv
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for i in range(runs):
+            start = time.time()
+            subprocess.check_call(argv, cwd=ROOT, env=env, stdout=devnull)
+            times.append(time.time() - start)
+    return times
+
+@benchmark
+def startup(args):
+    page = os.path.join(TESTDATA, 'working.htm')
+    results = [
+        ('python (no imports)', import_times('pass', args.runs)),
+        ('import surfboard', import_times('import surfboard', args.runs)),
+        ('import deferred modules',
+         import_times('import ' + ', '.join(DEFERRED), args.runs)),
+    ]
+
+    env = dict(os.environ)
+    env.pop('MUNIN_PLUGSTATE', None)
+    results.append(('config (scrape + parse)',
+                    run_times(['config', page], args.runs, env)))
+
+    state = mkdtemp()
+    try:
+        env['MUNIN_PLUGSTATE'] = state
+        run_times([page], 1, env) # Remember the layout
+        results.append(('config (known layout)',
+                        run_times(['config', page], args.runs, env)))
+        results.append(('fetch (parse)', run_times([page], args.runs, env)))
+    finally:
+        rmtree(state)
+
+    for name, times in results:
+        print format_summary(name, summarize(times))
@@ -0,0 +1,82 @@
+"""Per poll cost of table/row lookups over the testdata/orig corpus.
+
+Compares xpath strings formatted (and parsed by lxml) on every call, as
+get_table()/get_row() used to, with the compiled XPaths registry, and
+the single pass extract_tables() that SignalData uses.
+"""
+import time
+from glob import glob
+from os.path import getsize, join
+from benchmarks import TESTDATA, benchmark, format_summary, summarize
+from surfboard.parse import (SignalData, contains, convert_text,
+                             extract_tables, get_fields, get_table,
+                             parse_html)
+
+def string_get_fields(lxml, table_header, header, split, convert):
+    """get_table() + get_fields() with per call xpath strings."""
+    headers = lxml.xpath('//table//*[{}]'.format(contains(table_header)))
+    if not headers:
+        return None
+    tables = headers[0].xpath('./ancestor::table')
+    if not tables:
+        return None
+    tds = tables[-1].xpath('./tbody/tr/td[{}]'.format(contains(header)))
+    if tds:
+        return convert_text(tds[0].getparent().xpath('./td')[1:],
+                            convert or int, split)
+
+def compiled_get_fields(lxml, table_header, header, split, convert):
+    return get_fields(get_table(lxml, table_header), header, split,
+                      convert or int)
+
+def lookups():
+    """(table header, row header, split, convert) for every field."""
+    for info in SignalData.tables.values():
+        for row in info.get('rows', []):
+            name, header, split, convert = (row + (None, None))[:4]
+            yield info['header'], header, split, convert
+
+def per_field(func):
+    """Poll every field of a root with func."""
+    fields = list(lookups())
+    def poll(root):
+        for args in fields:
+            func(root, *args)
+    return poll
+
+def poll_times(roots, poll, runs):
+    """Seconds per poll(root) of each root."""
+    times = []
+    for i in range(runs):
+        for root in roots:
+            start = time.time()
+            poll(root)
+            times.append(time.time() - start)
+    return times
+
+def corpus():
+    paths = sorted(glob(join(TESTDATA, 'orig', 'cmSignalData.htm*')))
+    return [path for path in paths if getsize(path)]
+
+@benchmark
+def xpath(args):
+    roots = []
+    for path in corpus():
+        with open(path) as f:
+            roots.append(parse_html(f.read()))
+
+    single_pass = lambda root: extract_tables(root, SignalData.tables)
+    results = [
+        ('xpath strings', poll_times(roots, per_field(string_get_fields),
+                                     args.runs)),
+        ('compiled XPaths', poll_times(roots, per_field(compiled_get_fields),
+                                       args.runs)),
+        ('single pass', poll_times(roots, single_pass, args.runs)),
+    ]
+    for name, times in results:
+        print format_summary(name, summarize(times))
+
+    base = summarize(results[0][1])['p50']
+    for name, times in results[1:]:
+        print "{:<32} {:.1f}x faster than xpath strings (p50)".format(
+            name, base / summarize(times)['p50'])
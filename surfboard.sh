@@ -2,5 +2,8 @@
 
 # Wrapper to execute surfboard.py in venv
 
-cd $(dirname "${0}") || exit1
+# Linked as a wildcard plugin (surfboard_<graph>): surfboard.py sees it's own
+# name, not the link's, pass that on
+export SURFBOARD_PLUGIN=$(basename "${0}")
+cd $(dirname "$(readlink -f "${0}")") || exit1
 ./venv/bin/python2 ./surfboard.py "${@}"
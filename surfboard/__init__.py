@@ -1,15 +1,33 @@
 import argparse
+import os
+import sys
+import time
+from collections import OrderedDict
 from functools import partial
 from pprint import pprint
+from cache import (DEFAULT_WAIT, ResultCache, load_layout, page_cache,
+                   result_cache, save_layout, single_flight, state_dir)
 from parse import *
 from graph import *
+from spool import DEFAULT_INTERVAL, Sample, Spool, layout_of, poll
+from timing import Timings
+from api import Reading, sample
+# fetch, fleet, replay and exporter are imported where used, they pull in slow
+# imports (httplib/ssl, multiprocessing) most runs don't need
 
 __all__ = (
     'DEFAULT_URL', 'handle_args', 'config', 'values',
+    # In-process API (see api.py)
+    'sample', 'Reading',
     # Re-expored from parse (for tests)
     'pluralize', 'strip_lower', 'zip_and_dict', 'SignalData',
+    'get_table', 'get_row', 'get_fields', 'stream_tables', 'xpaths',
     # Re-expored from config (for tests)
     'GraphPoint', 'config_graph',
+    # Re-exported from spool (for tests)
+    'Sample', 'Spool',
+    # Re-exported from timing (for tests)
+    'Timings',
 )
 
 DEFAULT_URL = 'http://192.168.100.1/cmSignalData.htm'
@@ -17,15 +35,79 @@ DEFAULT_URL = 'http://192.168.100.1/cmSignalData.htm'
 parser = argparse.ArgumentParser()
 parser.add_argument('mode', nargs='?')
 parser.add_argument('html', nargs='?', default=DEFAULT_URL)
+parser.add_argument('--soup', action='store_true',
+                    help='Parse with BeautifulSoup first (for broken markup)')
+parser.add_argument('--stream', action='store_true',
+                    help='Parse while reading, stop once all tables are read')
+parser.add_argument('--timeout', type=float,
+                    help='Seconds to wait connecting to the modem'
+                         ' (default: 2)')
+parser.add_argument('--read-timeout', type=float,
+                    help='Seconds to wait for data from the modem'
+                         ' (default: 5)')
+parser.add_argument('--retries', type=int,
+                    help='Retries (with backoff) for failed fetches, made'
+                         ' if they can finish within 9 seconds of the first'
+                         ' attempt (default: 2)')
+parser.add_argument('--cache-dir',
+                    help='Share scraped pages (and the last channel layout,'
+                         ' for `config`) between runs via this directory'
+                         ' (default: $MUNIN_PLUGSTATE)')
+parser.add_argument('--cache-ttl', type=int,
+                    help='Seconds to reuse a scraped page, 0 to disable'
+                         ' (default: $SURFBOARD_CACHE_TTL or 60)')
+parser.add_argument('--wait', type=float,
+                    help='Seconds to wait for a concurrent run scraping the'
+                         ' same page (via --cache-dir) and share its scrape,'
+                         ' 0 to disable (default: $SURFBOARD_WAIT or'
+                         ' {:g})'.format(DEFAULT_WAIT))
+parser.add_argument('--spool-dir',
+                    help='Directory `daemon` mode spools samples to, and'
+                         ' other modes read them from'
+                         ' (default: $MUNIN_PLUGSTATE)')
+parser.add_argument('--interval', type=int,
+                    help='Seconds between `daemon` mode polls (and'
+                         ' `exporter` mode refreshes)'
+                         ' (default: $SURFBOARD_INTERVAL or {})'.format(
+                             DEFAULT_INTERVAL))
+parser.add_argument('--fleet',
+                    help='Modem urls (comma separated, or a file with one per'
+                         ' line) to poll concurrently, instead of html'
+                         ' (default: $SURFBOARD_FLEET)')
+parser.add_argument('--workers', type=int,
+                    help='Concurrent fetches in --fleet mode (default: 8)')
+parser.add_argument('--processes', type=int,
+                    help='Parser processes in --fleet and `replay` modes'
+                         ' (default: cpus, in --fleet mode one per 32'
+                         ' modems)')
+parser.add_argument('--spread', type=float, default=0,
+                    help='Spread --fleet fetches randomly over this many'
+                         ' seconds')
+parser.add_argument('--listen', default=':9551',
+                    help='[host:]port `exporter` mode serves /metrics on'
+                         ' (default: :9551)')
+parser.add_argument('--format', choices=('csv', 'jsonl'), default='csv',
+                    help='`replay` output format (default: csv)')
+parser.add_argument('--output',
+                    help='`replay` output file (default: stdout)')
+parser.add_argument('--graphs',
+                    help='Graphs to output (comma separated, of {}), only'
+                         " the tables they're from are extracted (default:"
+                         ' $SURFBOARD_GRAPHS, or from a surfboard_<graph>'
+                         ' wildcard plugin name, or all)'.format(
+                             ', '.join(GRAPH_NAMES)))
+parser.add_argument('--checkpoint',
+                    help='`replay` progress file, rerun with the same'
+                         ' captures and --output to resume')
 
 def test(data):
     print "---INPUT---"
     for section, subs in SignalData.tables.items():
         print "{}:".format(section)
         rows = [row[0] for row in subs.get('rows', [])]
+        columns = getattr(data, '{}_by_column'.format(section))()
         for sub in rows:
-            method = pluralize('_'.join((section, sub)))
-            vals = getattr(data, method)()
+            vals = [column.get(sub) for column in columns if column]
             print "\t{}: {}".format(sub, map(str, vals))
 
     print
@@ -37,20 +119,76 @@ def test(data):
     })
 
 
-def config(data):
-    graph_configs = map(partial(config_graph, data), graphs)
-    return '\n\n'.join(graph_configs)
+def config(data, host=None, directory=None, selected=graphs,
+           update_rate=None):
+    """Config of selected graphs for data's channel layout (see
+    layout_config())."""
+    return layout_config(layout_of(data, graph_tables(selected)), host,
+                         directory, selected, update_rate)
 
-def values(data):
-    values = []
-    for graph in graphs:
-        if values:
-            values.append('') # blank line spacer
-        graph_name = graph.get('graph')
-        values.append("multigraph surfboard_{}".format(graph_name))
-        for point in setup_graph_points(data, graph):
-            values.append(point.value_line())
-    return '\n'.join(values)
+def values(*datas):
+    """Values for one or more SignalData (or spooled Sample) objects."""
+    return host_values(datas)
+
+def host_values(datas, host=None, selected=graphs):
+    graph_values = map(partial(values_graph, datas, host=host), selected)
+    return '\n\n'.join(graph_values)
+
+def chosen(args, all_graphs=graphs):
+    """Graphs of all_graphs args.graphs selects."""
+    return select_graphs(all_graphs, args.graphs)
+
+def error_outputs(args, urls, hosts=False):
+    """Config/values of the error graphs for urls a daemon keeps a History
+    of: {url: output}.
+
+    hosts: for --fleet output (multigraph names include url's host).
+    """
+    if args.spool_dir is None or not chosen(args, error_graphs):
+        return {}
+    from history import History
+    from rates import WINDOW, error_rates
+    histories = OrderedDict()
+    for url in urls:
+        try:
+            histories[url] = History(args.spool_dir, url, create=False)
+        except (IOError, ValueError):
+            pass # No daemon (or an older one's history)
+    try:
+        all_rates = error_rates(histories.values(), time.time() - WINDOW)
+    finally:
+        for history in histories.values():
+            history.close()
+
+    outputs = {}
+    for url, rates in zip(histories, all_rates):
+        host = None
+        if hosts:
+            from fleet import host_name
+            host = host_name(url)
+        outputs[url] = graphs_output(args, rates, chosen(args, error_graphs),
+                                     host)
+    return outputs
+
+def graphs_output(args, data, graphs, host=None):
+    """Config (followed by values, with dirtyconfig) or values of graphs."""
+    sections = []
+    if args.mode == 'config':
+        sections.extend(config_graph(data, graph, host) for graph in graphs)
+    if args.mode != 'config' or args.dirty:
+        sections.extend(values_graph([data], graph, host) for graph in graphs)
+    return '\n\n'.join(sections)
+
+def with_extras(args, timings, output):
+    """output followed by the error graphs (with a daemon's History) and
+    the plugin_timing graph's config/values."""
+    sections = [output]
+    errors = error_outputs(args, [args.html]).get(args.html)
+    if errors is not None:
+        sections.append(errors)
+    sections.append(graphs_output(args, timings,
+                                  chosen(args, [timing_graph])))
+    return '\n\n'.join(section for section in sections if section)
 
 def handle_args(args=None):
     args = parser.parse_args(args)
@@ -62,19 +200,270 @@ def munge_args(args):
     Handle munin plugin `config` optional first argument
     (I wish it was `--config`)
     """
-    MODES = 'test', 'config'
+    MODES = 'test', 'config', 'daemon', 'replay', 'exporter'
     if args.mode is not None:
         if args.mode not in MODES:
             # Maybe it's the html argument
             args.html = args.mode
             args.mode = None
 
+    if args.spool_dir is None:
+        args.spool_dir = state_dir()
+    args.layout_dir = args.cache_dir or state_dir()
+    if args.interval is None:
+        args.interval = int(os.environ.get('SURFBOARD_INTERVAL',
+                                           DEFAULT_INTERVAL))
+    if args.fleet is None:
+        args.fleet = os.environ.get('SURFBOARD_FLEET')
+    if args.graphs is None:
+        args.graphs = os.environ.get('SURFBOARD_GRAPHS')
+    if args.graphs is not None:
+        args.graphs = args.graphs.replace(',', ' ').split()
+    else:
+        # surfboard.sh passes on the name it was linked as
+        args.graphs = plugin_graphs(os.environ.get('SURFBOARD_PLUGIN')
+                                    or sys.argv[0])
+    unknown = set(args.graphs or []) - set(GRAPH_NAMES)
+    if unknown:
+        parser.error('unknown graphs: {}'.format(', '.join(sorted(unknown))))
+    # munin 2.x: config runs may output values too, saving a fetch run
+    args.dirty = (args.mode == 'config'
+                  and os.environ.get('MUNIN_CAP_DIRTYCONFIG') == '1')
+    if args.fleet is not None and args.mode == 'test':
+        parser.error('test mode only works with a single modem')
+    if args.mode == 'daemon' and args.spool_dir is None:
+        parser.error('daemon mode needs --spool-dir (or $MUNIN_PLUGSTATE)')
+    if args.mode == 'exporter' and args.fleet is not None:
+        parser.error('exporter mode only works with a single modem')
+    if args.mode == 'replay':
+        if args.html == DEFAULT_URL:
+            parser.error('replay mode needs a directory or glob of captures')
+        if args.checkpoint is not None and args.output is None:
+            parser.error('--checkpoint needs --output')
+
+def plugin_graphs(path):
+    """Graph a munin wildcard plugin (surfboard_<graph>) is named for,
+    as a list, None for a plain plugin."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name.startswith('surfboard_'):
+        return [name[len('surfboard_'):]]
+
+def spool_reader(args):
+    """Spool reader (see Spool) for the selected graphs, None for all."""
+    if args.graphs:
+        return '_'.join(sorted(set(args.graphs)))
+
+def spool_rate(args, spool):
+    """update_rate for config (see config_graph()): args.interval if a
+    daemon is filling spool, so values come from it, otherwise None."""
+    if spool is not None and spool.active():
+        return args.interval
+
+def spooled(args, spool, url=None):
+    """Output from samples spooled by a `daemon`, None if there are none.
+
+    url: for --fleet output (multigraph names include url's host).
+    """
+    host = None
+    if url is not None:
+        from fleet import host_name
+        host = host_name(url)
+    if args.mode == 'config':
+        latest = spool.latest()
+        if latest is not None:
+            output = config(latest, host, args.layout_dir, chosen(args),
+                            args.interval)
+            samples = args.dirty and spool.unread()
+            if samples:
+                output = '\n\n'.join((output, host_values(samples, host,
+                                                           chosen(args))))
+            return output
+    elif args.mode is None:
+        samples = spool.unread()
+        if samples:
+            return host_values(samples, host, chosen(args))
+
+def make_fetcher(args):
+    from fetch import Fetcher
+    kwargs = {}
+    for arg, kwarg in (('timeout', 'connect_timeout'),
+                       ('read_timeout', 'read_timeout'),
+                       ('retries', 'retries')):
+        if getattr(args, arg) is not None:
+            kwargs[kwarg] = getattr(args, arg)
+    return Fetcher(**kwargs)
+
+def known_layout(args, url, tables=None):
+    """Sample with url's last known channel layout (for config), or None
+    if it isn't known (for all of tables, default all)."""
+    if args.layout_dir is not None:
+        layout = load_layout(args.layout_dir, url)
+        if tables is None:
+            tables = SignalData.tables
+        if layout is not None and set(tables) <= set(layout):
+            return Sample.from_layout(layout)
+
+def remember_layout(args, url, data, tables=None):
+    """Store the layout of data's tables (default all), others' are kept
+    (wildcard plugins for different graphs share it)."""
+    if args.layout_dir is not None:
+        layout = layout_of(data, tables)
+        if tables is not None:
+            layout = dict(load_layout(args.layout_dir, url) or {}, **layout)
+        save_layout(args.layout_dir, url, layout)
+
+def run_fleet(args):
+    """Output for every modem in args.fleet, from spools where possible."""
+    from fleet import (DEFAULT_WORKERS, empty_sample, host_name, load_fleet,
+                       poll_fleet, sample_all)
+    urls = load_fleet(args.fleet)
+    workers = args.workers or DEFAULT_WORKERS
+    if args.mode == 'daemon':
+        poll_fleet(urls, args.spool_dir, args.interval, workers=workers,
+                   processes=args.processes, fetcher=make_fetcher(args),
+                   history=True, soup=args.soup, stream=args.stream)
+        return
+
+    selected = chosen(args)
+    tables = None # All of them
+    if args.graphs is not None:
+        # Only the tables selected graphs are from
+        tables = graph_tables(selected)
+    # Nothing to scrape for only graphs that aren't from the page (errors)
+    paged = [] if tables == [] else urls
+    output, live = {}, []
+    for url in paged:
+        spool = None
+        if args.spool_dir is not None:
+            spool = Spool(args.spool_dir, url, spool_reader(args))
+        if args.mode == 'config' and not args.dirty:
+            layout = known_layout(args, url, tables)
+            if layout is not None:
+                output[url] = config(layout, host_name(url),
+                                     args.layout_dir, selected,
+                                     spool_rate(args, spool))
+        if output.get(url) is None and spool is not None:
+            output[url] = spooled(args, spool, url)
+        if output.get(url) is None:
+            live.append(url)
+
+    if live:
+        cache = single_flight(args.cache_dir,
+                              page_cache(args.cache_dir, args.cache_ttl),
+                              args.wait)
+        samples = sample_all(live, workers, args.spread, cache,
+                             args.processes, make_fetcher(args),
+                             soup=args.soup, stream=args.stream,
+                             tables=tables)
+        for url, sample in zip(live, samples):
+            host = host_name(url)
+            if sample is None:
+                sample = empty_sample()
+            else:
+                remember_layout(args, url, sample, tables)
+            if args.mode == 'config':
+                output[url] = config(sample, host, args.layout_dir, selected)
+                if args.dirty:
+                    output[url] = '\n\n'.join((output[url], host_values(
+                        [sample], host, selected)))
+            else:
+                output[url] = host_values([sample], host, selected)
+
+    sections = [output[url] for url in urls if url in output]
+    errors = error_outputs(args, urls, hosts=True)
+    sections.extend(errors[url] for url in urls if url in errors)
+    return '\n\n'.join(sections)
+
+def run_replay(args):
+    """Captures in args.html (a directory or glob) to args.output."""
+    from replay import captures, replay
+    paths = captures(args.html)
+    if args.output is None:
+        return replay(paths, sys.stdout, args.format, args.processes)
+    resume = (args.checkpoint is not None and os.path.exists(args.checkpoint)
+              and os.path.exists(args.output))
+    with open(args.output, 'r+b' if resume else 'wb') as output:
+        return replay(paths, output, args.format, args.processes,
+                      args.checkpoint)
+
+def run_exporter(args):
+    """Serve args.html's metrics for Prometheus (forever)."""
+    from exporter import Exporter, serve
+    host, _, port = args.listen.rpartition(':')
+    serve(Exporter(args.html, args.interval, soup=args.soup,
+                   stream=args.stream, fetcher=make_fetcher(args),
+                   results=ResultCache()),
+          host, int(port))
+
 def main():
     args = handle_args()
-    data = SignalData(args.html)
+    if args.mode == 'replay':
+        run_replay(args)
+        return
+    elif args.mode == 'exporter':
+        run_exporter(args)
+        return
+    if args.fleet is not None:
+        output = run_fleet(args)
+        if output is not None:
+            print output
+        return
+
+    timings = Timings()
+    spool = None
+    if args.spool_dir is not None:
+        spool = Spool(args.spool_dir, args.html, spool_reader(args))
+    if args.mode == 'daemon':
+        from history import History
+        poll(args.html, spool, args.interval,
+             history=History(args.spool_dir, args.html), soup=args.soup,
+             stream=args.stream, fetcher=make_fetcher(args),
+             results=ResultCache())
+        return
+    selected = chosen(args)
+    tables = None # All of them
+    if args.graphs is not None and args.mode != 'test':
+        # Only the tables selected graphs are from
+        tables = graph_tables(selected)
+    if tables == []:
+        # Only graphs that aren't from the page (errors, timing)
+        print with_extras(args, timings, '')
+        return
+    elif args.mode == 'config' and not args.dirty:
+        # Only the channel layout matters for config, don't scrape for it
+        layout = known_layout(args, args.html, tables)
+        if layout is not None:
+            print with_extras(args, timings, config(
+                layout, directory=args.layout_dir, selected=selected,
+                update_rate=spool_rate(args, spool)))
+            return
+    if spool is not None:
+        with timings.time('render'):
+            output = spooled(args, spool)
+        if output is not None:
+            print with_extras(args, timings, output)
+            return
+
+    data = sample(args.html, stream=args.stream, soup=args.soup,
+                  cache=single_flight(args.cache_dir,
+                                      page_cache(args.cache_dir,
+                                                 args.cache_ttl),
+                                      args.wait),
+                  fetcher=make_fetcher(args),
+                  results=result_cache(args.cache_dir), tables=tables)
+    timings.values.update(data.timings)
+    remember_layout(args, args.html, data, tables)
     if args.mode == 'test':
         test(data)
-    elif args.mode == 'config':
-        print config(data)
-    else:
-        print values(data)
+        return
+    with timings.time('render'):
+        if args.mode == 'config':
+            output = config(data, directory=args.layout_dir,
+                            selected=selected)
+            if args.dirty:
+                # Values from the same scrape, munin skips the fetch run
+                output = '\n\n'.join((output, host_values([data],
+                                                           selected=selected)))
+        else:
+            output = host_values([data], selected=selected)
+    print with_extras(args, timings, output)
@@ -0,0 +1,101 @@
+"""In-process API, for collectors that would otherwise run the plugin and
+parse it's output:
+
+    import surfboard
+    reading = surfboard.sample('http://192.168.100.1/cmSignalData.htm')
+    [channel.snr for channel in reading.down]
+    reading.timings['fetch']
+"""
+import time
+from parse import SignalData, read_data
+from snapshot import Frozen
+from spool import Sample
+from timing import Timings
+
+__all__ = (
+    'Reading', 'sample',
+)
+
+def is_page(source):
+    """Whether source is page content rather than a url or path."""
+    return '<' in source
+
+def records_getter(table):
+    def func(self):
+        return self.sample.channels(table).records()
+    return func
+
+def by_column_getter(table):
+    def func(self):
+        return getattr(self.sample, '{}_by_column'.format(table))()
+    return func
+
+class Reading(Frozen):
+    """One scrape of a modem, immutable.
+
+    down, up, stats: tuples of channel records (namedtuples, see
+                     snapshot.RECORDS), one per channel the modem reported.
+    sample: the Sample (timestamp, channels) for spools and histories.
+            The Reading itself has no timestamp: graph.py renders it as
+            live values, not timestamped ones like spooled Samples.
+    timings: {field: value} of Timings.FIELDS, seconds (bytes for 'bytes'),
+             None for steps this scrape skipped.
+    *_by_column() are the same as SignalData's, graph.py renders a Reading
+    like any other data.
+    """
+    __slots__ = ('source', 'sample', 'timings')
+
+    def __init__(self, source, sample, timings):
+        self._init(source=source, sample=sample, timings=timings)
+
+    def __repr__(self):
+        return 'Reading(source={!r}, timestamp={!r})'.format(
+            self.source if not is_page(self.source) else '<page>',
+            self.sample.timestamp)
+
+    def __reduce__(self):
+        return Reading, (self.source, self.sample, self.timings)
+
+for table in SignalData.tables:
+    setattr(Reading, table, property(records_getter(table)))
+    setattr(Reading, '{}_by_column'.format(table), by_column_getter(table))
+del table
+
+def sample(source, timestamp=None, stream=False, soup=False, cache=None,
+           fetcher=None, results=None, tables=None):
+    """Reading of source: a url, a file path, or the page itself (a str
+    of markup, e.g. fetched by the caller).
+
+    timestamp: of the Reading's sample (default now).
+    stream, soup, cache, fetcher, results: see SignalData.  cache can
+        also be a SingleFlight, sharing the scrape with other processes.
+    tables: Names of the tables to extract (default all), the Reading
+            only has those.
+
+    Thread safe, calls share nothing but what's passed in (Fetcher,
+    PageCache and ResultCache are all safe to share between threads).
+    """
+    if timestamp is None:
+        timestamp = int(time.time())
+    timings = Timings()
+    content = None
+    if is_page(source):
+        content = source
+    elif stream:
+        # Parsed while reading, fetch includes parse
+        with timings.time('fetch'):
+            data = SignalData(source, stream=True, cache=cache,
+                              fetcher=fetcher, extract=tables)
+        timings.values['bytes'] = data.read_bytes
+    else:
+        with timings.time('fetch'):
+            content = read_data(source, cache, fetcher)
+        timings.values['bytes'] = len(content)
+    if content is not None:
+        with timings.time('parse'):
+            data = SignalData(content=content, soup=soup, results=results,
+                              extract=tables)
+            data.extracted # Scanned (or parsed) lazily, time it here
+    with timings.time('extract'):
+        data = Sample.from_data(data, timestamp, tables)
+    return Reading(source, data, timings.values)
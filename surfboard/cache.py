@@ -0,0 +1,435 @@
+import errno
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+from hashlib import sha1
+from StringIO import StringIO
+from tempfile import mkstemp
+from parse import dump_fields, load_fields
+
+__all__ = (
+    'DEFAULT_TTL', 'state_dir', 'atomic_write',
+    'CachingReader', 'PageCache', 'page_cache',
+    'DEFAULT_RESULTS', 'ResultCache', 'result_cache',
+    'DEFAULT_WAIT', 'DEFAULT_DEADLINE', 'SingleFlight', 'single_flight',
+    'load_layout', 'save_layout', 'load_config', 'save_config',
+)
+
+# Seconds a scraped page is reused, long enough to cover munin's
+# `config` run followed by the fetch run
+DEFAULT_TTL = 60
+
+CACHE_PREFIX = 'surfboard-page-'
+LAYOUT_PREFIX = 'surfboard-layout-'
+CONFIG_PREFIX = 'surfboard-config-'
+RESULT_PREFIX = 'surfboard-result-'
+
+# Extracted pages kept by a ResultCache (in memory, and on disk)
+DEFAULT_RESULTS = 16
+
+FLIGHT_PREFIX = 'surfboard-flight-'
+
+# Seconds an invocation waits for another's scrape of the same page before
+# scraping itself: fetch.DEFAULT_DEADLINE, by then that scrape is done or
+# has given up (not imported, fetch pulls in httplib).  That leaves nothing
+# of DEFAULT_DEADLINE, a run still waiting then fails instead of scraping
+DEFAULT_WAIT = 9
+WAIT_POLL = 0.05
+
+# Seconds a SingleFlight.open() may take, waiting included: a scrape after
+# waiting only gets what's left (fetch.DEFAULT_DEADLINE, inside munin-node's
+# 10 second plugin timeout)
+DEFAULT_DEADLINE = 9
+
+def state_dir():
+    """Munin plugin state directory (None outside of munin)."""
+    return os.environ.get('MUNIN_PLUGSTATE')
+
+def atomic_write(path, content):
+    """Write content to path via a temp file + rename.
+
+    Readers see either the old or new file, never a partial one.
+    """
+    directory, name = os.path.split(path)
+    fd, tmp_path = mkstemp(dir=directory or '.', prefix='.{}.'.format(name))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+class CachingReader(object):
+    """Wrap a file like object, storing everything read in cache on close.
+
+    Content is only stored once read to the end, or up to the last table
+    (see stream_tables(), which calls finish()): a page read up to the
+    last table parses the same as the whole page.  A failed read (timeout,
+    dropped connection) stores nothing, the next open() fetches again.
+    """
+    def __init__(self, cache, key, content):
+        self.cache = cache
+        self.key = key
+        self.content = content
+        self.chunks = []
+        self.complete = False
+        self.failed = False
+
+    def read(self, size=-1):
+        try:
+            chunk = self.content.read(size)
+        except:
+            self.failed = True
+            raise
+        self.chunks.append(chunk)
+        if size is None or size < 0 or not chunk:
+            self.complete = True
+        return chunk
+
+    def finish(self):
+        """Everything needed has been read, store it even if there's more."""
+        self.complete = True
+        finish = getattr(self.content, 'finish', None)
+        if finish is not None:
+            finish() # A CachingReader too (a SingleFlight's around a cache)
+
+    def close(self):
+        self.content.close()
+        if self.chunks is not None and self.complete and not self.failed:
+            self.cache.put(self.key, ''.join(self.chunks))
+        self.chunks = None
+
+class PageCache(object):
+    """Raw pages stored in directory, keyed by url, expired after ttl."""
+    def __init__(self, directory, ttl=DEFAULT_TTL):
+        self.directory = directory
+        self.ttl = ttl
+
+    def __repr__(self):
+        return ('PageCache(directory={self.directory!r}'
+                ', ttl={self.ttl!r})').format(self=self)
+
+    def path(self, key):
+        return os.path.join(self.directory,
+                            CACHE_PREFIX + sha1(key).hexdigest())
+
+    def age(self, path, now=None):
+        """Age of path in seconds, None if it doesn't exist."""
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        return (now or time.time()) - mtime
+
+    def get(self, key):
+        """Cached content for key, None if missing or expired."""
+        path = self.path(key)
+        age = self.age(path)
+        if age is None or age >= self.ttl:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except IOError:
+            return None # Evicted since age() check
+
+    def put(self, key, content):
+        atomic_write(self.path(key), content)
+        self.evict()
+
+    def evict(self):
+        """Remove all cached pages older than ttl."""
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.startswith(CACHE_PREFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            age = self.age(path, now)
+            if age is not None and age >= self.ttl:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass # Another invocation got it first
+
+    def open(self, key, opener):
+        """File like object for key, from cache or opener() (then cached)."""
+        content = self.get(key)
+        if content is not None:
+            return StringIO(content)
+        return CachingReader(self, key, opener())
+
+def page_cache(directory=None, ttl=None):
+    """Setup a PageCache, defaults from munin's environment.
+
+    Returns None (no caching) without a directory or with a ttl of 0.
+    """
+    directory = directory or state_dir()
+    if ttl is None:
+        ttl = int(os.environ.get('SURFBOARD_CACHE_TTL', DEFAULT_TTL))
+    if directory is None or ttl <= 0:
+        return None
+    return PageCache(directory, ttl)
+
+class ResultCache(object):
+    """Extracted tables (see SignalData.extracted) of pages, keyed by a
+    hash of the page's content.
+
+    The modem only updates it's page every few seconds, repeated scrapes
+    are often byte for byte the same: those skip parsing and extraction.
+    Keeps the size most recently used results in memory, and in directory
+    (if given, shared between invocations, as JSON: see dump_fields()).
+    Thread safe.
+    """
+    def __init__(self, size=DEFAULT_RESULTS, directory=None):
+        self.size = size
+        self.directory = directory
+        self.results = OrderedDict() # key -> result, oldest first
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return ('ResultCache(size={self.size!r}'
+                ', directory={self.directory!r}'
+                ', hits={self.hits!r}, misses={self.misses!r})').format(
+                    self=self)
+
+    @staticmethod
+    def key(content):
+        return sha1(content).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, RESULT_PREFIX + key)
+
+    def get(self, key):
+        """Result stored for key, None (a miss) if there isn't one."""
+        with self._lock:
+            result = self.results.pop(key, None)
+            if result is None and self.directory is not None:
+                result = self.load(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.remember(key, result)
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self.results.pop(key, None)
+            self.remember(key, result)
+            if self.directory is not None:
+                atomic_write(self.path(key), dump_fields(result))
+                self.evict()
+
+    def remember(self, key, result):
+        self.results[key] = result
+        while len(self.results) > self.size:
+            self.results.popitem(last=False)
+
+    def load(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = load_fields(f.read())
+            os.utime(path, None) # Recently used, evict() keeps it
+        except (IOError, OSError, ValueError, KeyError, TypeError,
+                AttributeError):
+            return None # Not (or no longer) a result
+        return result
+
+    def evict(self):
+        """Remove all but the size most recently used results on disk."""
+        paths = []
+        for name in os.listdir(self.directory):
+            if name.startswith(RESULT_PREFIX):
+                path = os.path.join(self.directory, name)
+                try:
+                    paths.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass # Another invocation evicted it
+        for mtime, path in sorted(paths, reverse=True)[self.size:]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+def result_cache(directory=None, size=None):
+    """Setup a ResultCache, defaults from munin's environment.
+
+    Results are only kept in memory without a directory, returns None (no
+    caching) with a size of 0.
+    """
+    directory = directory or state_dir()
+    if size is None:
+        size = int(os.environ.get('SURFBOARD_RESULTS', DEFAULT_RESULTS))
+    if size <= 0:
+        return None
+    return ResultCache(size, directory)
+
+class FlightReader(CachingReader):
+    """CachingReader storing in a SingleFlight's result file, holding it's
+    lock (a locked file) until closed."""
+    def __init__(self, flight, key, content, lock):
+        CachingReader.__init__(self, flight, key, content)
+        self.lock = lock
+
+    def close(self):
+        try:
+            CachingReader.close(self)
+        finally:
+            if self.lock is not None:
+                fcntl.flock(self.lock, fcntl.LOCK_UN)
+                self.lock.close()
+                self.lock = None
+
+class SingleFlight(object):
+    """Concurrent invocations scraping the same page share one scrape.
+
+    The first to take the page's lock file (flock) scrapes, via cache (a
+    PageCache) if given, and leaves the page in a result file.  Others
+    wait up to `wait` seconds for the lock, then reuse the result if it
+    was written while they waited.  Otherwise (the scrape failed, or took
+    too long) they scrape themselves, with what's left of `deadline`
+    seconds.  Used like a PageCache (see open_data()).
+
+    The scrape is read by it's caller as it arrives (it can stop early,
+    see stream_tables()), the lock is held and the result file written
+    once it's closed.
+    """
+    def __init__(self, directory, wait=DEFAULT_WAIT, cache=None,
+                 deadline=DEFAULT_DEADLINE):
+        self.directory = directory
+        self.wait = wait
+        self.cache = cache
+        self.deadline = deadline
+
+    def __repr__(self):
+        return ('SingleFlight(directory={self.directory!r}'
+                ', wait={self.wait!r}, cache={self.cache!r}'
+                ', deadline={self.deadline!r})').format(self=self)
+
+    def path(self, key):
+        return os.path.join(self.directory,
+                            FLIGHT_PREFIX + sha1(key).hexdigest())
+
+    def version(self, path):
+        """Identifies a result file (each write is a new file), None if
+        there isn't one."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime
+
+    def lock(self, lock):
+        """Wait for lock (a file), False if it took longer than wait."""
+        deadline = time.time() + self.wait
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            if time.time() >= deadline:
+                return False
+            time.sleep(WAIT_POLL)
+
+    def put(self, key, content):
+        """Leave content as key's result (see FlightReader)."""
+        atomic_write(self.path(key), content)
+
+    def open(self, key, opener):
+        """File like object for key, shared with a concurrent scrape or
+        from opener() (then shared once closed, close it).
+
+        opener is called as opener(deadline=seconds), seconds being what's
+        left of deadline after waiting.  Raises IOError (without calling
+        it) if nothing is.
+        """
+        start = time.time()
+        path = self.path(key)
+        seen = self.version(path)
+        lock = open(path + '.lock', 'a')
+        locked = False
+        try:
+            # Not locked: another scrape is hung, don't wait on it any
+            # longer (nor share this scrape)
+            locked = self.lock(lock)
+            if locked and self.version(path) != seen:
+                # Scraped while waiting for the lock
+                try:
+                    with open(path, 'rb') as f:
+                        return StringIO(f.read())
+                except IOError:
+                    pass
+            left = self.deadline - (time.time() - start)
+            if left <= 0:
+                raise IOError("no time left to scrape {} after waiting"
+                              " {:.1f}s for another scrape".format(
+                                  key, time.time() - start))
+            opener = partial(opener, deadline=left)
+            if self.cache is not None:
+                content = self.cache.open(key, opener)
+            else:
+                content = opener()
+            if not locked:
+                return content
+            # The reader unlocks
+            reader, lock = FlightReader(self, key, content, lock), None
+            return reader
+        finally:
+            if lock is not None:
+                if locked:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+                lock.close()
+
+def single_flight(directory=None, cache=None, wait=None):
+    """Setup a SingleFlight around cache (a PageCache or None), defaults
+    from munin's environment.
+
+    Returns cache as is without a directory or with a wait of 0.
+    """
+    directory = directory or state_dir()
+    if wait is None:
+        wait = float(os.environ.get('SURFBOARD_WAIT', DEFAULT_WAIT))
+    if directory is None or wait <= 0:
+        return cache
+    return SingleFlight(directory, wait, cache)
+
+def layout_path(directory, source):
+    return os.path.join(directory, LAYOUT_PREFIX + sha1(source).hexdigest())
+
+def load_layout(directory, source):
+    """Last known channel layout of source ({table: columns}), or None."""
+    try:
+        with open(layout_path(directory, source)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def save_layout(directory, source, layout):
+    """Store source's channel layout (if it changed)."""
+    if load_layout(directory, source) != layout:
+        atomic_write(layout_path(directory, source),
+                     json.dumps(layout, sort_keys=True))
+
+def config_path(directory, key):
+    return os.path.join(directory, CONFIG_PREFIX + sha1(key).hexdigest())
+
+def load_config(directory, key):
+    """Config rendered for key (see graph.layout_config()), or None."""
+    try:
+        with open(config_path(directory, key)) as f:
+            return f.read()
+    except IOError:
+        return None
+
+def save_config(directory, key, config):
+    atomic_write(config_path(directory, key), config)
@@ -0,0 +1,243 @@
+import sys
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from parse import SignalData
+from spool import DEFAULT_INTERVAL, Sample
+
+__all__ = (
+    'DEFAULT_PORT', 'CONTENT_TYPE', 'METRICS',
+    'Histogram', 'Exporter', 'serve',
+)
+
+DEFAULT_PORT = 9551
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, for both scrape and refresh (modem fetch + parse) latency
+BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+# Direction label of each table's channels (stats are downstream)
+DIRECTIONS = {'down': 'down', 'up': 'up', 'stats': 'down'}
+
+# field -> (metric, type, help, extra labels), for every table's channels
+METRICS = {
+    'freq': ('surfboard_frequency_hertz', 'gauge',
+             'Channel frequency', ()),
+    'snr': ('surfboard_snr_db', 'gauge',
+            'Signal to noise ratio', ()),
+    'power': ('surfboard_power_dbmv', 'gauge',
+              'Power level', ()),
+    'rate': ('surfboard_symbol_rate_msyms', 'gauge',
+             'Symbol rate (Msym/s)', ()),
+    'service_id': ('surfboard_service_id', 'gauge',
+                   'Upstream service id', ()),
+    'unerrored': ('surfboard_codewords_total', 'counter',
+                  'Codewords received', (('type', 'unerrored'), )),
+    'correctable': ('surfboard_codewords_total', 'counter',
+                    'Codewords received', (('type', 'correctable'), )),
+    'uncorrectable': ('surfboard_codewords_total', 'counter',
+                      'Codewords received', (('type', 'uncorrectable'), )),
+}
+
+def labels(pairs):
+    return ','.join('{}="{}"'.format(name, str(value).replace('"', '\\"'))
+                    for name, value in pairs)
+
+def sample_metrics(sample):
+    """Exposition lines for every channel's fields in sample."""
+    families = {} # metric -> (type, help, [lines])
+    order = []
+    for table in sorted(SignalData.tables):
+        fields = [row[0] for row in SignalData.tables[table]['rows']]
+        for column in getattr(sample, '{}_by_column'.format(table))():
+            if column.get('channel') is None:
+                continue # Padding, or a channel the modem didn't report
+            channel = (('direction', DIRECTIONS[table]),
+                       ('channel', column['channel']))
+            for field in fields:
+                if field not in METRICS or column.get(field) is None:
+                    continue
+                metric, type, help, extra = METRICS[field]
+                if metric not in families:
+                    families[metric] = type, help, []
+                    order.append(metric)
+                families[metric][2].append('{}{{{}}} {}'.format(
+                    metric, labels(channel + extra), column[field]))
+    lines = []
+    for metric in order:
+        type, help, samples = families[metric]
+        lines.append('# HELP {} {}'.format(metric, help))
+        lines.append('# TYPE {} {}'.format(metric, type))
+        lines.extend(samples)
+    return lines
+
+class Histogram(object):
+    """Prometheus histogram (thread safe)."""
+    def __init__(self, name, help, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'Histogram(name={self.name!r}, count={self.count!r})'.format(
+            self=self)
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def lines(self):
+        with self._lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} histogram'.format(self.name)]
+        for bound, bucket in zip(self.buckets, counts):
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, bound,
+                                                          bucket))
+        lines.append('{}_bucket{{le="+Inf"}} {}'.format(self.name, count))
+        lines.append('{}_sum {}'.format(self.name, total))
+        lines.append('{}_count {}'.format(self.name, count))
+        return lines
+
+class Exporter(object):
+    """Latest Sample of source, refreshed every interval seconds by a
+    background thread (start()).
+
+    Scrapes only read the latest sample, they never wait on the modem, and
+    however many scrapers there are the modem is fetched once per interval.
+    A failed refresh keeps serving the last sample (with surfboard_up 0).
+    kwargs are passed to SignalData.
+    """
+    def __init__(self, source, interval=DEFAULT_INTERVAL, **kwargs):
+        self.source = source
+        self.interval = interval
+        self.kwargs = kwargs
+        self.latest = None
+        self.up = False
+        self.refreshed = None # time of the last refresh attempt
+        self.failures = 0
+        self.scrapes = Histogram('surfboard_scrape_duration_seconds',
+                                 'Time answering a scrape')
+        self.refreshes = Histogram('surfboard_refresh_duration_seconds',
+                                   'Time fetching and parsing the modem page')
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return ('Exporter(source={self.source!r}'
+                ', interval={self.interval!r})').format(self=self)
+
+    def refresh(self):
+        start = time.time()
+        try:
+            self.latest = Sample.scrape(self.source, int(start),
+                                        **self.kwargs)
+            self.up = True
+        except Exception as e:
+            print >> sys.stderr, "refresh of {} failed: {!r}".format(
+                self.source, e)
+            self.failures += 1
+            self.up = False
+        self.refreshed = time.time()
+        self.refreshes.observe(self.refreshed - start)
+
+    def run(self):
+        """Refresh every interval seconds, until stop()."""
+        next_refresh = time.time()
+        while not self._stopping.is_set():
+            self.refresh()
+            next_refresh += self.interval
+            delay = next_refresh - time.time()
+            if delay <= 0:
+                next_refresh = time.time() # Fell behind, don't burst
+            self._stopping.wait(max(delay, 0))
+
+    def start(self):
+        """Refresh in a daemon thread."""
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop refreshing (after a refresh in progress)."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def sample(self):
+        """Latest Sample (None if there hasn't been a good one yet)."""
+        return self.latest
+
+    def metrics(self):
+        """Exposition format text of the latest sample and the exporter."""
+        start = time.time()
+        sample = self.sample()
+        lines = []
+        if sample is not None:
+            lines.extend(sample_metrics(sample))
+            lines.extend([
+                '# HELP surfboard_sample_timestamp_seconds'
+                ' When the modem was last fetched',
+                '# TYPE surfboard_sample_timestamp_seconds gauge',
+                'surfboard_sample_timestamp_seconds {}'.format(
+                    sample.timestamp),
+            ])
+        lines.extend([
+            '# HELP surfboard_up Whether the last modem fetch succeeded',
+            '# TYPE surfboard_up gauge',
+            'surfboard_up {}'.format(int(self.up)),
+            '# HELP surfboard_refresh_failures_total Failed modem fetches',
+            '# TYPE surfboard_refresh_failures_total counter',
+            'surfboard_refresh_failures_total {}'.format(self.failures),
+        ])
+        lines.extend(self.refreshes.lines())
+        # Includes this scrape (up to rendering the histogram itself)
+        self.scrapes.observe(time.time() - start)
+        lines.extend(self.scrapes.lines())
+        return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.exporter.metrics()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scraped every few seconds, don't fill the logs
+
+class ExporterServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, exporter):
+        HTTPServer.__init__(self, address, MetricsHandler)
+        self.exporter = exporter
+
+def serve(exporter, host='', port=DEFAULT_PORT):
+    """Refresh exporter and serve it's metrics on
+    http://host:port/metrics (forever)."""
+    server = ExporterServer((host, port), exporter)
+    exporter.start()
+    try:
+        server.serve_forever()
+    finally:
+        exporter.stop()
+        server.server_close()
@@ -0,0 +1,318 @@
+import httplib
+import socket
+import threading
+import time
+from collections import deque
+from StringIO import StringIO
+from urlparse import urlparse
+
+__all__ = (
+    'DEFAULT_CONNECT_TIMEOUT', 'DEFAULT_READ_TIMEOUT', 'DEFAULT_RETRIES',
+    'DEFAULT_DEADLINE',
+    'FetchError', 'Timing', 'Response', 'Fetcher', 'default_fetcher',
+)
+
+# Seconds, the modem is slow but a hung connection shouldn't outlive
+# munin's plugin timeout (munin-node's default is 10)
+DEFAULT_CONNECT_TIMEOUT = 2
+DEFAULT_READ_TIMEOUT = 5
+
+# Seconds a fetch may take, all attempts included: a retry is only made if
+# it can time out (connect + read timeouts) before then
+DEFAULT_DEADLINE = 9
+
+# Retries after the first attempt, with exponential backoff between them
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 4
+
+# Timings kept by a Fetcher
+TIMINGS_KEPT = 100
+
+# Errors worth retrying (connection refused/reset, timeouts, bad responses)
+RETRY_ERRORS = socket.error, httplib.HTTPException
+
+class FetchError(IOError):
+    pass
+
+class Timing(object):
+    """Timing of a single fetch, times are seconds since start."""
+    def __init__(self, url, deadline=None):
+        self.url = url
+        self.start = time.time()
+        self.deadline = deadline # All attempts must be done by then
+        self.attempts = 0
+        self.status = None
+        self.connect = None # Connected (None for a reused connection)
+        self.first_byte = None # Response headers received
+        self.total = None # Body read (or closed early)
+        self.bytes = 0
+        self.cached = False # 304 Not Modified, content from last fetch
+
+    def __repr__(self):
+        return ('Timing(url={self.url!r}'
+                ', status={self.status!r}'
+                ', total={self.total!r}'
+                ', bytes={self.bytes!r})').format(self=self)
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def timeout(self, timeout):
+        """timeout, cut short to what's left before deadline (raises
+        socket.timeout if it has passed)."""
+        if self.deadline is None:
+            return timeout
+        left = self.deadline - self.elapsed()
+        if left <= 0:
+            raise socket.timeout('fetch deadline passed')
+        return min(timeout, left)
+
+class DeadlineSocket(object):
+    """Socket (proxy) a response body is received from, each receive
+    times out by deadline (seconds since timing started)."""
+    def __init__(self, sock, timing, deadline, read_timeout):
+        self.sock = sock
+        self.timing = timing
+        self.deadline = deadline
+        self.read_timeout = read_timeout
+
+    def recv(self, size):
+        left = self.deadline - self.timing.elapsed()
+        if left <= 0:
+            raise socket.timeout('fetch deadline passed')
+        self.sock.settimeout(min(self.read_timeout, left))
+        return self.sock.recv(size)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+class Response(object):
+    """File like response body, updates it's timing as it's read.
+
+    The connection is handed back to the fetcher for reuse when the body
+    has been read completely, and dropped when closed early.  Reading
+    past deadline (seconds since the fetch started, None for no limit)
+    raises socket.timeout, a trickled body can't outlive it.
+    """
+    def __init__(self, fetcher, key, conn, response, timing, deadline=None):
+        self.fetcher = fetcher
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.timing = timing
+        self.sock = None
+        if deadline is not None and hasattr(response.fp, '_sock'):
+            # The body's socket (conn.sock is already closed when the
+            # modem closes the connection after the response)
+            self.sock = response.fp._sock
+            response.fp._sock = DeadlineSocket(self.sock, timing, deadline,
+                                               fetcher.read_timeout)
+        self.chunks = []
+
+    def read(self, size=-1):
+        if self.response is None:
+            return ''
+        try:
+            if size is None or size < 0:
+                chunk = self.response.read()
+            else:
+                chunk = self.response.read(size)
+        except:
+            self._done(complete=False)
+            raise
+        if not chunk and size and self.response.length:
+            # Dropped before Content-Length bytes, read(size) doesn't check
+            self._done(complete=False)
+            raise httplib.IncompleteRead(''.join(self.chunks or []))
+        self.timing.bytes += len(chunk)
+        self.chunks.append(chunk)
+        if not chunk or self.response.isclosed():
+            self._done(complete=True)
+        return chunk
+
+    def close(self):
+        if self.response is not None:
+            self._done(complete=self.response.isclosed())
+
+    def _done(self, complete):
+        self.timing.total = self.timing.elapsed()
+        if complete:
+            if self.sock is not None:
+                # Reused by later fetches, with deadlines of their own
+                self.sock.settimeout(self.fetcher.read_timeout)
+            self.fetcher._release(self.key, self.conn, self.response)
+            self.fetcher._store(self.timing.url, self.response,
+                                ''.join(self.chunks))
+        else:
+            self.conn.close()
+        self.response = self.chunks = None
+
+class Fetcher(object):
+    """HTTP client for polling modems.
+
+    * connect and read timeouts
+    * keep-alive connections, reused by later fetches of the same host
+      (thread safe, each fetch gets a connection of it's own)
+    * retries with capped exponential backoff, within a deadline
+    * conditional requests (ETag/Last-Modified) when the modem sends those
+    * a Timing for every fetch (last TIMINGS_KEPT kept in timings)
+    """
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, max_backoff=MAX_BACKOFF,
+                 deadline=DEFAULT_DEADLINE):
+        """deadline: seconds for all attempts of a fetch, None for no
+                  limit but retries."""
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.timings = deque(maxlen=TIMINGS_KEPT)
+        self._idle = {} # (scheme, host, port) -> [idle connections]
+        self._validators = {} # url -> (etag, last modified, content)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return ('Fetcher(connect_timeout={self.connect_timeout!r}'
+                ', read_timeout={self.read_timeout!r}'
+                ', retries={self.retries!r}'
+                ', deadline={self.deadline!r})').format(self=self)
+
+    def _can_retry(self, timing, delay):
+        """Whether another attempt, after delay, times out by timing's
+        deadline."""
+        if timing.deadline is None:
+            return True
+        worst = self.connect_timeout + self.read_timeout
+        return timing.elapsed() + delay + worst <= timing.deadline
+
+    def _connection(self, key, timing):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        scheme, host, port = key
+        timeout = timing.timeout(self.connect_timeout)
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, port, timeout=timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=timeout)
+        conn.connect()
+        timing.connect = timing.elapsed()
+        return conn, False
+
+    def _release(self, key, conn, response):
+        if response.will_close:
+            conn.close()
+            return
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    def _store(self, url, response, content):
+        """Remember validators for conditional requests."""
+        etag = response.getheader('etag')
+        modified = response.getheader('last-modified')
+        if response.status == 200 and (etag or modified):
+            with self._lock:
+                self._validators[url] = etag, modified, content
+
+    def _request(self, url, key, path, timing):
+        conn, reused = self._connection(key, timing)
+        try:
+            conn.sock.settimeout(timing.timeout(self.read_timeout))
+        except socket.timeout:
+            conn.close()
+            raise
+        headers = {}
+        with self._lock:
+            etag, modified, cached = self._validators.get(url,
+                                                          (None, None, None))
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+        except RETRY_ERRORS:
+            conn.close()
+            if reused:
+                # Idle connection closed by the modem, not a real failure
+                return self._request(url, key, path, timing)
+            raise
+        timing.first_byte = timing.elapsed()
+        timing.status = response.status
+
+        if response.status == httplib.NOT_MODIFIED and cached is not None:
+            response.read()
+            self._release(key, conn, response)
+            timing.total = timing.elapsed()
+            timing.cached = True
+            return StringIO(cached)
+        elif response.status != httplib.OK:
+            response.read()
+            self._release(key, conn, response)
+            error = FetchError('{} from {}'.format(response.status, url))
+            error.status = response.status
+            raise error
+        return Response(self, key, conn, response, timing, timing.deadline)
+
+    def open(self, url, deadline=None):
+        """File like response for url, see Response.
+
+        deadline: seconds this fetch may take, if less than the fetcher's
+                  (e.g. what's left of a caller's own deadline).
+        """
+        parsed = urlparse(url)
+        key = parsed.scheme, parsed.hostname, parsed.port
+        path = parsed.path or '/'
+        if parsed.query:
+            path = '{}?{}'.format(path, parsed.query)
+
+        if deadline is None or (self.deadline is not None
+                                and self.deadline < deadline):
+            deadline = self.deadline
+        timing = Timing(url, deadline)
+        self.timings.append(timing)
+        while True:
+            timing.attempts += 1
+            try:
+                return self._request(url, key, path, timing)
+            except RETRY_ERRORS + (FetchError, ) as e:
+                if isinstance(e, FetchError) and e.status < 500:
+                    raise
+                retry = timing.attempts - 1
+                delay = min(self.max_backoff, self.backoff * 2 ** retry)
+                if retry >= self.retries or not self._can_retry(timing,
+                                                                delay):
+                    timing.total = timing.elapsed()
+                    raise
+                time.sleep(delay)
+
+    def fetch(self, url):
+        """Content of url."""
+        response = self.open(url)
+        try:
+            return response.read()
+        finally:
+            response.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+_default_fetcher = None
+
+def default_fetcher():
+    """Shared Fetcher with default settings."""
+    global _default_fetcher
+    if _default_fetcher is None:
+        _default_fetcher = Fetcher()
+    return _default_fetcher
@@ -0,0 +1,224 @@
+import os
+import random
+import re
+import sys
+import time
+from collections import OrderedDict
+from functools import partial
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+from urlparse import urlparse
+from history import History
+from parse import SignalData, read_data
+from spool import DEFAULT_INTERVAL, KEEP_AGE, Sample, Spool
+
+__all__ = (
+    'DEFAULT_WORKERS',
+    'load_fleet', 'host_name', 'empty_sample',
+    'fetch_all', 'parse_all', 'sample_all', 'sample_fleet', 'poll_fleet',
+)
+
+# Concurrent modem fetches
+DEFAULT_WORKERS = 8
+
+# Pages for each parser process by default, fewer are parsed in this
+# process (scanning a page takes well under a millisecond, far less than
+# starting a process)
+PAGES_PER_PROCESS = 32
+
+def load_fleet(spec):
+    """Modem urls from spec, a file (one url per line, # comments) or a
+    comma/whitespace separated list of urls."""
+    if os.path.isfile(spec):
+        with open(spec) as f:
+            lines = [line.split('#', 1)[0] for line in f]
+        spec = ' '.join(lines)
+    return [url for url in re.split(r'[\s,]+', spec) if url]
+
+def host_name(url):
+    """Munin safe name for url's host (used in multigraph names)."""
+    host = urlparse(url).hostname or url
+    return re.sub(r'[^A-Za-z0-9_]', '_', host)
+
+def empty_sample(timestamp=None):
+    """Sample with no data (munin 'U' values) for an unreachable modem."""
+    layout = {}
+    for table, info in SignalData.tables.items():
+        layout[table] = info.get('min_columns', 0)
+    return Sample.from_layout(layout, timestamp)
+
+def fetch(url, cache=None, fetcher=None):
+    """Content of url, None on failure."""
+    try:
+        return read_data(url, cache, fetcher)
+    except Exception as e:
+        print >> sys.stderr, "fetch of {} failed: {!r}".format(url, e)
+
+def stream_columns(url, cache=None, fetcher=None, soup=False, tables=None):
+    """Sample columns of url, parsed while reading (see
+    SignalData(stream=True)), None on failure.  tables: see
+    parse_columns()."""
+    try:
+        return Sample.scrape(url, tables=tables, soup=soup, stream=True,
+                             cache=cache, fetcher=fetcher).columns
+    except Exception as e:
+        print >> sys.stderr, "fetch of {} failed: {!r}".format(url, e)
+
+def fetch_all(urls, workers=DEFAULT_WORKERS, spread=0, cache=None,
+              fetcher=None, read=fetch):
+    """Fetch urls concurrently (at most workers at once).
+
+    Each fetch starts after a random delay up to spread seconds, so polls
+    don't all hit the network at once.  Delays are waited out here, a
+    fetch is only handed to a worker once it's due.  Returns page content
+    (None for failures) in the same order as urls.
+
+    read: called as read(url, cache, fetcher) for each url (default
+          fetch()), what it returns is returned.
+    """
+    pool = ThreadPool(max(1, min(workers, len(urls))))
+    try:
+        start = time.time()
+        offsets = sorted((random.uniform(0, spread) if spread else 0, i)
+                         for i in range(len(urls)))
+        results = [None] * len(urls)
+        for offset, i in offsets:
+            delay = start + offset - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            results[i] = pool.apply_async(read, (urls[i], cache, fetcher))
+        return [result.get() for result in results]
+    finally:
+        pool.close()
+
+def parse_columns(content, soup=False, tables=None):
+    """Parse page content into Sample columns (runs in a worker process).
+
+    soup: see SignalData.
+    tables: Names of the tables to extract (default all), the columns
+            only have those.
+    """
+    if content is None:
+        return None
+    try:
+        return Sample.scrape(content=content, tables=tables,
+                             soup=soup).columns
+    except Exception as e:
+        print >> sys.stderr, "parse failed: {!r}".format(e)
+
+def parse_processes(pages, processes=None):
+    """Parser processes for pages: processes (default the number of cpus,
+    for PAGES_PER_PROCESS pages each), at most one per page."""
+    if processes is None:
+        processes = min(cpu_count(), pages // PAGES_PER_PROCESS)
+    return min(processes, pages)
+
+def parse_all(contents, processes=None, pool=None, soup=False, tables=None):
+    """Parse contents into Sample columns, in a pool of processes.
+
+    processes: see parse_processes(), 1 parses in this process.
+    pool: a multiprocessing Pool to parse in (kept between calls) instead.
+    soup, tables: see parse_columns().
+    """
+    parse = partial(parse_columns, soup=soup, tables=tables)
+    if pool is not None:
+        return pool.map(parse, contents)
+    processes = parse_processes(len(contents), processes)
+    if processes <= 1:
+        return map(parse, contents)
+    pool = Pool(processes)
+    try:
+        return pool.map(parse, contents)
+    finally:
+        pool.close()
+        pool.join()
+
+def sample_all(urls, workers=DEFAULT_WORKERS, spread=0, cache=None,
+               processes=None, fetcher=None, pool=None, soup=False,
+               stream=False, tables=None):
+    """Fetch and parse every url, returns Samples (None for failures) in
+    the same order as urls.  processes, pool: see parse_all().
+
+    soup, stream: see SignalData, with stream pages are parsed while
+                  they're read, in the fetching threads (not in processes).
+    tables: Names of the tables to extract (default all), Samples only
+            have those.
+    """
+    timestamp = int(time.time())
+    if stream:
+        all_columns = fetch_all(urls, workers, spread, cache, fetcher,
+                                partial(stream_columns, soup=soup,
+                                        tables=tables))
+    else:
+        contents = fetch_all(urls, workers, spread, cache, fetcher)
+        all_columns = parse_all(contents, processes, pool, soup, tables)
+    samples = []
+    for columns in all_columns:
+        if columns is not None:
+            columns = Sample.from_by_columns(timestamp, columns)
+        samples.append(columns)
+    return samples
+
+def sample_fleet(urls, workers=DEFAULT_WORKERS, spread=0, cache=None,
+                 processes=None, fetcher=None, soup=False, stream=False,
+                 tables=None):
+    """Fetch and parse every url, returns {host_name: Sample}.
+
+    Modems that couldn't be fetched or parsed get an empty_sample().
+    tables: see sample_all().
+    """
+    samples = OrderedDict()
+    all_samples = sample_all(urls, workers, spread, cache, processes,
+                             fetcher, soup=soup, stream=stream,
+                             tables=tables)
+    for url, sample in zip(urls, all_samples):
+        samples[host_name(url)] = sample or empty_sample()
+    return samples
+
+def poll_fleet(urls, directory, interval=DEFAULT_INTERVAL, count=None,
+               workers=DEFAULT_WORKERS, processes=None, fetcher=None,
+               history=False, soup=False, stream=False):
+    """Poll every url each interval seconds, into a Spool per url (and a
+    History per url, with history).
+
+    Fetches are spread over the first half of each interval.  Pass a
+    fetcher to reuse (keep-alive) connections between polls.  Parser
+    processes (see parse_processes()) are started once, for every poll.
+    soup, stream: see sample_all().
+    """
+    spools = [Spool(directory, url) for url in urls]
+    histories = [None] * len(urls)
+    if history:
+        histories = [History(directory, url) for url in urls]
+    pool = None
+    processes = parse_processes(len(urls), processes)
+    if processes > 1 and not stream:
+        pool = Pool(processes)
+    polls = 0
+    trim_every = max(1, KEEP_AGE // interval // 10)
+    next_poll = time.time()
+    try:
+        while count is None or polls < count:
+            samples = sample_all(urls, workers, interval / 2.0,
+                                 processes=processes, fetcher=fetcher,
+                                 pool=pool, soup=soup, stream=stream)
+            for spool, history, sample in zip(spools, histories, samples):
+                if sample is not None:
+                    spool.append(sample)
+                    if history is not None:
+                        history.append(sample)
+            polls += 1
+            if polls % trim_every == 0:
+                for spool in spools:
+                    spool.trim()
+
+            next_poll += interval
+            delay = next_poll - time.time()
+            if delay > 0 and (count is None or polls < count):
+                time.sleep(delay)
+            elif delay <= 0:
+                next_poll = time.time() # Fell behind, don't burst
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
@@ -1,10 +1,15 @@
+import json
 import string
 from collections import OrderedDict
+from hashlib import sha1
+from cache import load_config, save_config
 from parse import *
 
 __all__ = (
-    'graphs',
-    'GraphPoint', 'config_graph', 'setup_graph_points',
+    'graphs', 'error_graphs', 'timing_graph',
+    'GraphPoint', 'config_graph', 'values_graph', 'setup_graph_points',
+    'multigraph_name', 'layout_config',
+    'GRAPH_NAMES', 'select_graphs', 'graph_tables',
 )
 
 # Used to label channels
@@ -117,6 +122,73 @@ graphs = [
     },
 ]
 
+# Computed over a daemon's History (see rates.ErrorRates), not a single page
+error_graphs = [
+    {
+        'graph': 'error_ratio',
+        'title': "Moto Surfboard Codeword Error Ratio",
+        'vlabel': 'errored / all codewords',
+        'category': 'network',
+        'points': [
+            ('ratio.pre_fec', OrderedDict([
+                ('label', 'Pre-FEC {id}'),
+                ('info', 'Correctable and uncorrectable codewords'),
+            ])),
+            ('ratio.post_fec', OrderedDict([
+                ('label', 'Post-FEC {id}'),
+                ('info', 'Uncorrectable codewords'),
+            ])),
+        ],
+    },
+    {
+        'graph': 'error_rate',
+        'title': "Moto Surfboard Codeword Error Rate",
+        'vlabel': 'codewords / second',
+        'category': 'network',
+        'points': [
+            ('rate.correctable', OrderedDict([
+                ('label', 'Correctable Errors {id}'),
+                ('info', 'Counter resets (modem reboots) are not spikes'),
+            ])),
+            ('rate.uncorrectable', OrderedDict([
+                ('label', 'Uncorrectable Errors {id}'),
+            ])),
+        ],
+    },
+]
+
+# The plugin's own hot path (see timing.Timings), not part of graphs as it's
+# not from the modem's page
+timing_graph = {
+    'graph': 'plugin_timing',
+    'title': "Moto Surfboard Plugin Timing",
+    'vlabel': 'seconds',
+    'category': 'network',
+    'points': [
+        ('plugin.fetch', OrderedDict([
+            ('label', 'Fetch'),
+            ('info', 'Reading the page (from the modem, cache or a file)'),
+        ])),
+        ('plugin.parse', OrderedDict([
+            ('label', 'Parse'),
+            ('info', "Scanning the page for the tables' fields (or parsing"
+                     ' it with lxml when the scan falls back)'),
+        ])),
+        ('plugin.extract', OrderedDict([
+            ('label', 'Extract'),
+            ('info', "Building the sample from the tables' fields"),
+        ])),
+        ('plugin.render', OrderedDict([
+            ('label', 'Render'),
+            ('info', 'Rendering the other graphs'),
+        ])),
+        ('plugin.bytes', OrderedDict([
+            ('label', 'Bytes received'),
+            ('graph', 'no'), # Not seconds, for alerts (e.g. `critical 1:`)
+        ])),
+    ],
+}
+
 class GraphPoint(object):
     """GraphPoint object, can be used to generate configs or values"""
     def __init__(self, table, point, id, extra, value=None):
@@ -149,10 +221,29 @@ class GraphPoint(object):
             return 'U' # Munin code for unavailable
         return self._value
 
-    def value_line(self):
+    def value_line(self, timestamp=None):
+        if timestamp is not None:
+            return "{self.source}.value {}:{self.value}".format(timestamp,
+                                                                self=self)
         return "{self.source}.value {self.value}".format(self=self)
 
 
+# Every graph's name, e.g. 'snr_power' (a surfboard_snr_power plugin)
+GRAPH_NAMES = tuple(graph['graph']
+                    for graph in graphs + error_graphs + [timing_graph])
+
+def select_graphs(all_graphs, names=None):
+    """Graphs of all_graphs named in names (all of them if None)."""
+    if names is None:
+        return all_graphs
+    return [graph for graph in all_graphs if graph['graph'] in names]
+
+def graph_tables(graphs):
+    """Tables graphs' points come from, e.g. ['down', 'stats']."""
+    return sorted(set(point.split('.')[0]
+                      for graph in graphs
+                      for point, p_info in graph.get('points', [])))
+
 def setup_graph_points(data, graph):
     points = []
     for point, p_info in graph.get('points', []):
@@ -165,15 +256,33 @@ def setup_graph_points(data, graph):
             points.append(point)
     return points
 
-def config_graph(data, graph):
+def multigraph_name(graph, host=None):
+    """surfboard_<graph>, or surfboard_<host>_<graph> (for fleets)"""
+    if host is not None:
+        return "surfboard_{}_{}".format(host, graph.get('graph'))
+    return "surfboard_{}".format(graph.get('graph'))
+
+def config_graph(data, graph, host=None, update_rate=None):
+    """Config of graph for data's channels.
+
+    update_rate: seconds between samples, for values from a daemon's spool
+                 (munin keeps them at that resolution, see SPOOLED_DATA_SIZE),
+                 None for munin's own 300.
+    """
     config = []
     for key in 'graph', 'title', 'category', 'vlabel':
         val = graph.get(key)
         if val is not None:
             if key == 'graph':
-                config.append("multigraph surfboard_{}".format(val))
+                config.append("multigraph {}".format(
+                    multigraph_name(graph, host)))
+            elif key == 'title' and host is not None:
+                config.append("graph_{} {} ({})".format(key, val, host))
             else:
                 config.append("graph_{} {}".format(key, val))
+    if update_rate is not None:
+        config.append("update_rate {}".format(update_rate))
+        config.append("graph_data_size {}".format(SPOOLED_DATA_SIZE))
 
     p_config, order = [], ['graph_order']
     for point in setup_graph_points(data, graph):
@@ -185,3 +294,74 @@ def config_graph(data, graph):
 
     config.extend(p_config)
     return '\n'.join(config)
+
+def values_graph(datas, graph, host=None):
+    """Values for datas (SignalData or spooled Samples)
+
+    Samples are output with their timestamp (`field.value epoch:value`).
+    """
+    values = ["multigraph {}".format(multigraph_name(graph, host))]
+    for data in datas:
+        timestamp = getattr(data, 'timestamp', None)
+        for point in setup_graph_points(data, graph):
+            values.append(point.value_line(timestamp))
+    return '\n'.join(values)
+
+class Layout(object):
+    """Stands in for SignalData when only the channel layout matters
+    (config): *_by_column() gives empty columns."""
+    def __init__(self, layout):
+        self.layout = layout
+
+    def __getattr__(self, name):
+        table = name[:-len('_by_column')]
+        if not name.endswith('_by_column') or table not in self.layout:
+            raise AttributeError(name)
+        return lambda: [{} for i in range(self.layout[table])]
+
+# RRD archives for spooled values (see config_graph()): every sample for a
+# day, then consolidated much like munin's default ("normal") graph_data_size
+SPOOLED_DATA_SIZE = 'custom 1d, 5m for 1w, 30m for 1t, 1d for 1y'
+
+# Bump when config_graph() or GraphPoint.config() output changes, configs
+# saved by layout_config() (in $MUNIN_PLUGSTATE) aren't reused after
+CONFIG_VERSION = 1
+
+# Rendered configs, by layout_key()
+_configs = {}
+_graphs_digest = None
+
+def layout_key(layout, host=None, selected=graphs, update_rate=None):
+    """Everything config output depends on: the layout, host, graphs,
+    update rate and how they're rendered (CONFIG_VERSION)."""
+    global _graphs_digest
+    if _graphs_digest is None:
+        _graphs_digest = sha1(repr(graphs)).hexdigest()
+    key = [CONFIG_VERSION, sorted(layout.items()), host, _graphs_digest]
+    if selected is not graphs:
+        key.append([graph['graph'] for graph in selected])
+    if update_rate is not None:
+        key.append(['update_rate', update_rate])
+    return json.dumps(key)
+
+def layout_config(layout, host=None, directory=None, selected=graphs,
+                  update_rate=None):
+    """Config of every graph in selected (default all of graphs) for a
+    channel layout ({table: columns}, only selected's tables matter).
+    update_rate: see config_graph().
+
+    Only rendered the first time a layout is seen, then reused (for the
+    process, and between runs via directory if given).
+    """
+    key = layout_key(layout, host, selected, update_rate)
+    config = _configs.get(key)
+    if config is None and directory is not None:
+        config = load_config(directory, key)
+    if config is None:
+        data = Layout(layout)
+        config = '\n\n'.join(config_graph(data, graph, host, update_rate)
+                              for graph in selected)
+        if directory is not None:
+            save_config(directory, key, config)
+    _configs[key] = config
+    return config
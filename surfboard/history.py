@@ -0,0 +1,179 @@
+import mmap
+import os
+import struct
+from array import array
+from hashlib import sha1
+from cache import atomic_write
+from graph import GRAPH_IDS
+
+__all__ = (
+    'DEFAULT_SLOTS', 'MAX_CHANNELS', 'SERIES', 'History',
+)
+
+# Samples kept, a day of daemon polls every 20 seconds
+DEFAULT_SLOTS = 4320
+
+# Channels kept per table (the SB6121 bonds 4 down and 4 up)
+MAX_CHANNELS = 8
+
+# (table, field) kept for every channel
+SERIES = (
+    ('down', 'channel'), ('down', 'freq'), ('down', 'snr'), ('down', 'power'),
+    ('up', 'channel'), ('up', 'freq'), ('up', 'power'),
+    ('stats', 'channel'), ('stats', 'unerrored'), ('stats', 'correctable'),
+    ('stats', 'uncorrectable'),
+)
+
+HISTORY_PREFIX = 'surfboard-history-'
+
+MAGIC = 'SBHIST01'
+# magic, slots, channels, series, samples appended (ever)
+HEADER = struct.Struct('<8sIIIQ')
+COUNT_OFFSET = 20
+HEADER_SIZE = 64 # Leaves room, keeps the arrays aligned
+VALUE = struct.Struct('<d')
+
+NAN = float('nan')
+
+class History(object):
+    """Fixed size, memory mapped ring buffer of samples for one modem.
+
+    Every (table, field) in SERIES is kept for up to `channels` channels,
+    as float64 (NaN for missing values).  Each channel's values are one
+    contiguous ring of `slots` samples, next to a ring of timestamps:
+
+        header | timestamps[slot] | series[series][channel][slot]
+
+    append() is O(1) (a write per value, then the sample count), reads
+    come straight from the map, no parsing.  Meant for a single writer
+    (the daemon) and any number of readers.
+    """
+    def __init__(self, directory, source, slots=DEFAULT_SLOTS,
+                 channels=MAX_CHANNELS, create=True):
+        """create: create a missing history (otherwise IOError)."""
+        self.directory = directory
+        self.source = source
+        self.path = os.path.join(directory,
+                                 HISTORY_PREFIX + sha1(source).hexdigest())
+        self.slots = slots
+        self.channels = channels
+        self.index = dict((series, i) for i, series in enumerate(SERIES))
+        self.size = HEADER_SIZE + VALUE.size * slots * (
+            1 + len(SERIES) * channels)
+        if not os.path.exists(self.path):
+            if not create:
+                raise IOError("no history of {} in {}".format(source,
+                                                              directory))
+            header = HEADER.pack(MAGIC, slots, channels, len(SERIES), 0)
+            header = header.ljust(HEADER_SIZE, '\0')
+            atomic_write(self.path, header.ljust(self.size, '\0'))
+        with open(self.path, 'r+b') as f:
+            self.map = mmap.mmap(f.fileno(), self.size)
+        magic, file_slots, file_channels, series, count = \
+            HEADER.unpack_from(self.map)
+        if (magic, file_slots, file_channels, series) != (
+                MAGIC, slots, channels, len(SERIES)):
+            self.close()
+            raise ValueError("{} isn't a history of {} slots x {} channels"
+                             .format(self.path, slots, channels))
+
+    def __repr__(self):
+        return ('History(directory={self.directory!r}'
+                ', source={self.source!r}'
+                ', slots={self.slots!r})').format(self=self)
+
+    def close(self):
+        self.map.close()
+
+    @property
+    def count(self):
+        """Samples ever appended."""
+        return struct.unpack_from('<Q', self.map, COUNT_OFFSET)[0]
+
+    def __len__(self):
+        return min(self.count, self.slots)
+
+    def _offset(self, table, field, channel):
+        series = self.index[table, field]
+        ring = 1 + series * self.channels + channel
+        return HEADER_SIZE + VALUE.size * self.slots * ring
+
+    def append(self, sample):
+        """Add sample (Sample, or anything with *_by_column() and a
+        timestamp), overwriting the oldest once full."""
+        count = self.count
+        slot = count % self.slots
+        position = VALUE.size * slot
+        VALUE.pack_into(self.map, HEADER_SIZE + position, sample.timestamp)
+        columns = dict((table, getattr(sample, '{}_by_column'.format(table))())
+                       for table in set(table for table, field in SERIES))
+        for table, field in SERIES:
+            table_columns = columns[table]
+            for channel in range(self.channels):
+                value = None
+                if channel < len(table_columns):
+                    value = table_columns[channel].get(field)
+                VALUE.pack_into(self.map,
+                                self._offset(table, field, channel) + position,
+                                NAN if value is None else value)
+        # Readers only see the sample once it's complete
+        struct.pack_into('<Q', self.map, COUNT_OFFSET, count + 1)
+
+    def _ring(self, base, n, count=None):
+        """Last n values of the ring at base, oldest first."""
+        if count is None:
+            count = self.count
+        n = min(n, count, self.slots)
+        end = count % self.slots or (self.slots if count else 0)
+        start = end - n
+        values = array('d')
+        if start < 0:
+            values.extend(struct.unpack_from(
+                '<{}d'.format(-start), self.map,
+                base + VALUE.size * (self.slots + start)))
+            start = 0
+        values.extend(struct.unpack_from(
+            '<{}d'.format(end - start), self.map, base + VALUE.size * start))
+        return values
+
+    def timestamps(self, n=None):
+        """Timestamps of the last n (default all) samples, oldest first."""
+        return self._ring(HEADER_SIZE, self.slots if n is None else n)
+
+    def series(self, table, field, channel, n=None):
+        """array('d') of the last n (default all) values of a channel's
+        field (channel is 0 based, column A), oldest first."""
+        if not 0 <= channel < self.channels:
+            raise IndexError("channel {} not kept".format(channel))
+        return self._ring(self._offset(table, field, channel),
+                          self.slots if n is None else n)
+
+    def window(self, table, field, since=None, n=None):
+        """(timestamps, {id: values}) of samples newer than since (or the
+        last n), for every channel with values in the window."""
+        timestamps, (channels, ) = self.windows(table, [field], since, n)
+        return timestamps, channels
+
+    def windows(self, table, fields, since=None, n=None):
+        """Like window(), for several fields of the same samples:
+        (timestamps, [{id: values} per field])."""
+        count = self.count # Same samples for every ring, even mid append()
+        timestamps = self._ring(HEADER_SIZE, self.slots if n is None else n,
+                                count)
+        if since is not None:
+            skip = len(timestamps)
+            for i, timestamp in enumerate(timestamps):
+                if timestamp > since:
+                    skip = i
+                    break
+            timestamps = timestamps[skip:]
+        windows = []
+        for field in fields:
+            channels = {}
+            for channel in range(self.channels):
+                values = self._ring(self._offset(table, field, channel),
+                                    len(timestamps), count)
+                if any(value == value for value in values): # Not all NaN
+                    channels[GRAPH_IDS[channel]] = values
+            windows.append(channels)
+        return timestamps, windows
@@ -1,14 +1,20 @@
-from bs4 import BeautifulSoup
-from decimal import Decimal
-from lxml import html as lxhtml
-from urllib import urlopen
+from functools import partial
+from string import ascii_lowercase, ascii_uppercase
+
+# lxml, bs4 and decimal are slow to import, they're imported where used so
+# runs that never parse (config from a known layout, spooled samples) don't
+# pay for them
 
 __all__ = (
     'pluralize',
     'strip_lower', 'zip_and_dict',
-    'convert_text', 'intify_text', 'contains',
+    'convert_text', 'intify_text', 'decimal', 'contains',
+    'XPaths', 'xpaths',
     'get_table', 'table_getter', 'get_row', 'row_getter',
-    'get_fields', 'field_getter', 'column_getter', 'load_data',
+    'get_fields', 'field_getter', 'column_getter',
+    'open_data', 'read_data', 'load_data', 'parse_html',
+    'first_text', 'extract_tables', 'stream_tables',
+    'dump_fields', 'load_fields',
     'SignalData',
 )
 
@@ -66,78 +72,436 @@ def intify_text(elems, split=None):
     """Wrapper for convert_text with int() as conversion function."""
     return convert_text(elems, int, split)
 
-def contains(text):
-    """Generate an xpath contains() for text."""
-    return 'contains(text(), "{}")'.format(text)
+def decimal(text):
+    """Convert text to a Decimal."""
+    from decimal import Decimal
+    return Decimal(text)
+
+def contains(text, variable=False):
+    """Generate a case insensitive xpath contains() for (lower case) text.
+
+    variable: text is the name of an xpath variable, not literal text.
+    """
+    text = '${}'.format(text) if variable else '"{}"'.format(text)
+    return 'contains(translate(text(), "{}", "{}"), {})'.format(
+        ascii_uppercase, ascii_lowercase, text)
+
+class XPaths(object):
+    """Compiled xpaths for every table and row header lookup in tables.
+
+    Header text is an xpath variable, so each expression is compiled
+    once instead of being formatted (and parsed by lxml) on every call.
+    """
+    def __init__(self, tables):
+        from lxml import etree
+        self.table_header = etree.XPath(
+            '//table//*[{}]'.format(contains('header', variable=True)))
+        self.row_header = etree.XPath(
+            './tbody/tr/td[{}]'.format(contains('header', variable=True)))
+        self.ancestor_tables = etree.XPath('./ancestor::table')
+        self.cells = etree.XPath('./td')
+
+        self.tables, self.rows = {}, {}
+        for info in tables.values():
+            header = info['header']
+            self.tables[header] = partial(self.table_header, header=header)
+            for row in info.get('rows', []):
+                self.rows[row[1]] = partial(self.row_header, header=row[1])
+
+    def table(self, header):
+        """Lookup for elements (in any table) containing header."""
+        lookup = self.tables.get(header)
+        if lookup is None:
+            lookup = partial(self.table_header, header=header)
+        return lookup
+
+    def row(self, header):
+        """Lookup for a table's row header cells containing header."""
+        lookup = self.rows.get(header)
+        if lookup is None:
+            lookup = partial(self.row_header, header=header)
+        return lookup
+
+_xpaths = None
+
+def xpaths():
+    """XPaths for SignalData.tables, compiled on first use (lxml is a slow
+    import, runs that don't parse shouldn't pay for it)."""
+    global _xpaths
+    if _xpaths is None:
+        _xpaths = XPaths(SignalData.tables)
+    return _xpaths
 
 def get_table(lxml, header):
     """Get a table via header text."""
-    headers = lxml.xpath('//table//*[{}]'.format(contains(header)))
+    registry = xpaths()
+    headers = registry.table(header)(lxml)
     if headers:
-        tables = headers[0].xpath('./ancestor::table')
+        tables = registry.ancestor_tables(headers[0])
         if tables:
             # Return "closest" table
             return tables[-1]
 
-def table_getter(header):
+def table_getter(table):
     def func(self):
-        return get_table(self.lxml, header)
+        return self.elements[table]['table']
     return func
 
 def get_row(table, header):
     """Get a row via it's header text."""
     if table is not None:
-        xpath = './tbody/tr/td[{}]'.format(contains(header))
-        tds = table.xpath(xpath)
+        tds = xpaths().row(header)(table)
         if tds:
             return tds[0].getparent()
 
-def row_getter(table, header):
+def row_getter(table, name):
     def func(self):
-        return get_row(get_table(self.lxml, table), header)
+        rows = self.elements[table]['rows']
+        if rows is not None:
+            return rows.get(name)
     return func
 
 def get_fields(table, header, split=None, convert=None):
     """Get a fields for a row specified by their header text."""
     row = get_row(table, header)
     if row is not None:
-        tds = row.xpath('./td')[1:]
+        tds = xpaths().cells(row)[1:]
         if convert is not None:
             return convert_text(tds, convert, split)
         else:
             return intify_text(tds, split)
 
-def field_getter(table, header, split=None, convert=None):
+def field_getter(table, name):
     def func(self):
-        t = get_table(self.lxml, table)
-        return get_fields(t, header, split, convert)
+        fields = self.extracted[table]['fields']
+        if fields is not None and fields.get(name) is not None:
+            # Copy, callers used to get a fresh list on every call
+            return list(fields[name])
     return func
 
 def column_getter(table, fields, min_columns=0):
     def func(self):
-        columns = []
-        for field in fields:
-            method = '_'.join((table, field))
-            method = pluralize(method)
-            columns.append(getattr(self, method)())
-        columns = zip_and_dict(columns, fields)
-        for i in range(len(columns), min_columns):
-            columns.append({})
-        return columns
+        columns = self._columns.get(table)
+        if columns is None:
+            columns = []
+            for field in fields:
+                method = '_'.join((table, field))
+                method = pluralize(method)
+                columns.append(getattr(self, method)())
+            columns = zip_and_dict(columns, fields)
+            for i in range(len(columns), min_columns):
+                columns.append({})
+            self._columns[table] = columns
+        # Copies, callers used to get fresh dicts on every call
+        return [dict(column) for column in columns]
     return func
 
-def load_data(source, parser='lxml'):
+def first_text(elem):
+    """Get elem's first text node, the one xpath's contains(text(), ...) sees."""
+    if elem.text is not None:
+        return elem.text
+    for child in elem:
+        if child.tail is not None:
+            return child.tail
+
+def extract_tables(root, tables):
+    """Extract every table in tables (see SignalData.tables) in one walk.
+
+    Matches the semantics of get_table()/get_row()/get_fields(): the first
+    element (in document order) inside a table containing the header text
+    picks its closest table, and the first direct row cell containing a
+    row header picks that row.
+
+    Returns a dict keyed like tables:
+      {'down': {'table': <table>, 'rows': {'channel': <tr>, ...},
+                'fields': {'channel': [144, ...], ...}}, ...}
+    Missing tables have None for 'table', 'rows' and 'fields'.
+    """
+    pending = dict((name, info['header']) for name, info in tables.items())
+    found = {}
+    cells = {} # table element -> candidate row header cells, in order
+    for elem in root.iter():
+        tag = elem.tag
+        if not isinstance(tag, basestring):
+            continue # Comments, processing instructions
+        if tag == 'td':
+            # Only ./tbody/tr/td cells of a table, same as get_row()
+            tr = elem.getparent()
+            tbody = tr.getparent()
+            table = tbody.getparent() if tbody is not None else None
+            if (tr.tag == 'tr' and tbody.tag == 'tbody'
+                    and table is not None and table.tag == 'table'):
+                cells.setdefault(table, []).append(elem)
+        if pending:
+            text = first_text(elem)
+            if not text:
+                continue
+            text = text.lower()
+            for name, header in pending.items():
+                if header in text:
+                    table = next(elem.iterancestors('table'), None)
+                    if table is None:
+                        break # Not inside any table, can't match others
+                    found[name] = table
+                    del pending[name]
+
+    extracted = {}
+    for name, info in tables.items():
+        table = found.get(name)
+        if table is None:
+            extracted[name] = {'table': None, 'rows': None, 'fields': None}
+            continue
+        rows, fields = {}, {}
+        table_cells = cells.get(table, [])
+        for row in info.get('rows', []):
+            row_name, row_header, sep, convert = (row + (None, None))[:4]
+            tr = None
+            for td in table_cells:
+                text = first_text(td)
+                if text is not None and row_header in text.lower():
+                    tr = td.getparent()
+                    break
+            rows[row_name] = tr
+            if tr is None:
+                fields[row_name] = None
+                continue
+            tds = [td for td in tr if td.tag == 'td'][1:]
+            fields[row_name] = convert_text(tds, convert or int, sep)
+        extracted[name] = {'table': table, 'rows': rows, 'fields': fields}
+    return extracted
+
+# Bytes fed to the incremental parser at a time by stream_tables()
+CHUNK_SIZE = 1024
+
+def open_data(source, cache=None, fetcher=None):
+    """Open a url or file path for reading.
+
+    cache: PageCache (or SingleFlight), urls are read from (or stored in)
+           cache when given.
+    fetcher: Fetcher for urls, default_fetcher() if not given.
+    """
     if hasattr(source, 'startswith') and source.startswith('http'):
-        content = urlopen(source)
-    else:
-        content = open(source)
-    return BeautifulSoup(content.read(), parser)
+        if fetcher is None:
+            from fetch import default_fetcher
+            fetcher = default_fetcher()
+        if cache is not None:
+            return cache.open(source, partial(fetcher.open, source))
+        return fetcher.open(source)
+    return open(source)
+
+def read_data(source, cache=None, fetcher=None):
+    """Read raw page content from a url or file path."""
+    content = open_data(source, cache, fetcher)
+    try:
+        return content.read()
+    finally:
+        content.close()
+
+def load_data(source, parser='lxml', cache=None, fetcher=None):
+    """Load source with BeautifulSoup, (slow) fallback for broken markup."""
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(read_data(source, cache, fetcher), parser)
+
+def parse_html(content):
+    """Parse raw page content directly with lxml."""
+    from lxml import html
+    return html.fromstring(content)
+
+class CountingReader(object):
+    """Wrap a file like object, counting the bytes read from it."""
+    def __init__(self, content):
+        self.content = content
+        self.count = 0
+
+    def read(self, size=-1):
+        chunk = self.content.read(size)
+        self.count += len(chunk)
+        return chunk
+
+    def finish(self):
+        finish = getattr(self.content, 'finish', None)
+        if finish is not None:
+            finish()
+
+    def close(self):
+        self.content.close()
+
+def stream_tables(content, tables, chunk_size=CHUNK_SIZE):
+    """Incrementally parse content (file like), extracting tables as they close.
+
+    Reading stops as soon as every table in tables has been found, the
+    rest of the page is never read.  Returns (root, extracted), see
+    extract_tables() for extracted.  root only holds the page read so far.
+    """
+    from lxml import etree
+    parser = etree.HTMLPullParser(events=('end',), tag='table')
+    pending = dict(tables)
+    extracted = {}
+    for chunk in iter(partial(content.read, chunk_size), ''):
+        parser.feed(chunk)
+        for _, table in parser.read_events():
+            if next(table.iterancestors('table'), None) is not None:
+                # Wait for the outermost table, headers are matched in
+                # document order through all it's nested tables
+                continue
+            for name, info in extract_tables(table, pending).items():
+                if info['table'] is not None:
+                    extracted[name] = info
+                    del pending[name]
+        if not pending:
+            finish = getattr(content, 'finish', None)
+            if finish is not None:
+                finish() # The rest isn't needed (see CachingReader)
+            break
+    root = parser.close()
+
+    for name in pending:
+        extracted[name] = {'table': None, 'rows': None, 'fields': None}
+    return root, extracted
+
+def dump_fields(extracted):
+    """JSON of extracted tables' fields (see SignalData.extracted)."""
+    import json
+    return json.dumps(dict((name, {'fields': table['fields']})
+                           for name, table in extracted.items()),
+                      sort_keys=True, default=str)
+
+def load_fields(text):
+    """Extracted tables' fields from dump_fields() JSON."""
+    import json
+    extracted = json.loads(text)
+    # Decimals were dumped as str(), and strings load as unicode
+    for name, table in extracted.items():
+        fields = table['fields']
+        if fields is None:
+            continue
+        for row in SignalData.tables[name].get('rows', []):
+            row_name, convert = row[0], (row + (None, None))[3]
+            if convert is None or fields.get(row_name) is None:
+                continue
+            fields[row_name] = [None if value is None else convert(value)
+                                for value in fields[row_name]]
+    return extracted
 
 class SignalData(object):
-    def __init__(self, html):
-        self.soup = load_data(html)
-        #self.soup = load_data(html, "lxml")
-        self.lxml = lxhtml.fromstring(str(self.soup).lower())
+    def __init__(self, html=None, soup=False, stream=False, cache=None,
+                 content=None, fetcher=None, fast=True, results=None,
+                 extract=None):
+        """Parse html (url or file path) with lxml.
+
+        soup: Parse with BeautifulSoup first, then re-parse it's output with
+              lxml. Twice the work, only useful if lxml chokes on the markup.
+        stream: Parse while reading, and stop reading once every table has
+                been extracted.
+        cache: PageCache (or SingleFlight) to share scraped pages between
+               invocations.
+        content: Already read page, parsed instead of reading html.
+        fetcher: Fetcher used for urls (timeouts, retries, keep-alive).
+        fast: Scan the raw page for the tables' fields (see scan.py), only
+              parsing it with lxml if that fails or elements are asked for.
+        results: ResultCache of extracted tables, a page seen before (same
+                 content) isn't parsed or extracted again.
+        extract: Names of the tables to extract (default all of tables),
+                 the others' getters raise KeyError.
+
+        read_bytes: bytes of the page this read (with stream, only up to
+                    the last table), None if it was given or soup loaded.
+        """
+        self.soup = None
+        self.fast = fast
+        self._content = None # Raw page, parsed on first use of lxml
+        self._lxml = None
+        self.results = results
+        self._extracted = None
+        self._elements = None
+        self._columns = {} # table -> *_by_column(), see column_getter()
+        self.read_bytes = None
+        self.wanted = self.tables
+        if extract is not None:
+            self.wanted = dict((name, self.tables[name]) for name in extract)
+        if content is not None:
+            if soup:
+                from bs4 import BeautifulSoup
+                self.soup = BeautifulSoup(content, 'lxml')
+                self._lxml = parse_html(str(self.soup))
+            else:
+                self._content = content
+        elif soup:
+            self.soup = load_data(html, cache=cache, fetcher=fetcher)
+            self._lxml = parse_html(str(self.soup))
+        elif stream:
+            content = CountingReader(open_data(html, cache, fetcher))
+            try:
+                self._lxml, self._elements = stream_tables(content,
+                                                           self.wanted)
+            finally:
+                content.close()
+            self.read_bytes = content.count
+            self._extracted = self._elements
+        else:
+            self._content = read_data(html, cache, fetcher)
+            self.read_bytes = len(self._content)
+
+    def snapshot(self, timestamp=None):
+        """Immutable, compact Snapshot of every table (see snapshot.py)."""
+        from snapshot import Snapshot
+        return Snapshot.from_data(self, timestamp)
+
+    def invalidate(self):
+        """Forget everything extracted, it's extracted again on next use."""
+        self._extracted = None
+        self._elements = None
+        self._columns = {}
+
+    def refresh(self, content):
+        """Replace the page with content (a later scrape of it)."""
+        self.soup = None
+        self._content = content
+        self._lxml = None
+        self.invalidate()
+
+    @property
+    def lxml(self):
+        if self._lxml is None:
+            self._lxml = parse_html(self._content)
+        return self._lxml
+
+    @property
+    def elements(self):
+        """All tables (elements and fields), extracted from lxml in a single
+        pass on first use."""
+        if self._elements is None:
+            self._elements = extract_tables(self.lxml, self.wanted)
+        return self._elements
+
+    @property
+    def extracted(self):
+        """All tables' fields: from results, scanned from the raw page
+        when possible, else the same as elements."""
+        if self._extracted is None:
+            key = None
+            if self.results is not None and self._content is not None:
+                key = self.results.key(self._content)
+                if self.wanted is not self.tables:
+                    key = '-'.join([key] + sorted(self.wanted))
+                self._extracted = self.results.get(key)
+                if self._extracted is not None:
+                    return self._extracted
+            if self.fast and self._content is not None:
+                from scan import ScanError, scan_tables
+                try:
+                    self._extracted = scan_tables(self._content,
+                                                  self.wanted)
+                except ScanError:
+                    pass # Not the usual layout, lxml will know
+            if self._extracted is None:
+                self._extracted = self.elements
+            if key is not None:
+                # Only the fields, elements belong to this page's tree
+                self.results.put(key, dict(
+                    (name, {'fields': table['fields']})
+                    for name, table in self._extracted.items()))
+        return self._extracted
 
     # This is used to setup class methods in setup_signal_data()
     tables = {
@@ -158,7 +522,7 @@ class SignalData(object):
                 ('channel', 'channel'),
                 ('freq', 'frequency', ' '),
                 ('service_id', 'service id'),
-                ('rate', 'symbol rate', ' ', Decimal),
+                ('rate', 'symbol rate', ' ', decimal),
                 ('power', 'power level', ' '),
                 ('status', 'ranging status', None, str),
             ],
@@ -184,16 +548,14 @@ def setup_signal_data():
     """
     cls = SignalData
     for table, info in cls.tables.items():
-        table_header = info['header']
-        setattr(cls, '{}_table'.format(table), table_getter(table_header))
+        setattr(cls, '{}_table'.format(table), table_getter(table))
 
         rows = info.get('rows', [])
         for row in rows:
-            name, row_header, sep, convert = (row + (None, None))[:4]
-            args = table_header, row_header, sep, convert
+            name = row[0]
             full_name = '_'.join((table, name))
-            setattr(cls, '{}_row'.format(full_name), row_getter(*args[:2]))
-            setattr(cls, pluralize(full_name), field_getter(*args))
+            setattr(cls, '{}_row'.format(full_name), row_getter(table, name))
+            setattr(cls, pluralize(full_name), field_getter(table, name))
 
         min_columns = info.get('min_columns', 0)
         setattr(cls, '{}_by_column'.format(table),
@@ -0,0 +1,112 @@
+from array import array
+from graph import GRAPH_IDS
+from parse import SignalData
+
+__all__ = (
+    'WINDOW', 'deltas', 'intervals', 'totals',
+    'ErrorRates', 'error_rates',
+)
+
+# Seconds of history rates are computed over (munin's polling interval)
+WINDOW = 300
+
+COUNTERS = 'unerrored', 'correctable', 'uncorrectable'
+
+NAN = float('nan')
+
+def deltas(values):
+    """Differences between consecutive counter values (array('d')).
+
+    A counter that went down was reset (the modem rebooted), it counted
+    up from 0 since: the delta is the new value, not a negative spike.
+    NaN (missing values) stay NaN.
+    """
+    result = array('d')
+    previous = NAN
+    for value in values:
+        delta = value - previous
+        if delta < 0:
+            delta = value
+        result.append(delta)
+        previous = value
+    del result[:1]
+    return result
+
+def intervals(timestamps):
+    """Seconds between consecutive timestamps (array('d'))."""
+    return array('d', (b - a for a, b in zip(timestamps, timestamps[1:])))
+
+def totals(arrays, mask=None):
+    """Sum of each array in arrays, skipping NaN (and positions where
+    mask, an array of the same length, is NaN)."""
+    if mask is None:
+        return [sum(value for value in values if value == value)
+                for values in arrays]
+    return [sum(value for value, valid in zip(values, mask)
+                if value == value and valid == valid)
+            for values in arrays]
+
+def ratio(numerator, denominator):
+    if not denominator:
+        return None
+    return numerator / denominator
+
+class ErrorRates(object):
+    """Codeword error ratios and rates of one modem's stats channels.
+
+    ratio_by_column(): pre_fec (correctable + uncorrectable) and post_fec
+    (uncorrectable) errors over all codewords.  rate_by_column():
+    correctable and uncorrectable codewords per second.  Used like
+    SignalData's *_by_column() by the error graphs.
+    """
+    def __init__(self, ratios, rates):
+        self.ratios = ratios
+        self.rates = rates
+
+    def __repr__(self):
+        return 'ErrorRates(channels={})'.format(len(self.ratios))
+
+    def ratio_by_column(self):
+        return [dict(column) for column in self.ratios]
+
+    def rate_by_column(self):
+        return [dict(column) for column in self.rates]
+
+def error_rates(histories, since=None, n=None):
+    """ErrorRates of each History (same order) over samples newer than
+    since (or the last n).
+
+    Channels are padded to the stats table's min_columns, like
+    stats_by_column().  Plain Python loops over array('d'), about a
+    millisecond per modem for a 5 minute window (see benchmarks/rates.py).
+    """
+    min_columns = SignalData.tables['stats'].get('min_columns', 0)
+    results = []
+    for history in histories:
+        timestamps, windows = history.windows('stats', COUNTERS, since, n)
+        seconds = intervals(timestamps)
+        ids = set().union(*windows)
+        count = max([GRAPH_IDS.index(id) + 1 for id in ids] or [0])
+        ratios, rates = [], []
+        for id in GRAPH_IDS[:count]:
+            counters = [deltas(window.get(id, array('d')))
+                        for window in windows]
+            # Only intervals where every counter has a value
+            mask = array('d', (NAN if any(value != value for value in values)
+                               else 0 for values in zip(*counters)))
+            unerrored, correctable, uncorrectable = totals(counters, mask)
+            elapsed, = totals([seconds], mask)
+            codewords = unerrored + correctable + uncorrectable
+            ratios.append({
+                'pre_fec': ratio(correctable + uncorrectable, codewords),
+                'post_fec': ratio(uncorrectable, codewords),
+            })
+            rates.append({
+                'correctable': ratio(correctable, elapsed),
+                'uncorrectable': ratio(uncorrectable, elapsed),
+            })
+        padding = max(0, min_columns - len(ratios))
+        ratios.extend({} for i in range(padding))
+        rates.extend({} for i in range(padding))
+        results.append(ErrorRates(ratios, rates))
+    return results
@@ -0,0 +1,160 @@
+import csv
+import json
+import os
+import re
+import sys
+from glob import glob
+from itertools import izip
+from multiprocessing import Pool, cpu_count
+from cache import atomic_write
+from graph import GRAPH_IDS
+from parse import SignalData, read_data
+
+__all__ = (
+    'FORMATS', 'CHECKPOINT_EVERY',
+    'captures', 'replay_columns', 'replay_rows', 'replay',
+)
+
+FORMATS = 'csv', 'jsonl'
+
+# Captures between checkpoints (a resumed replay redoes at most this many)
+CHECKPOINT_EVERY = 100
+
+# Captures handed to a worker process at once
+CHUNK_SIZE = 16
+
+# CSV columns, every table's fields (first seen order)
+HEADER = ['source', 'timestamp', 'table', 'id']
+for table, info in SignalData.tables.items():
+    for row in info.get('rows', []):
+        if row[0] not in HEADER:
+            HEADER.append(row[0])
+del table, info, row
+
+def natural_key(path):
+    """Sort key, cmSignalData.htm.2 before cmSignalData.htm.10"""
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r'(\d+)', path)]
+
+def captures(spec):
+    """Capture paths from spec (a directory or glob), in natural order."""
+    if os.path.isdir(spec):
+        paths = [os.path.join(spec, name) for name in os.listdir(spec)
+                 if not name.startswith('.')]
+    else:
+        paths = glob(spec)
+    return sorted((path for path in paths if os.path.isfile(path)),
+                  key=natural_key)
+
+def replay_columns(path):
+    """(path, timestamp, {table: *_by_column()}) for a capture, None if it
+    can't be parsed (runs in a worker process).
+
+    The timestamp is the capture's mtime.
+    """
+    try:
+        timestamp = int(os.path.getmtime(path))
+        data = SignalData(content=read_data(path))
+        columns = dict((table, getattr(data, '{}_by_column'.format(table))())
+                       for table in SignalData.tables)
+    except Exception as e:
+        print >> sys.stderr, "replay of {} failed: {!r}".format(path, e)
+        return None
+    return path, timestamp, columns
+
+def replay_rows(path, timestamp, columns):
+    """A row (dict, HEADER keys) per channel, empty columns are skipped."""
+    rows = []
+    for table in SignalData.tables:
+        for id, column in zip(GRAPH_IDS, columns.get(table, [])):
+            if not column:
+                continue
+            row = {'source': path, 'timestamp': timestamp,
+                   'table': table, 'id': id}
+            row.update(column)
+            rows.append(row)
+    return rows
+
+class Checkpoint(object):
+    """Progress of a replay: captures done, and the output size then."""
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def save(self, done, last, offset):
+        atomic_write(self.path, json.dumps({'done': done, 'last': last,
+                                            'offset': offset}))
+
+def write_row(writer, fmt, row):
+    if fmt == 'csv':
+        writer.writerow(row)
+    else:
+        writer.write(json.dumps(row, sort_keys=True, default=str) + '\n')
+
+def replay(paths, output, fmt='csv', processes=None, checkpoint=None):
+    """Parse paths in a pool of processes, writing rows to output in order.
+
+    output: a file (opened 'r+b' when resuming from a checkpoint), only
+            seekable with a checkpoint (may be a pipe otherwise).
+    checkpoint: path of a checkpoint file, a replay of the same paths
+                continues where the last one stopped (output is truncated
+                to the last checkpoint, or emptied without one).
+    Returns the number of captures replayed.
+    """
+    done = 0
+    if checkpoint is not None:
+        checkpoint = Checkpoint(checkpoint)
+        state = checkpoint.load()
+        if state is not None:
+            done = state['done']
+            if done and paths[done - 1:done] != [state['last']]:
+                raise ValueError("captures changed since checkpoint"
+                                 " ({} not capture {})".format(state['last'],
+                                                               done))
+            output.seek(0, os.SEEK_END)
+            if output.tell() < state['offset']:
+                raise ValueError("output is shorter than at checkpoint")
+            output.seek(state['offset'])
+            output.truncate()
+        else:
+            # Nothing to resume, don't leave an old output's tail
+            output.seek(0)
+            output.truncate()
+
+    if fmt == 'csv':
+        writer = csv.DictWriter(output, HEADER)
+        if not done:
+            # Not resuming (after the header)
+            writer.writeheader()
+    else:
+        writer = output
+
+    remaining = paths[done:]
+    processes = min(processes or cpu_count(), len(remaining))
+    if processes <= 1:
+        results = (replay_columns(path) for path in remaining)
+        pool = None
+    else:
+        pool = Pool(processes)
+        results = pool.imap(replay_columns, remaining, CHUNK_SIZE)
+    try:
+        for path, result in izip(remaining, results):
+            if result is not None:
+                for row in replay_rows(*result):
+                    write_row(writer, fmt, row)
+            done += 1
+            if checkpoint is not None and (done % CHECKPOINT_EVERY == 0
+                                           or done == len(paths)):
+                output.flush()
+                checkpoint.save(done, path, output.tell())
+    finally:
+        if pool is not None:
+            pool.terminate() # Done, or stopped early (don't wait on workers)
+    output.flush()
+    return len(remaining)
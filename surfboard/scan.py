@@ -0,0 +1,193 @@
+"""DOM free extraction of SignalData.tables from the raw page.
+
+The SB6121 page is small and always laid out the same way: three outer
+tables, a header cell naming each, then rows of cells.  scan_tables()
+finds those with precompiled regular expressions on the page's bytes,
+without building a tree.  Anything it isn't sure matches what
+extract_tables() would find raises ScanError, callers fall back to it.
+"""
+import re
+from bisect import bisect_right
+from parse import convert_text
+
+__all__ = (
+    'ScanError', 'scan_tables',
+)
+
+# Patterns run on a lower cased copy of the page, cell text is lower cased
+# for conversion anyway (see convert_text()).  The copy is the one copy of
+# the page scan_tables() makes: ~5us for a 3KB page.  Case insensitive
+# patterns on the page itself measured slower (re.I header searches lose
+# sre's literal search, ~15us each against ~2us for str.find()), ~35% more
+# per scan all in.
+
+# A table structure start tag (or a table's or tbody's end), and the text
+# following it (up to the next tag, for a td that's what lxml has as it's
+# .text).  Or the start of a comment, script or style, whose contents
+# aren't tags (see RAW_END).  The common < is kept outside the alternatives,
+# sre then searches for it: ~25% faster per scan than '<(...)...|<!--'.
+TOKEN = re.compile(r'<(?:(/table|table|/tbody|tbody|tr|td|script|style)\b'
+                   r'[^>]*>([^<]*)|!--)')
+# Where the contents of a comment, script or style end
+RAW_END = {None: '-->', 'script': '</script', 'style': '</style'}
+# Tags that can end a cell without text, anything else is a child element
+# (which extract_tables() would look at the tail of)
+CELL_END = re.compile(r'</|<(td|tr|tbody|table)\b')
+ENTITY = re.compile(r'&(#x[0-9a-f]+|#\d+|[a-z]+);?')
+ENTITIES = {'nbsp': u'\xa0', 'amp': u'&', 'lt': u'<', 'gt': u'>',
+            'quot': u'"'}
+NON_ASCII = re.compile(r'[\x80-\xff]')
+
+class ScanError(ValueError):
+    pass
+
+class Text(object):
+    """Stands in for an lxml element in convert_text()."""
+    __slots__ = ('text', )
+
+    def __init__(self, text):
+        self.text = text
+
+def entity(match):
+    name = match.group(1)
+    if name.startswith('#'):
+        if name.startswith('#x'):
+            code = int(name[2:], 16)
+        else:
+            code = int(name[1:])
+        try:
+            return unichr(code)
+        except (ValueError, OverflowError):
+            raise ScanError("entity out of range {!r}".format(
+                match.group(0)))
+    try:
+        return ENTITIES[name]
+    except KeyError:
+        raise ScanError("unknown entity {!r}".format(match.group(0)))
+
+def cell_text(text):
+    """Decoded text of a cell, like lxml's .text."""
+    if not text:
+        return None
+    if NON_ASCII.search(text):
+        raise ScanError("non ascii text, the page's encoding matters")
+    if '&' in text:
+        text = text.replace('&nbsp;', u'\xa0') # The usual one, quicker
+        if '&' in text:
+            text = ENTITY.sub(entity, text)
+    return text
+
+class Table(object):
+    """An outer table: where it is, and it's own (not nested tables')
+    rows of raw cell text."""
+    __slots__ = ('start', 'end', 'first_cell', 'rows', 'tbody')
+
+    def __init__(self, start):
+        self.start = start
+        self.end = None
+        self.first_cell = None
+        self.rows = []
+        self.tbody = False
+
+def outer_tables(content):
+    """Every outermost Table in (lower cased) content, in one pass over
+    it's tags.  Comments, scripts and styles are skipped, inside a table
+    they raise ScanError (lxml would see the text around them differently).
+    """
+    tables = []
+    depth = 0
+    table = None
+    skip_to = 0 # End of the last comment, script or style
+    for match in TOKEN.finditer(content):
+        if match.start() < skip_to:
+            continue
+        tag, text = match.groups()
+        if tag in RAW_END:
+            if depth:
+                raise ScanError("{} inside a table".format(tag or 'comment'))
+            skip_to = content.find(RAW_END[tag], match.end())
+            if skip_to < 0:
+                raise ScanError("unclosed {}".format(tag or 'comment'))
+        elif tag == 'table':
+            if depth == 0:
+                table = Table(match.start())
+                tables.append(table)
+            depth += 1
+        elif tag == '/table':
+            if depth > 0:
+                depth -= 1
+                if depth == 0:
+                    table.end = match.end()
+        elif depth != 1:
+            continue # A nested table's
+        elif tag == 'tbody':
+            table.tbody = True
+        elif tag == '/tbody':
+            # Rows after it aren't in a tbody (see below)
+            table.tbody = False
+        elif tag == 'tr':
+            if not table.tbody:
+                # lxml doesn't add tbody, without it the xpaths see no rows
+                raise ScanError("table rows outside a tbody")
+            table.rows.append([])
+        elif tag == 'td':
+            if not table.rows or not table.tbody:
+                raise ScanError("cell outside a row")
+            if table.first_cell is None:
+                table.first_cell = match.start()
+            if not text and not CELL_END.match(content, match.end()):
+                raise ScanError("cell starts with markup")
+            table.rows[-1].append(text)
+    if depth:
+        raise ScanError("unclosed table")
+    return tables
+
+def scan_tables(content, tables):
+    """Fields of every table in tables (see SignalData.tables) from raw
+    page content: {'down': {'fields': {'channel': [144, ...], ...}}, ...}
+
+    Raises ScanError unless every table and row is found, exactly where
+    extract_tables() would find them.
+    """
+    content = content.lower() # The one copy of the page, see above
+    outer = outer_tables(content)
+    extracted = {}
+    for name, info in tables.items():
+        header = info['header']
+        for table in outer:
+            position = content.find(header, table.start, table.end)
+            if position < 0:
+                continue
+            # The header cell comes before the table's first row cell,
+            # and no earlier table mentions the header
+            if table.first_cell is None or position > table.first_cell:
+                raise ScanError("{} header isn't in a header cell".format(
+                    name))
+            break
+        else:
+            raise ScanError("no {} table".format(name))
+
+        # Every cell's text, searched at once for each row header
+        offsets, cells = [], []
+        offset = 0
+        for row in table.rows:
+            for i, text in enumerate(row):
+                offsets.append(offset)
+                cells.append((row, i))
+                offset += len(text) + 1
+        texts = '\0'.join(text for row in table.rows for text in row)
+
+        fields = {}
+        for row in info.get('rows', []):
+            row_name, row_header, sep, convert = (row + (None, None))[:4]
+            position = texts.find(row_header)
+            if position < 0:
+                raise ScanError("no {} {} row".format(name, row_name))
+            row_cells, i = cells[bisect_right(offsets, position) - 1]
+            if i != 0:
+                raise ScanError("{} {} header isn't the row's first cell"
+                                .format(name, row_name))
+            values = [Text(cell_text(text)) for text in row_cells[1:]]
+            fields[row_name] = convert_text(values, convert or int, sep)
+        extracted[name] = {'fields': fields}
+    return extracted
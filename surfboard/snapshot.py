@@ -0,0 +1,192 @@
+from array import array
+from collections import namedtuple
+from parse import SignalData
+
+__all__ = (
+    'RECORDS', 'Channels', 'Snapshot',
+)
+
+NAN = float('nan')
+
+def record_types(tables):
+    """namedtuple per table for it's channels, e.g. DownChannel(channel,
+    freq, snr, power), fields in SignalData.tables row order."""
+    types = {}
+    for table, info in tables.items():
+        fields = [row[0] for row in info.get('rows', [])]
+        name = '{}Channel'.format(table.capitalize())
+        types[table] = namedtuple(name, fields)
+    return types
+
+# table -> namedtuple of one channel's values
+RECORDS = record_types(SignalData.tables)
+
+def numeric_fields(tables):
+    """Fields converted with int() (the default), stored in arrays."""
+    numeric = {}
+    for table, info in tables.items():
+        numeric[table] = frozenset(row[0] for row in info.get('rows', [])
+                                   if (row + (None, None))[3] in (None, int))
+    return numeric
+
+# table -> fields stored as array('d'), others (Decimal, str) are tuples
+NUMERIC = numeric_fields(SignalData.tables)
+
+def pack(values):
+    """array('d') of int (or None -> NaN) values."""
+    return array('d', (NAN if value is None else value for value in values))
+
+def unpack(value):
+    if value != value: # NaN
+        return None
+    return int(value)
+
+class Frozen(object):
+    """Base for immutable, slotted objects (set attributes via _init())."""
+    __slots__ = ()
+
+    def _init(self, **attrs):
+        for name, value in attrs.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("{} is frozen".format(self.__class__.__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError("{} is frozen".format(self.__class__.__name__))
+
+class Channels(Frozen):
+    """One table's channels, column oriented.
+
+    Numeric fields are array('d') (NaN for missing values), others are
+    tuples.  padding is the number of empty columns *_by_column() adds to
+    reach the table's min_columns.
+    """
+    __slots__ = ('table', 'columns', 'padding')
+
+    def __init__(self, table, columns, padding=0):
+        self._init(table=table, columns=tuple(columns), padding=padding)
+
+    def __repr__(self):
+        return ('Channels(table={self.table!r}'
+                ', channels={}, padding={self.padding!r})').format(
+                    len(self), self=self)
+
+    def __reduce__(self):
+        return Channels, (self.table, self.columns, self.padding)
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(self.columns[0])
+
+    def __eq__(self, other):
+        return (isinstance(other, Channels)
+                and self.table == other.table
+                and self.padding == other.padding
+                and self.records() == other.records())
+
+    def __ne__(self, other):
+        return not self == other
+
+    @classmethod
+    def from_columns(cls, table, columns):
+        """Channels from *_by_column() style dicts ({} are padding)."""
+        real = [column for column in columns if column]
+        fields = RECORDS[table]._fields
+        packed = []
+        for field in fields:
+            values = [column.get(field) for column in real]
+            if field in NUMERIC[table]:
+                packed.append(pack(values))
+            else:
+                packed.append(tuple(values))
+        return cls(table, packed, len(columns) - len(real))
+
+    def column(self, field):
+        """All channels' values of field (array('d') if numeric)."""
+        return self.columns[RECORDS[self.table]._fields.index(field)]
+
+    def records(self):
+        """A namedtuple (see RECORDS) per channel."""
+        record = RECORDS[self.table]
+        numeric = NUMERIC[self.table]
+        columns = []
+        for field, values in zip(record._fields, self.columns):
+            if field in numeric:
+                values = map(unpack, values)
+            columns.append(values)
+        return tuple(record(*values) for values in zip(*columns))
+
+    def by_column(self):
+        """Compatibility view, same as SignalData.*_by_column()."""
+        columns = [dict(zip(record._fields, record))
+                   for record in self.records()]
+        columns.extend({} for i in range(self.padding))
+        return columns
+
+def channels_getter(table):
+    def func(self):
+        return self.tables[table].by_column()
+    return func
+
+class Snapshot(Frozen):
+    """Immutable, compact copy of everything extracted from one page.
+
+    tables: {table: Channels}.  *_by_column() methods give the same dicts
+    as SignalData's (build new lists on each call, they're views).
+    """
+    __slots__ = ('timestamp', 'tables')
+
+    def __init__(self, timestamp, tables):
+        self._init(timestamp=timestamp, tables=tables)
+
+    def __repr__(self):
+        return 'Snapshot(timestamp={self.timestamp!r})'.format(self=self)
+
+    def __reduce__(self):
+        return self.__class__, (self.timestamp, self.tables)
+
+    def __eq__(self, other):
+        return (isinstance(other, Snapshot)
+                and self.timestamp == other.timestamp
+                and self.tables == other.tables)
+
+    def __ne__(self, other):
+        return not self == other
+
+    @classmethod
+    def from_by_columns(cls, timestamp, columns):
+        """Snapshot from {table: *_by_column() dicts}."""
+        tables = {}
+        for table, table_columns in columns.items():
+            tables[str(table)] = Channels.from_columns(str(table),
+                                                       table_columns)
+        return cls(timestamp, tables)
+
+    @classmethod
+    def from_data(cls, data, timestamp=None, tables=None):
+        """Snapshot of data (SignalData, or anything with *_by_column()),
+        of every table in tables (default all)."""
+        columns = {}
+        for table in SignalData.tables if tables is None else tables:
+            columns[table] = getattr(data, '{}_by_column'.format(table))()
+        return cls.from_by_columns(timestamp, columns)
+
+    @classmethod
+    def scrape(cls, html=None, timestamp=None, tables=None, **kwargs):
+        """Snapshot of html (kwargs are passed to SignalData), every table
+        in tables (default all) extracted up front, no others.
+
+        Nothing of the parse is kept (the raw page, soup and lxml trees
+        go with the SignalData), unlike holding on to a SignalData.
+        """
+        return cls.from_data(SignalData(html, extract=tables, **kwargs),
+                             timestamp, tables)
+
+    def channels(self, table):
+        return self.tables[table]
+
+for table in SignalData.tables:
+    setattr(Snapshot, '{}_by_column'.format(table), channels_getter(table))
+del table
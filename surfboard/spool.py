@@ -0,0 +1,192 @@
+import json
+import os
+import sys
+import time
+from hashlib import sha1
+from cache import atomic_write
+from parse import SignalData, decimal
+from snapshot import Snapshot
+
+__all__ = (
+    'DEFAULT_INTERVAL', 'STALE_AGE', 'KEEP_AGE',
+    'Sample', 'Spool', 'poll', 'layout_of',
+)
+
+# Seconds between daemon polls (munin itself only asks every 300)
+DEFAULT_INTERVAL = 20
+
+# A spool without samples this recent is ignored (daemon isn't running)
+STALE_AGE = 600
+
+# Samples older than this are trimmed from the spool
+KEEP_AGE = 3600
+
+SPOOL_PREFIX = 'surfboard-spool-'
+
+class Sample(Snapshot):
+    """Timestamped Snapshot, serialized to/from a Spool line."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'Sample(timestamp={self.timestamp!r})'.format(self=self)
+
+    @classmethod
+    def from_data(cls, data, timestamp=None, tables=None):
+        if timestamp is None:
+            timestamp = int(time.time())
+        return super(Sample, cls).from_data(data, timestamp, tables)
+
+    @classmethod
+    def from_layout(cls, layout, timestamp=None):
+        """Sample without values, enough to render config for a layout
+        (see layout_of())."""
+        columns = {}
+        for table, count in layout.items():
+            columns[table] = [{} for i in range(count)]
+        return cls.from_by_columns(timestamp, columns)
+
+    @property
+    def columns(self):
+        """{table: *_by_column() dicts}"""
+        return dict((table, channels.by_column())
+                    for table, channels in self.tables.items())
+
+    def dumps(self):
+        return json.dumps({'timestamp': self.timestamp,
+                           'columns': self.columns},
+                          sort_keys=True, default=str)
+
+    @classmethod
+    def loads(cls, line):
+        sample = json.loads(line)
+        columns = sample['columns']
+        # Decimals were dumped as str()
+        for table, info in SignalData.tables.items():
+            for row in info.get('rows', []):
+                name, convert = row[0], (row + (None, None))[3]
+                if convert is not decimal:
+                    continue
+                for column in columns.get(table, []):
+                    if column.get(name) is not None:
+                        column[name] = decimal(column[name])
+        return cls.from_by_columns(sample['timestamp'], columns)
+
+def layout_of(data, tables=None):
+    """Channel layout of data (SignalData or Sample): {table: columns}, of
+    every table in tables (default all)"""
+    layout = {}
+    for table in SignalData.tables if tables is None else tables:
+        layout[table] = len(getattr(data, '{}_by_column'.format(table))())
+    return layout
+
+class Spool(object):
+    """Append only file of Samples for one modem (source url).
+
+    A daemon appends Samples, plugin fetch runs read the ones they
+    haven't seen yet (tracked in a marker file per reader: wildcard
+    plugins for different graphs each read every sample).
+    """
+    def __init__(self, directory, source, reader=None):
+        self.directory = directory
+        self.source = source
+        self.reader = reader
+        name = SPOOL_PREFIX + sha1(source).hexdigest()
+        self.path = os.path.join(directory, name)
+        self.marker_path = self.path + '.last'
+        if reader is not None:
+            self.marker_path += '-' + reader
+
+    def __repr__(self):
+        return ('Spool(directory={self.directory!r}'
+                ', source={self.source!r}'
+                ', reader={self.reader!r})').format(self=self)
+
+    def append(self, sample):
+        # Single small write to an O_APPEND file, readers never see half a
+        # line except at the end (which samples() skips)
+        with open(self.path, 'a') as f:
+            f.write(sample.dumps() + '\n')
+
+    def samples(self, since=None):
+        """Spooled Samples, optionally only those newer than since."""
+        samples = []
+        try:
+            f = open(self.path)
+        except IOError:
+            return samples
+        with f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break # Still being written
+                sample = Sample.loads(line)
+                if since is None or sample.timestamp > since:
+                    samples.append(sample)
+        return samples
+
+    def latest(self, max_age=STALE_AGE):
+        """Most recent Sample, None if there isn't one within max_age."""
+        samples = self.samples(since=time.time() - max_age)
+        if samples:
+            return samples[-1]
+
+    def active(self, max_age=STALE_AGE):
+        """Whether a daemon has appended within max_age (without reading
+        the spool)."""
+        try:
+            return os.path.getmtime(self.path) > time.time() - max_age
+        except OSError:
+            return False
+
+    def last_read(self):
+        try:
+            with open(self.marker_path) as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            return None
+
+    def unread(self, max_age=STALE_AGE):
+        """Samples not yet returned by unread(), newer than max_age."""
+        since = time.time() - max_age
+        last_read = self.last_read()
+        if last_read is not None:
+            since = max(since, last_read)
+        samples = self.samples(since=since)
+        if samples:
+            atomic_write(self.marker_path, str(samples[-1].timestamp))
+        return samples
+
+    def trim(self, max_age=KEEP_AGE):
+        """Drop samples older than max_age."""
+        samples = self.samples(since=time.time() - max_age)
+        atomic_write(self.path, ''.join(s.dumps() + '\n' for s in samples))
+
+def poll(source, spool, interval=DEFAULT_INTERVAL, count=None, history=None,
+         **kwargs):
+    """Poll source every interval seconds, appending Samples to spool (and
+    history, a History, if given).
+
+    Runs forever, or for count polls.  kwargs are passed to SignalData.
+    Failed polls are reported on stderr and skipped.
+    """
+    polls = 0
+    trim_every = max(1, KEEP_AGE // interval // 10)
+    next_poll = time.time()
+    while count is None or polls < count:
+        timestamp = int(time.time())
+        try:
+            sample = Sample.scrape(source, timestamp, **kwargs)
+            spool.append(sample)
+            if history is not None:
+                history.append(sample)
+        except Exception as e:
+            print >> sys.stderr, "poll of {} failed: {!r}".format(source, e)
+        polls += 1
+        if polls % trim_every == 0:
+            spool.trim()
+
+        next_poll += interval
+        delay = next_poll - time.time()
+        if delay > 0 and (count is None or polls < count):
+            time.sleep(delay)
+        elif delay <= 0:
+            next_poll = time.time() # Fell behind, don't burst to catch up
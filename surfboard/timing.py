@@ -0,0 +1,39 @@
+import time
+from contextlib import contextmanager
+
+__all__ = (
+    'Timings',
+)
+
+class Timings(object):
+    """Hot path timings of one plugin run, graphed as plugin_timing.
+
+    Seconds for fetch, parse, extract and render, plus bytes received.
+    Anything not measured this run (e.g. a page from the cache, or samples
+    from a spool) is None (munin 'U').
+    """
+    FIELDS = 'fetch', 'bytes', 'parse', 'extract', 'render'
+
+    def __init__(self):
+        self.values = dict((field, None) for field in self.FIELDS)
+
+    def __repr__(self):
+        return 'Timings({})'.format(', '.join(
+            '{}={!r}'.format(field, self.values[field])
+            for field in self.FIELDS))
+
+    @contextmanager
+    def time(self, field):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.values[field] = time.time() - start
+
+    def plugin_by_column(self):
+        """A single column, used like SignalData.*_by_column()"""
+        column = dict(self.values)
+        for field, value in column.items():
+            if isinstance(value, float):
+                column[field] = '{:.6f}'.format(value) # Not 1e-05 notation
+        return [column]
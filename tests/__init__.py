@@ -1,13 +1,57 @@
+import json
+import pickle
+import re
+import sys
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from benchmarks.fakemodem import FakeModem, testdata_pages
 from decimal import Decimal
-from os.path import dirname, join
+from functools import partial
+from glob import glob
+from hashlib import sha1
+from httplib import IncompleteRead
+from math import isnan
+from os import environ, listdir, symlink, utime
+from os.path import basename, dirname, getmtime, getsize, join
+from shutil import rmtree
+from socket import timeout
+from StringIO import StringIO
+from subprocess import PIPE, Popen, check_output
+from surfboard.cache import (PageCache, ResultCache, SingleFlight, load_layout,
+                             save_layout)
+from surfboard.exporter import Exporter, ExporterServer
+from surfboard.fetch import Fetcher, FetchError
+from surfboard.history import History
+from surfboard import graph as graph_module
+from surfboard.graph import graph_tables, graphs, layout_config
+from surfboard import host_values, main, plugin_graphs, spooled
+from surfboard.fleet import (fetch_all, host_name, load_fleet, poll_fleet,
+                             sample_fleet)
+from surfboard.rates import deltas, error_rates
+from surfboard.replay import captures, replay
+from surfboard.parse import extract_tables, parse_html, read_data
+from surfboard.scan import ScanError, scan_tables
+from surfboard.snapshot import RECORDS, Snapshot
+from surfboard.spool import layout_of, poll
+from tempfile import mkdtemp
+from threading import Thread
+from time import sleep, time
 from surfboard import *
 from unittest import TestCase
+from urllib2 import HTTPError, urlopen
 from xml.etree import ElementTree as ET
 
 __all__ = (
     'TestArgs',
     'SignalDataTestCase', 'SignalDataTestCaseTwo',
     'SDOneDownOnlyTestCase',
+    'ExtractTablesTestCase', 'PageCacheTestCase', 'ResultCacheTestCase',
+    'SpoolTestCase',
+    'FleetTestCase', 'FetcherTestCase', 'FakeModemTestCase',
+    'SingleFlightTestCase',
+    'ApiTestCase', 'StartupTestCase',
+    'SnapshotTestCase', 'TimingsTestCase', 'GraphSelectionTestCase',
+    'ReplayTestCase',
+    'HistoryTestCase', 'RatesTestCase', 'ExporterTestCase',
 )
 
 class TestArgs(TestCase):
@@ -41,6 +85,19 @@ class TestArgs(TestCase):
         self.assertEquals('config', args.mode)
         self.assertEquals('file.html', args.html)
 
+    def test_soup(self):
+        self.assertFalse(handle_args([]).soup)
+        self.assertTrue(handle_args(['--soup', 'file.html']).soup)
+
+    def test_dirtyconfig(self):
+        environ['MUNIN_CAP_DIRTYCONFIG'] = '1'
+        try:
+            self.assertTrue(handle_args(['config']).dirty)
+            self.assertFalse(handle_args([]).dirty)
+        finally:
+            del environ['MUNIN_CAP_DIRTYCONFIG']
+        self.assertFalse(handle_args(['config']).dirty)
+
 
 def ts_lower(elem):
     return ET.tostring(elem).lower()
@@ -225,3 +282,1473 @@ class SDOneDownOnlyTestCase(SignalDataTestCase):
     stats_unerroreds = [183209]
     stats_correctables = [11]
     stats_uncorrectables = [658]
+
+
+def corpus(*patterns):
+    """Non-empty testdata files matching patterns"""
+    base = join(dirname(__file__), '..', 'testdata')
+    paths = []
+    for pattern in patterns or ('orig/cmSignalData.htm.*', '*.htm'):
+        paths.extend(sorted(glob(join(base, pattern))))
+    return [path for path in paths if getsize(path)]
+
+class ExtractTablesTestCase(TestCase):
+    """Single pass extraction must match the per-field xpath lookups"""
+    def test_matches_xpath(self):
+        for path in corpus():
+            data = SignalData(path)
+            for table, info in SignalData.tables.items():
+                t = get_table(data.lxml, info['header'])
+                self.assertIs(t, getattr(data, '{}_table'.format(table))())
+                for row in info.get('rows', []):
+                    name, header, sep, convert = (row + (None, None))[:4]
+                    full_name = '_'.join((table, name))
+                    self.assertIs(get_row(t, header),
+                        getattr(data, '{}_row'.format(full_name))())
+                    self.assertEquals(get_fields(t, header, sep, convert),
+                        getattr(data, pluralize(full_name))(), path)
+
+    def test_xpath_registry(self):
+        registry = xpaths()
+        self.assertIs(registry, xpaths())
+        for info in SignalData.tables.values():
+            self.assertTrue(info['header'] in registry.tables)
+            for row in info.get('rows', []):
+                self.assertTrue(row[1] in registry.rows)
+
+    def test_soup_matches_lxml(self):
+        for path in corpus():
+            direct, soup = SignalData(path), SignalData(path, soup=True)
+            for table in SignalData.tables:
+                method = '{}_by_column'.format(table)
+                self.assertEquals(getattr(direct, method)(),
+                                  getattr(soup, method)(), path)
+
+    def test_stream_matches_lxml(self):
+        for path in corpus():
+            direct, stream = SignalData(path), SignalData(path, stream=True)
+            for table in SignalData.tables:
+                method = '{}_by_column'.format(table)
+                self.assertEquals(getattr(direct, method)(),
+                                  getattr(stream, method)(), path)
+
+    def test_stream_stops_reading(self):
+        with open(corpus('working.htm')[0]) as f:
+            page = f.read()
+        padding = '<p>{}</p>'.format('x' * 100000)
+        content = StringIO(page.replace('</BODY>', padding + '</BODY>'))
+        _, extracted = stream_tables(content, SignalData.tables)
+        self.assertTrue(content.tell() < len(page) + 1024)
+        self.assertEquals([-11, -9, -9, -10],
+                          extracted['down']['fields']['power'])
+
+    def test_scan_matches_xpath(self):
+        for path in corpus():
+            content = read_data(path)
+            scanned = scan_tables(content, SignalData.tables)
+            extracted = extract_tables(parse_html(content),
+                                       SignalData.tables)
+            for table in SignalData.tables:
+                self.assertEquals(extracted[table]['fields'],
+                                  scanned[table]['fields'], path)
+
+    def test_scan_falls_back(self):
+        with open(corpus('working.htm')[0]) as f:
+            page = f.read()
+        snr = '<TD>34 dB&nbsp;</TD>'
+        for content in (page.replace('<TD>Power Level',
+                                     '<TD><!-- dBmV -->Power Level'),
+                        page.replace('</TABLE>', '', 1),
+                        # Tags that aren't
+                        page.replace(snr, '<!-- <TD>99 dB</TD> -->' + snr),
+                        page.replace('<TD>Power Level', '<TD>Power Level'
+                                     '<script>var s = "<td>";</script>'),
+                        page.replace(snr, '<TD>34 dB&#99999999;</TD>'),
+                        # Rows ./tbody/tr doesn't see
+                        page.replace('<TR><TD>Power Level',
+                                     '</TBODY><TR><TD>Power Level')):
+            self.assertRaises(ScanError, scan_tables, content,
+                              SignalData.tables)
+            fast, slow = SignalData(content=content), SignalData(
+                content=content, fast=False)
+            for table in SignalData.tables:
+                self.assertEquals(slow.extracted[table]['fields'],
+                                  fast.extracted[table]['fields'])
+
+    def test_scan_skips(self):
+        with open(corpus('working.htm')[0]) as f:
+            page = f.read()
+        for content in (page.replace('<BODY', '<!-- <TABLE> --><BODY'),
+                        page.replace('<BODY', '<script>document.write('
+                                     '"<table><tr>")</script><BODY'),
+                        page.replace('<TD>34 dB&nbsp;</TD>',
+                                     '<TD>34&#x20;dB&#160;</TD>')):
+            scanned = scan_tables(content, SignalData.tables)
+            extracted = extract_tables(parse_html(content),
+                                       SignalData.tables)
+            for table in SignalData.tables:
+                self.assertEquals(extracted[table]['fields'],
+                                  scanned[table]['fields'])
+
+    def test_columns_extracted_once(self):
+        data = SignalData(corpus('working.htm')[0])
+        calls = []
+        getters = {}
+        for table, info in SignalData.tables.items():
+            for row in info['rows']:
+                name = pluralize('_'.join((table, row[0])))
+                getters[name] = getattr(SignalData, name)
+                def getter(self, table=table, getter=getters[name]):
+                    calls.append(table)
+                    return getter(self)
+                setattr(SignalData, name, getter)
+        try:
+            config(data)
+            values(data)
+            self.assertEquals(
+                sorted(table for table, info in SignalData.tables.items()
+                       for row in info['rows']),
+                sorted(calls))
+            data.down_by_column()[0]['snr'] = None
+            self.assertEquals(34, data.down_by_column()[0]['snr'])
+            del calls[:]
+            data.invalidate()
+            data.down_by_column()
+            rows = SignalData.tables['down']['rows']
+            self.assertEquals(['down'] * len(rows), calls)
+        finally:
+            for name, getter in getters.items():
+                setattr(SignalData, name, getter)
+
+    def test_refresh(self):
+        data = SignalData(corpus('working.htm')[0])
+        self.assertEquals(4, len(data.down_by_column()))
+        data.refresh(read_data(corpus('one_down_only.htm')[0]))
+        self.assertEquals(SignalData(corpus('one_down_only.htm')[0])
+                          .down_by_column(), data.down_by_column())
+
+    def test_scan_skips_parsing(self):
+        data = SignalData(corpus('working.htm')[0])
+        data.down_by_column()
+        self.assertIs(None, data._lxml)
+
+
+class PageCacheTestCase(TestCase):
+    url = 'http://192.0.2.1/cmSignalData.htm'
+
+    def setUp(self):
+        super(PageCacheTestCase, self).setUp()
+        self.directory = mkdtemp()
+        self.cache = PageCache(self.directory, ttl=60)
+
+    def tearDown(self):
+        rmtree(self.directory)
+        super(PageCacheTestCase, self).tearDown()
+
+    def age(self, key, seconds):
+        path = self.cache.path(key)
+        then = getmtime(path) - seconds
+        utime(path, (then, then))
+
+    def test_put_get(self):
+        self.assertIsNone(self.cache.get(self.url))
+        self.cache.put(self.url, 'page')
+        self.assertEquals('page', self.cache.get(self.url))
+        self.assertEquals(['surfboard-page-' + sha1(self.url).hexdigest()],
+                          listdir(self.directory))
+
+    def test_expired(self):
+        self.cache.put(self.url, 'page')
+        self.age(self.url, 61)
+        self.assertIsNone(self.cache.get(self.url))
+
+    def test_evict(self):
+        self.cache.put('old', 'page')
+        self.age('old', 61)
+        self.cache.put(self.url, 'page')
+        self.assertEquals([basename(self.cache.path(self.url))],
+                          listdir(self.directory))
+
+    def test_open_once(self):
+        opened = []
+        def opener():
+            opened.append(True)
+            return StringIO('page')
+        for i in range(3):
+            content = self.cache.open(self.url, opener)
+            self.assertEquals('page', content.read())
+            content.close()
+        self.assertEquals(1, len(opened))
+
+    def test_failed_read_not_cached(self):
+        class Failing(StringIO):
+            def read(self, size=-1):
+                raise timeout('timed out')
+        opened = []
+        def opener():
+            opened.append(True)
+            return Failing() if len(opened) == 1 else StringIO('page')
+        content = self.cache.open(self.url, opener)
+        self.assertRaises(timeout, content.read, 10)
+        content.close()
+        self.assertIsNone(self.cache.get(self.url))
+        content = self.cache.open(self.url, opener)
+        self.assertEquals('page', content.read())
+        content.close()
+        self.assertEquals(2, len(opened))
+        self.assertEquals('page', self.cache.get(self.url))
+
+    def test_partial_read_not_cached(self):
+        content = self.cache.open(self.url, lambda: StringIO('page'))
+        self.assertEquals('pa', content.read(2))
+        content.close()
+        self.assertIsNone(self.cache.get(self.url))
+
+    def test_stream_caches_tables(self):
+        with open(corpus('working.htm')[0]) as f:
+            page = f.read()
+        padding = '<p>{}</p>'.format('x' * 100000)
+        page = page.replace('</BODY>', padding + '</BODY>')
+        class PageFetcher(object):
+            def open(self, url):
+                return StringIO(page)
+        data = SignalData(self.url, stream=True, cache=self.cache,
+                          fetcher=PageFetcher())
+        self.assertEquals([34, 35, 35, 34], data.down_snrs())
+        cached = self.cache.get(self.url)
+        self.assertTrue(cached and len(cached) < len(page) - 90000)
+        self.assertEquals([34, 35, 35, 34],
+                          SignalData(content=cached).down_snrs())
+
+    def test_signal_data_from_cache(self):
+        with open(corpus('working.htm')[0]) as f:
+            self.cache.put(self.url, f.read())
+        for stream in False, True:
+            data = SignalData(self.url, stream=stream, cache=self.cache)
+            self.assertEquals([34, 35, 35, 34], data.down_snrs())
+
+
+class ResultCacheTestCase(TestCase):
+    def setUp(self):
+        super(ResultCacheTestCase, self).setUp()
+        self.directory = mkdtemp()
+        with open(corpus('working.htm')[0]) as f:
+            # Not the usual layout, so a miss parses with lxml
+            self.page = f.read().replace('<TD>Power Level',
+                                         '<TD><!-- dBmV -->Power Level')
+
+    def tearDown(self):
+        rmtree(self.directory)
+        super(ResultCacheTestCase, self).tearDown()
+
+    def test_lru(self):
+        cache = ResultCache(size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEquals(1, cache.get('a'))
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEquals([1, 3], [cache.get('a'), cache.get('c')])
+        self.assertEquals((3, 1), (cache.hits, cache.misses))
+
+    def test_disk(self):
+        fields = dict((name, {'fields': table['fields']}) for name, table
+                      in SignalData(content=self.page).extracted.items())
+        ResultCache(size=2, directory=self.directory).put('a', fields)
+        cache = ResultCache(size=2, directory=self.directory)
+        loaded = cache.get('a')
+        self.assertEquals(fields, loaded)
+        self.assertEquals(Decimal('5.12'), loaded['up']['fields']['rate'][0])
+        self.assertIsInstance(loaded['up']['fields']['rate'][0], Decimal)
+        cache.put('b', fields)
+        cache.put('c', fields)
+        self.assertEquals(2, len(listdir(self.directory)))
+
+    def test_disk_is_json(self):
+        cache = ResultCache(directory=self.directory)
+        # A pickle (code, when loaded) planted in the cache isn't loaded
+        with open(cache.path('a'), 'wb') as f:
+            pickle.dump({'down': {'fields': None}}, f, 2)
+        self.assertIsNone(cache.get('a'))
+        cache.put('b', SignalData(content=self.page).extracted)
+        with open(cache.path('b')) as f:
+            self.assertEquals(['down', 'stats', 'up'],
+                              sorted(json.load(f)))
+
+    def test_unchanged_page_skips_parsing(self):
+        cache = ResultCache()
+        first = SignalData(content=self.page, results=cache)
+        second = SignalData(content=self.page, results=cache)
+        for table in SignalData.tables:
+            method = '{}_by_column'.format(table)
+            self.assertEquals(getattr(first, method)(),
+                              getattr(second, method)())
+        self.assertIsNot(None, first._lxml)
+        self.assertIs(None, second._lxml)
+        self.assertEquals((1, 1), (cache.hits, cache.misses))
+
+
+class SpoolTestCase(TestCase):
+    source = corpus('working.htm')[0]
+
+    def setUp(self):
+        super(SpoolTestCase, self).setUp()
+        self.directory = mkdtemp()
+        self.spool = Spool(self.directory, self.source)
+        self.data = SignalData(self.source)
+
+    def tearDown(self):
+        rmtree(self.directory)
+        super(SpoolTestCase, self).tearDown()
+
+    def test_round_trip(self):
+        sample = Sample.from_data(self.data, 1400000000)
+        loaded = Sample.loads(sample.dumps())
+        self.assertEquals(1400000000, loaded.timestamp)
+        for table in SignalData.tables:
+            method = '{}_by_column'.format(table)
+            self.assertEquals(getattr(self.data, method)(),
+                              getattr(loaded, method)())
+
+    def test_config_matches(self):
+        self.assertEquals(config(self.data),
+                          config(Sample.from_data(self.data)))
+
+    def test_timestamped_values(self):
+        samples = [Sample.from_data(self.data, ts)
+                   for ts in (1400000000, 1400000020)]
+        lines = values(*samples).split('\n')
+        self.assertEquals('multigraph surfboard_snr_power', lines[0])
+        self.assertEquals('down_snrA.value 1400000000:34', lines[1])
+        self.assertTrue('down_snrA.value 1400000020:34' in lines)
+
+    def test_unread(self):
+        now = int(time())
+        for ts in now - 40, now - 20:
+            self.spool.append(Sample.from_data(self.data, ts))
+        self.assertEquals([now - 40, now - 20],
+                          [s.timestamp for s in self.spool.unread()])
+        self.assertEquals([], self.spool.unread())
+        self.spool.append(Sample.from_data(self.data, now))
+        self.assertEquals([now], [s.timestamp for s in self.spool.unread()])
+        self.assertEquals(now, self.spool.latest().timestamp)
+
+    def test_update_rate(self):
+        self.assertFalse(self.spool.active())
+        self.spool.append(Sample.from_data(self.data, int(time())))
+        self.assertTrue(self.spool.active())
+        args = handle_args(['config', self.source, '--spool-dir',
+                            self.directory, '--interval', '20'])
+        output = spooled(args, self.spool)
+        self.assertNotEquals(config(self.data), output)
+        # In every multigraph's config
+        self.assertEquals(len(graphs), output.count('\nupdate_rate 20\n'))
+        self.assertEquals(len(graphs),
+                          output.count('\ngraph_data_size custom 1d, '))
+        self.assertFalse('update_rate' in config(self.data))
+
+    def test_stale(self):
+        self.spool.append(Sample.from_data(self.data, int(time()) - 3600))
+        self.assertIsNone(self.spool.latest())
+        self.assertEquals([], self.spool.unread())
+
+    def test_poll(self):
+        poll(self.source, self.spool, count=1)
+        samples = self.spool.samples()
+        self.assertEquals(1, len(samples))
+        self.assertEquals(self.data.stats_by_column(),
+                          samples[0].stats_by_column())
+
+
+class FleetTestCase(TestCase):
+    sources = corpus('working.htm', 'one_down_only.htm')
+
+    def test_load_fleet(self):
+        self.assertEquals(['http://a/x', 'http://b/x', 'http://c/x'],
+                          load_fleet('http://a/x, http://b/x\nhttp://c/x'))
+        directory = mkdtemp()
+        try:
+            path = join(directory, 'fleet')
+            with open(path, 'w') as f:
+                f.write('# modems\nhttp://a/x\n\nhttp://b/x # upstairs\n')
+            self.assertEquals(['http://a/x', 'http://b/x'], load_fleet(path))
+        finally:
+            rmtree(directory)
+
+    def test_host_name(self):
+        self.assertEquals('192_168_100_1',
+                          host_name('http://192.168.100.1/cmSignalData.htm'))
+        self.assertEquals('modem_a', host_name('http://modem-a:8080/'))
+
+    def test_sample_fleet(self):
+        for processes, soup, stream in ((1, False, False), (2, False, False),
+                                        (2, True, False), (1, False, True)):
+            samples = sample_fleet(self.sources, processes=processes,
+                                   soup=soup, stream=stream)
+            self.assertEquals(2, len(samples))
+            for source, sample in zip(self.sources, samples.values()):
+                data = SignalData(source)
+                for table in SignalData.tables:
+                    method = '{}_by_column'.format(table)
+                    self.assertEquals(getattr(data, method)(),
+                                      getattr(sample, method)())
+
+    def test_spread_doesnt_hold_workers(self):
+        def read(url, cache, fetcher):
+            sleep(.05)
+            return url
+        urls = [str(i) for i in range(32)]
+        start = time()
+        self.assertEquals(urls, fetch_all(urls, workers=4, spread=.5,
+                                          read=read))
+        # Waiting for a start in a worker would take ~32 / 4 * .3 seconds
+        self.assertTrue(time() - start < 1.2)
+
+    def test_poll_fleet_pool(self):
+        fleet_module = sys.modules['surfboard.fleet']
+        Pool = fleet_module.Pool
+        pools = []
+        def counting_pool(processes):
+            pools.append(processes)
+            return Pool(processes)
+        directory = mkdtemp()
+        fleet_module.Pool = counting_pool
+        try:
+            poll_fleet(self.sources, directory, interval=.1, count=3,
+                       processes=2)
+            # One pool for every poll
+            self.assertEquals([2], pools)
+            poll_fleet(self.sources, directory, interval=.1, count=1)
+            # Too few pages to be worth a process
+            self.assertEquals([2], pools)
+            for source in self.sources:
+                self.assertEquals(4, len(Spool(directory, source).samples()))
+        finally:
+            fleet_module.Pool = Pool
+            rmtree(directory)
+
+    def test_unreachable(self):
+        samples = sample_fleet(['/nonexistent/cmSignalData.htm'])
+        self.assertEquals([{}, {}, {}, {}],
+                          samples.values()[0].down_by_column())
+
+    def test_main_twice(self):
+        # surfboard.fleet is the submodule, not shadowed by main()'s helper
+        argv, stdout = sys.argv, sys.stdout
+        sys.argv = ['surfboard.py', '--fleet', ','.join(self.sources)]
+        try:
+            outputs = []
+            for i in range(2):
+                sys.stdout = StringIO()
+                main()
+                outputs.append(sys.stdout.getvalue())
+        finally:
+            sys.argv, sys.stdout = argv, stdout
+        self.assertEquals(*[re.sub(r'value \d+:', 'value ', output)
+                            for output in outputs])
+        self.assertTrue('multigraph surfboard_' in outputs[0])
+
+    def test_fleet_config(self):
+        sample = sample_fleet(self.sources[:1]).values()[0]
+        lines = config(sample, 'modem_a').split('\n')
+        self.assertEquals('multigraph surfboard_modem_a_snr_power', lines[0])
+
+
+class ModemHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive
+    page = None # Set in FetcherTestCase.setUpClass()
+    etag = '"working"'
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get('if-none-match'))
+        if server.failures:
+            server.failures -= 1
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif self.headers.get('if-none-match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(self.page)))
+            if server.etag:
+                self.send_header('ETag', self.etag)
+            self.end_headers()
+            self.wfile.write(self.page)
+
+    def log_message(self, *args):
+        pass
+
+class FetcherTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(FetcherTestCase, cls).setUpClass()
+        with open(corpus('working.htm')[0]) as f:
+            ModemHandler.page = f.read()
+        cls.server = HTTPServer(('127.0.0.1', 0), ModemHandler)
+        cls.url = 'http://127.0.0.1:{}/cmSignalData.htm'.format(
+            cls.server.server_port)
+        thread = Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super(FetcherTestCase, cls).tearDownClass()
+
+    def setUp(self):
+        super(FetcherTestCase, self).setUp()
+        self.server.requests = []
+        self.server.failures = 0
+        self.server.etag = False
+        self.fetcher = Fetcher(backoff=0.01)
+
+    def tearDown(self):
+        self.fetcher.close()
+        super(FetcherTestCase, self).tearDown()
+
+    def test_fetch(self):
+        self.assertEquals(ModemHandler.page, self.fetcher.fetch(self.url))
+        timing = self.fetcher.timings[-1]
+        self.assertEquals(200, timing.status)
+        self.assertEquals(len(ModemHandler.page), timing.bytes)
+        self.assertTrue(timing.first_byte <= timing.total)
+
+    def test_keep_alive(self):
+        for i in range(3):
+            self.fetcher.fetch(self.url)
+        connects = [t.connect for t in self.fetcher.timings]
+        self.assertIsNotNone(connects[0])
+        self.assertEquals([None, None], connects[1:])
+
+    def test_retry(self):
+        self.server.failures = 2
+        self.assertEquals(ModemHandler.page, self.fetcher.fetch(self.url))
+        self.assertEquals(3, self.fetcher.timings[-1].attempts)
+
+    def test_retries_exhausted(self):
+        self.server.failures = 3
+        self.assertRaises(FetchError, self.fetcher.fetch, self.url)
+
+    def test_conditional(self):
+        self.server.etag = True
+        for i in range(2):
+            self.assertEquals(ModemHandler.page, self.fetcher.fetch(self.url))
+        self.assertEquals([None, ModemHandler.etag], self.server.requests)
+        self.assertTrue(self.fetcher.timings[-1].cached)
+        self.assertEquals(0, self.fetcher.timings[-1].bytes)
+
+    def test_stream(self):
+        data = SignalData(self.url, stream=True, fetcher=self.fetcher)
+        self.assertEquals([34, 35, 35, 34], data.down_snrs())
+        data = SignalData(self.url, fetcher=self.fetcher)
+        self.assertEquals([34, 35, 35, 34], data.down_snrs())
+
+
+class FakeModemTestCase(TestCase):
+    """The network path, against a stand-in modem with faults"""
+    pages = testdata_pages()
+
+    def setUp(self):
+        super(FakeModemTestCase, self).setUp()
+        self.modem = FakeModem(self.pages).start()
+        self.fetcher = Fetcher(read_timeout=.2, retries=0)
+
+    def tearDown(self):
+        self.fetcher.close()
+        self.modem.stop()
+        super(FakeModemTestCase, self).tearDown()
+
+    def assertParsed(self, page, stream=False):
+        expected = SignalData(content=page)
+        data = SignalData(self.modem.url, stream=stream, fetcher=self.fetcher)
+        for table in SignalData.tables:
+            method = '{}_by_column'.format(table)
+            self.assertEquals(getattr(expected, method)(),
+                              getattr(data, method)())
+
+    def test_rotating(self):
+        for page in self.pages[:3]:
+            self.assertEquals(page, self.fetcher.fetch(self.modem.url))
+        self.assertEquals(3, self.modem.requests)
+
+    def test_latency(self):
+        self.modem.latency = .1
+        self.fetcher.fetch(self.modem.url)
+        self.assertTrue(self.fetcher.timings[-1].first_byte >= .1)
+
+    def test_trickle_chunked(self):
+        self.modem.chunk_size = 256
+        self.modem.chunk_delay = .001
+        for chunked in False, True:
+            self.modem.chunked = chunked
+            self.assertParsed(self.pages[0])
+            self.assertParsed(self.pages[1], stream=True)
+            self.modem.requests = 0
+
+    def test_stall(self):
+        self.modem.stall = .5
+        for stream in False, True:
+            self.assertRaises(timeout, SignalData, self.modem.url,
+                              stream=stream, fetcher=self.fetcher)
+
+    def test_deadline(self):
+        # Hung before the headers: retries stop in time for the deadline
+        self.modem.latency = 2
+        fetcher = Fetcher(connect_timeout=.1, read_timeout=.3, retries=5,
+                          backoff=.01, deadline=1)
+        try:
+            self.assertRaises(timeout, fetcher.fetch, self.modem.url)
+        finally:
+            fetcher.close()
+        timing = fetcher.timings[-1]
+        self.assertTrue(1 < timing.attempts < 6)
+        self.assertTrue(timing.total <= 1)
+
+    def test_trickle_deadline(self):
+        # Every piece arrives within read_timeout, the body never would
+        self.modem.chunk_size = 256
+        self.modem.chunk_delay = .1
+        fetcher = Fetcher(read_timeout=.2, retries=0, deadline=.5)
+        try:
+            for stream in False, True:
+                start = time()
+                self.assertRaises(timeout, SignalData, self.modem.url,
+                                  stream=stream, fetcher=fetcher)
+                self.assertTrue(time() - start < .6)
+            self.modem.chunk_size = None
+            self.assertEquals(self.pages[2], fetcher.fetch(self.modem.url))
+        finally:
+            fetcher.close()
+
+    def test_truncated(self):
+        self.modem.truncate = 1000
+        for chunked in False, True:
+            self.modem.chunked = chunked
+            for stream in False, True:
+                self.assertRaises(IncompleteRead, SignalData,
+                                  self.modem.url, stream=stream,
+                                  fetcher=self.fetcher)
+
+    def test_concurrent(self):
+        self.modem.rotate = False
+        self.modem.latency = .05
+        errors = []
+        def fetch():
+            try:
+                self.assertParsed(self.pages[0])
+            except Exception as e:
+                errors.append(e)
+        threads = [Thread(target=fetch) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals([], errors)
+        self.assertEquals(8, self.modem.requests)
+
+
+class SingleFlightTestCase(TestCase):
+    """Concurrent scrapes of a page share the first one's"""
+    pages = testdata_pages()
+
+    def setUp(self):
+        super(SingleFlightTestCase, self).setUp()
+        self.directory = mkdtemp()
+        self.modem = FakeModem(self.pages, latency=.5).start()
+
+    def tearDown(self):
+        self.modem.stop()
+        rmtree(self.directory)
+        super(SingleFlightTestCase, self).tearDown()
+
+    def read_all(self, openers, wait=5, deadline=9):
+        """Content each opener got (or the exception), from concurrent
+        SingleFlights started in order."""
+        results = [None] * len(openers)
+        def read(i, opener):
+            try:
+                content = SingleFlight(self.directory, wait,
+                                       deadline=deadline).open(
+                    self.modem.url, opener)
+                try:
+                    results[i] = content.read()
+                finally:
+                    content.close() # Shares it
+            except Exception as e:
+                results[i] = e
+        threads = [Thread(target=read, args=(i, opener))
+                   for i, opener in enumerate(openers)]
+        for thread in threads:
+            thread.start()
+            thread.join(.05) # In order, the first takes the lock
+        for thread in threads:
+            thread.join()
+        return results
+
+    def fetch(self, deadline=None):
+        return urlopen(self.modem.url)
+
+    def test_concurrent_share(self):
+        contents = self.read_all([self.fetch] * 6)
+        self.assertEquals([self.pages[0]] * 6, contents)
+        self.assertEquals(1, self.modem.requests)
+
+    def test_sequential(self):
+        self.assertEquals([self.pages[0]], self.read_all([self.fetch]))
+        self.assertEquals([self.pages[1]], self.read_all([self.fetch]))
+
+    def test_failed_scrape(self):
+        def fail(deadline=None):
+            self.fetch().close()
+            raise IOError('failed')
+        first, second = self.read_all([fail, self.fetch])
+        self.assertIsInstance(first, IOError)
+        self.assertEquals(self.pages[1], second)
+
+    def test_bounded_wait(self):
+        self.modem.latency = 1
+        start = time()
+        self.assertEquals(self.pages[:2],
+                          self.read_all([self.fetch] * 2, wait=.2))
+        self.assertTrue(time() - start < 1.5)
+
+    def test_wait_within_deadline(self):
+        # The first scrape stalls past wait, the second only has what's
+        # left of the deadline for it's own
+        self.modem.latency = 2
+        fetcher = Fetcher(retries=0)
+        try:
+            start = time()
+            first, second = self.read_all(
+                [partial(fetcher.open, self.modem.url)] * 2, wait=.3,
+                deadline=.6)
+            self.assertIsInstance(first, timeout)
+            self.assertIsInstance(second, timeout)
+            self.assertTrue(time() - start < 1)
+        finally:
+            fetcher.close()
+
+    def test_wait_leaves_no_time(self):
+        self.modem.latency = 1
+        start = time()
+        first, second = self.read_all([self.fetch] * 2, wait=.3,
+                                      deadline=.3)
+        self.assertEquals(self.pages[0], first)
+        self.assertIsInstance(second, IOError)
+        self.assertTrue(time() - start < 1.5)
+        self.assertEquals(1, self.modem.requests)
+
+    def test_stream(self):
+        # Read as it arrives, up to the last table (and shared)
+        page = corpus('working.htm')[0]
+        with open(page) as f:
+            page = f.read() + '<!-- {} -->'.format('x' * 200000)
+        # ~2.5s for all of it
+        modem = FakeModem([page], chunk_size=4096, chunk_delay=.05).start()
+        try:
+            flight = SingleFlight(self.directory, deadline=9)
+            start = time()
+            reading = sample(modem.url, stream=True, cache=flight)
+            self.assertTrue(time() - start < 1)
+            timestamp = reading.sample.timestamp
+            self.assertEquals(sample(page, timestamp).sample, reading.sample)
+            self.assertTrue(0 < reading.timings['bytes'] < 20000)
+            with open(flight.path(modem.url), 'rb') as f:
+                shared = f.read()
+            self.assertTrue(len(shared) < len(page))
+            self.assertTrue(page.startswith(shared))
+            self.assertEquals(reading.sample,
+                              sample(shared, timestamp).sample)
+        finally:
+            modem.stop()
+
+    def test_plugin_runs(self):
+        env = dict(environ)
+        for name in 'MUNIN_PLUGSTATE', 'SURFBOARD_WAIT':
+            env.pop(name, None)
+        args = [sys.executable, 'surfboard.py', self.modem.url,
+                '--cache-dir', self.directory, '--cache-ttl', '0']
+        runs = [Popen(args, cwd=join(dirname(__file__), '..'), env=env,
+                      stdout=PIPE) for i in range(3)]
+        outputs = [run.communicate()[0] for run in runs]
+        self.assertEquals([0] * 3, [run.returncode for run in runs])
+        values = [output.split('\n\nmultigraph surfboard_plugin_timing')[0]
+                  for output in outputs]
+        self.assertEquals(values[:1] * 3, values)
+        self.assertEquals(1, self.modem.requests)
+
+
+class ApiTestCase(TestCase):
+    def test_sources(self):
+        path = corpus('working.htm')[0]
+        expected = SignalData(path).snapshot(1)
+        with open(path) as f:
+            page = f.read()
+        modem = FakeModem([page]).start()
+        try:
+            for source in path, page, modem.url:
+                for stream in False, True:
+                    reading = sample(source, 1, stream=stream)
+                    self.assertEquals(expected, reading.sample)
+        finally:
+            modem.stop()
+
+    def test_typed(self):
+        reading = sample(corpus('working.htm')[0])
+        self.assertEquals(RECORDS['down'](144, 699000000, 34, -11),
+                          reading.down[0])
+        self.assertEquals(4, len(reading.stats))
+        self.assertEquals(Decimal('5.12'), reading.up[0].rate)
+        self.assertEquals(SignalData(corpus('working.htm')[0])
+                          .up_by_column(), reading.up_by_column())
+        self.assertRaises(AttributeError, setattr, reading, 'sample', None)
+        loaded = pickle.loads(pickle.dumps(reading, 2))
+        self.assertEquals(reading.sample, loaded.sample)
+
+    def test_timings(self):
+        path = corpus('working.htm')[0]
+        timings = sample(path).timings
+        self.assertEquals(getsize(path), timings['bytes'])
+        for field in 'fetch', 'parse', 'extract':
+            self.assertTrue(timings[field] >= 0, field)
+        self.assertIsNone(timings['render'])
+        self.assertIsNone(sample(path, stream=True).timings['parse'])
+
+    def test_parse_timing(self):
+        # The page is parsed lazily, parse must still time it (here the
+        # lxml fallback), not extract
+        with open(corpus('working.htm')[0]) as f:
+            page = f.read().replace('<TD>Power Level',
+                                    '<TD><!-- dBmV -->Power Level')
+        from surfboard import parse
+        parse_html = parse.parse_html
+        def slow_parse_html(content):
+            sleep(.1)
+            return parse_html(content)
+        parse.parse_html = slow_parse_html
+        try:
+            timings = sample(page).timings
+        finally:
+            parse.parse_html = parse_html
+        self.assertTrue(timings['parse'] >= .1)
+        self.assertTrue(timings['extract'] < .1)
+
+    def test_stream_bytes(self):
+        page, = self.pages()
+        modem = FakeModem([page]).start()
+        fetcher = Fetcher()
+        try:
+            fetcher.fetch(modem.url)
+            # Bytes this call read, not the fetcher's last fetch
+            path = corpus('one_down_only.htm')[0]
+            read = sample(path, stream=True, fetcher=fetcher).timings['bytes']
+            self.assertTrue(0 < read <= getsize(path))
+            self.assertNotEquals(len(page), read)
+            read = sample(modem.url, stream=True,
+                          fetcher=fetcher).timings['bytes']
+            self.assertTrue(0 < read <= len(page))
+        finally:
+            fetcher.close()
+            modem.stop()
+
+    def test_threads(self):
+        modem = FakeModem(self.pages()).start()
+        fetcher, results = Fetcher(), ResultCache()
+        readings, errors = [], []
+        def poll():
+            try:
+                for i in range(5):
+                    readings.append(sample(modem.url, fetcher=fetcher,
+                                           results=results))
+            except Exception as e:
+                errors.append(e)
+        threads = [Thread(target=poll) for i in range(4)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            fetcher.close()
+            modem.stop()
+        self.assertEquals([], errors)
+        self.assertEquals(20, len(readings))
+        self.assertEquals(20, results.hits + results.misses)
+        expected = SignalData(corpus('working.htm')[0]).down_by_column()
+        self.assertTrue(all(reading.down_by_column() == expected
+                            for reading in readings))
+
+    def pages(self):
+        with open(corpus('working.htm')[0]) as f:
+            return [f.read()]
+
+
+class StartupTestCase(TestCase):
+    def test_lazy_imports(self):
+        code = ('import sys, surfboard; print sorted(set('
+                'm.split(".")[0] for m in sys.modules'
+                ' if sys.modules[m] is not None))')
+        modules = check_output([sys.executable, '-c', code],
+                               cwd=join(dirname(__file__), '..'))
+        for module in 'lxml', 'bs4', 'decimal', 'httplib', 'multiprocessing':
+            self.assertFalse("'{}'".format(module) in modules, module)
+
+    def test_layout_config(self):
+        directory = mkdtemp()
+        try:
+            data = SignalData(corpus('working.htm')[0])
+            layout = layout_of(data)
+            expected = '\n\n'.join(config_graph(data, graph)
+                                    for graph in graphs)
+            graph_module._configs.clear()
+            self.assertEquals(expected, layout_config(layout,
+                                                      directory=directory))
+            self.assertEquals(1, len([name for name in listdir(directory)
+                                      if name.startswith('surfboard-config')]))
+            # Served from directory (not rendered) by a later run
+            graph_module._configs.clear()
+            self.assertEquals(expected, layout_config(layout,
+                                                      directory=directory))
+            self.assertNotEquals(expected, layout_config(
+                dict(layout, down=layout['down'] + 1), directory=directory))
+            self.assertTrue('(host)' in layout_config(layout, 'host'))
+            # Saved by a version rendering configs differently
+            version = graph_module.CONFIG_VERSION
+            graph_module._configs.clear()
+            graph_module.CONFIG_VERSION = version + 1
+            try:
+                config_path = join(directory, [
+                    name for name in listdir(directory)
+                    if name.startswith('surfboard-config')][0])
+                with open(config_path, 'w') as f:
+                    f.write('stale')
+                self.assertEquals(expected, layout_config(
+                    layout, directory=directory))
+            finally:
+                graph_module.CONFIG_VERSION = version
+        finally:
+            rmtree(directory)
+
+    def test_config_from_layout(self):
+        directory = mkdtemp()
+        try:
+            for source in corpus():
+                data = SignalData(source)
+                save_layout(directory, source, layout_of(data))
+                layout = load_layout(directory, source)
+                self.assertEquals(config(data),
+                                  config(Sample.from_layout(layout)))
+        finally:
+            rmtree(directory)
+
+
+class SnapshotTestCase(TestCase):
+    def test_by_column(self):
+        for path in corpus():
+            data = SignalData(path)
+            snapshot = data.snapshot()
+            for table in SignalData.tables:
+                method = '{}_by_column'.format(table)
+                self.assertEquals(getattr(data, method)(),
+                                  getattr(snapshot, method)(), path)
+
+    def test_records(self):
+        snapshot = SignalData(corpus('working.htm')[0]).snapshot()
+        records = snapshot.channels('down').records()
+        self.assertEquals(RECORDS['down'](144, 699000000, 34, -11),
+                          records[0])
+        self.assertEquals([34, 35, 35, 34], [r.snr for r in records])
+        self.assertEquals(['continue', 'aborted', 'aborted'],
+                          [r.status for r in snapshot.channels('up').records()])
+
+    def test_columns(self):
+        path = corpus('orig/cmSignalData.htm.2')[0]
+        snapshot = SignalData(path).snapshot()
+        self.assertEquals('d', snapshot.channels('down').column('snr').typecode)
+        self.assertEquals(3, snapshot.channels('down').padding)
+        # service id is "n/a" while ranging
+        service_ids = snapshot.channels('up').column('service_id')
+        self.assertTrue(all(isnan(v) for v in service_ids))
+        self.assertEquals([None] * len(service_ids), [r.service_id
+            for r in snapshot.channels('up').records()])
+
+    def test_frozen(self):
+        snapshot = SignalData(corpus('working.htm')[0]).snapshot(1)
+        self.assertRaises(AttributeError, setattr, snapshot, 'timestamp', 2)
+        self.assertRaises(AttributeError, setattr, snapshot, 'extra', 2)
+        self.assertRaises(AttributeError, setattr,
+                          snapshot.channels('down'), 'padding', 2)
+
+    def test_pickle(self):
+        snapshot = SignalData(corpus('working.htm')[0]).snapshot(1)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            loaded = pickle.loads(pickle.dumps(snapshot, protocol))
+            self.assertEquals(snapshot, loaded)
+            self.assertEquals(snapshot.up_by_column(), loaded.up_by_column())
+    def test_scrape(self):
+        for path in corpus():
+            for soup in False, True:
+                snapshot = Snapshot.scrape(path, 1, soup=soup)
+                self.assertEquals(SignalData(path).snapshot(1), snapshot,
+                                  path)
+                # The page and it's trees weren't pickled along
+                self.assertTrue(len(pickle.dumps(snapshot, 2))
+                                < getsize(path), path)
+
+
+class TimingsTestCase(TestCase):
+    def test_time(self):
+        timings = Timings()
+        with timings.time('parse'):
+            pass
+        column, = timings.plugin_by_column()
+        self.assertEquals(None, column['fetch'])
+        self.assertRegexpMatches(column['parse'], r'^\d+\.\d{6}$')
+
+    def test_main_output(self):
+        path = corpus('working.htm')[0]
+        data = SignalData(path)
+        for args, expected in (([path], values(data)),
+                               (['config', path], config(data))):
+            output = check_output([sys.executable, 'surfboard.py'] + args,
+                                  cwd=join(dirname(__file__), '..'))
+            graphs, timing = output.split(
+                '\n\nmultigraph surfboard_plugin_timing\n')
+            self.assertEquals(expected, graphs)
+            self.assertTrue('plugin_fetchA.' in timing)
+
+    def test_dirtyconfig(self):
+        path = corpus('working.htm')[0]
+        data = SignalData(path)
+        output = check_output([sys.executable, 'surfboard.py', 'config', path],
+                              cwd=join(dirname(__file__), '..'),
+                              env=dict(environ, MUNIN_CAP_DIRTYCONFIG='1'))
+        graphs, timing = output.split(
+            '\n\nmultigraph surfboard_plugin_timing\n', 1)
+        self.assertEquals('\n\n'.join((config(data), values(data))), graphs)
+        self.assertTrue('plugin_fetchA.label' in timing)
+        self.assertTrue('plugin_fetchA.value' in timing)
+
+
+class GraphSelectionTestCase(TestCase):
+    path = corpus('working.htm')[0]
+
+    def test_args(self):
+        self.assertIsNone(handle_args([]).graphs)
+        self.assertEquals(['errors', 'snr_power'],
+                          handle_args(['--graphs', 'errors,snr_power']).graphs)
+        environ['SURFBOARD_GRAPHS'] = 'down_power error_rate'
+        try:
+            self.assertEquals(['down_power', 'error_rate'],
+                              handle_args([]).graphs)
+        finally:
+            del environ['SURFBOARD_GRAPHS']
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            self.assertRaises(SystemExit, handle_args, ['--graphs', 'nope'])
+        finally:
+            sys.stderr = stderr
+
+    def test_plugin_graphs(self):
+        self.assertEquals(['errors'],
+                          plugin_graphs('/etc/munin/plugins/surfboard_errors'))
+        self.assertEquals(['snr_power'], plugin_graphs('surfboard_snr_power'))
+        self.assertIsNone(plugin_graphs('surfboard.py'))
+        # Linked to surfboard.sh, which passes the name on
+        environ['SURFBOARD_PLUGIN'] = 'surfboard_errors'
+        try:
+            self.assertEquals(['errors'], handle_args([]).graphs)
+        finally:
+            del environ['SURFBOARD_PLUGIN']
+
+    def test_tables(self):
+        select = lambda name: [g for g in graphs if g['graph'] == name]
+        self.assertEquals(['stats'], graph_tables(select('errors')))
+        self.assertEquals(['down'], graph_tables(select('down_power')))
+        self.assertEquals(['down', 'up'], graph_tables(select('snr_power')))
+
+    def test_extract_only(self):
+        with open(self.path) as f:
+            page = f.read()
+        fallback = page.replace('<TD>Power Level',
+                                '<TD><!-- dBmV -->Power Level')
+        for content in page, fallback:
+            data = SignalData(content=content, extract=['down'])
+            self.assertEquals(['down'], data.extracted.keys())
+            self.assertEquals(SignalData(self.path).down_by_column(),
+                              data.down_by_column())
+            self.assertRaises(KeyError, data.stats_by_column)
+        data = SignalData(self.path, stream=True, extract=['stats'])
+        self.assertEquals(['stats'], data.extracted.keys())
+        reading = sample(self.path, tables=['stats'])
+        self.assertEquals(['stats'], reading.sample.tables.keys())
+
+    def test_fleet_extract_only(self):
+        sources = corpus('working.htm', 'one_down_only.htm')
+        for processes, stream in (1, False), (2, False), (1, True):
+            samples = sample_fleet(sources, processes=processes,
+                                   stream=stream, tables=['stats'])
+            for source, fleet_sample in zip(sources, samples.values()):
+                self.assertEquals(['stats'], fleet_sample.tables.keys())
+                self.assertEquals(SignalData(source).stats_by_column(),
+                                  fleet_sample.stats_by_column())
+
+    def test_fleet_wildcard_plugin(self):
+        directory = mkdtemp()
+        try:
+            plugin = join(directory, 'surfboard_errors')
+            symlink(join(dirname(__file__), '..', 'surfboard.py'), plugin)
+            data = SignalData(self.path)
+            errors = [g for g in graphs if g['graph'] == 'errors']
+            fleet = join(directory, 'fleet')
+            with open(fleet, 'w') as f:
+                f.write(self.path + '\n')
+            env = dict(environ, MUNIN_PLUGSTATE=directory)
+            output = check_output([sys.executable, plugin, '--fleet', fleet],
+                                  env=env)
+            # Fleet samples are timestamped (value epoch:value)
+            self.assertEquals(host_values([data], host_name(self.path),
+                                          errors) + '\n',
+                              re.sub(r'value \d+:', 'value ', output))
+            self.assertEquals(['stats'], load_layout(directory,
+                                                     self.path).keys())
+        finally:
+            rmtree(directory)
+
+    def test_wildcard_plugin(self):
+        directory = mkdtemp()
+        try:
+            plugin = join(directory, 'surfboard_errors')
+            symlink(join(dirname(__file__), '..', 'surfboard.py'), plugin)
+            data = SignalData(self.path)
+            errors = [g for g in graphs if g['graph'] == 'errors']
+            env = dict(environ, MUNIN_PLUGSTATE=directory)
+            for args, expected in (
+                    ([self.path], host_values([data], selected=errors)),
+                    (['config', self.path], config(data, selected=errors))):
+                output = check_output([sys.executable, plugin] + args,
+                                      env=env)
+                self.assertEquals(expected + '\n', output)
+            # Only the stats table's layout was needed
+            self.assertEquals(['stats'], load_layout(directory,
+                                                     self.path).keys())
+        finally:
+            rmtree(directory)
+
+    def test_wildcard_plugins_share_spool(self):
+        directory = mkdtemp()
+        try:
+            url = 'http://127.0.0.1:1/cmSignalData.htm' # Nothing listens
+            now = int(time())
+            spool = Spool(directory, url)
+            for timestamp in now - 40, now - 20:
+                spool.append(Sample.from_data(SignalData(self.path),
+                                              timestamp))
+            samples = spool.samples()
+            env = dict(environ, MUNIN_PLUGSTATE=directory)
+            for name in 'snr_power', 'errors':
+                plugin = join(directory, 'surfboard_' + name)
+                symlink(join(dirname(__file__), '..', 'surfboard.py'), plugin)
+                selected = [g for g in graphs if g['graph'] == name]
+                # Each plugin reads every spooled sample, none scrapes
+                self.assertEquals(host_values(samples, selected=selected)
+                                  + '\n', check_output([sys.executable,
+                                                        plugin, url],
+                                                       env=env))
+        finally:
+            rmtree(directory)
+
+
+class ReplayTestCase(TestCase):
+    paths = corpus()
+
+    def replayed(self, paths, fmt='csv', processes=1):
+        output = StringIO()
+        replay(paths, output, fmt, processes)
+        return output.getvalue()
+
+    def test_pipe(self):
+        class Pipe(StringIO):
+            def tell(self):
+                raise IOError(29, 'Illegal seek')
+            seek = truncate = tell
+        for fmt in 'csv', 'jsonl':
+            output = Pipe()
+            replay(self.paths, output, fmt, processes=1)
+            self.assertEquals(self.replayed(self.paths, fmt),
+                              output.getvalue())
+
+    def test_main_twice(self):
+        # surfboard.replay is the submodule, not shadowed by main()'s helper
+        directory = mkdtemp()
+        argv = sys.argv
+        try:
+            output = join(directory, 'out')
+            sys.argv = ['surfboard.py', 'replay',
+                        join(dirname(__file__), '..', 'testdata', '*.htm'),
+                        '--output', output, '--processes', '1']
+            for i in range(2):
+                main()
+                with open(output, 'rb') as f:
+                    self.assertEquals(self.replayed(corpus('*.htm')),
+                                      f.read())
+        finally:
+            sys.argv = argv
+            rmtree(directory)
+
+    def test_captures(self):
+        paths = captures(join(dirname(__file__), '..', 'testdata', 'orig'))
+        names = [basename(path) for path in paths
+                 if basename(path).startswith('cmSignalData.htm.')]
+        self.assertEquals(['cmSignalData.htm.{}'.format(i)
+                           for i in range(1, 22)], names)
+
+    def test_rows(self):
+        lines = self.replayed(self.paths, 'jsonl').splitlines()
+        channels = 0
+        for path in self.paths:
+            data = SignalData(path)
+            for table in SignalData.tables:
+                method = '{}_by_column'.format(table)
+                channels += len(filter(None, getattr(data, method)()))
+        self.assertEquals(channels, len(lines))
+        row = json.loads(lines[0])
+        self.assertEquals(self.paths[0], row['source'])
+        self.assertEquals('A', row['id'])
+
+    def test_processes(self):
+        for fmt in 'csv', 'jsonl':
+            self.assertEquals(self.replayed(self.paths, fmt),
+                              self.replayed(self.paths, fmt, processes=2))
+
+    def test_resume(self):
+        expected = self.replayed(self.paths)
+        directory = mkdtemp()
+        try:
+            output, checkpoint = join(directory, 'out'), join(directory, 'ck')
+            with open(output, 'wb') as f:
+                replay(self.paths[:5], f, processes=1, checkpoint=checkpoint)
+                f.write('partial,row,after,the,checkpoint\n')
+            with open(output, 'r+b') as f:
+                self.assertEquals(len(self.paths) - 5,
+                                  replay(self.paths, f, processes=1,
+                                         checkpoint=checkpoint))
+            with open(output, 'rb') as f:
+                self.assertEquals(expected, f.read())
+        finally:
+            rmtree(directory)
+
+    def test_checkpoint_without_state(self):
+        expected = self.replayed(self.paths)
+        directory = mkdtemp()
+        try:
+            output, checkpoint = join(directory, 'out'), join(directory, 'ck')
+            with open(output, 'wb') as f:
+                f.write('GARBAGE_TAIL\n' * (len(expected) // 10))
+            # An old output, but no checkpoint: replayed from scratch
+            with open(output, 'r+b') as f:
+                replay(self.paths, f, processes=1, checkpoint=checkpoint)
+            with open(output, 'rb') as f:
+                self.assertEquals(expected, f.read())
+        finally:
+            rmtree(directory)
+
+
+def history_values(values):
+    return [None if isnan(value) else int(value) for value in values]
+
+class HistoryTestCase(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.samples = [Sample.from_data(SignalData(path), i)
+                        for i, path in enumerate(corpus())]
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def test_series(self):
+        history = History(self.directory, 'modem')
+        for sample in self.samples:
+            history.append(sample)
+        self.assertEquals(len(self.samples), len(history))
+        self.assertEquals(range(len(self.samples)),
+                          map(int, history.timestamps()))
+        self.assertEquals(
+            [s.down_by_column()[1].get('snr') for s in self.samples],
+            history_values(history.series('down', 'snr', 1)))
+        unerrored = history.series('stats', 'unerrored', 0, n=3)
+        self.assertEquals([s.stats_by_column()[0].get('unerrored')
+                           for s in self.samples[-3:]],
+                          history_values(unerrored))
+        history.close()
+
+        # Reopened, same data
+        self.assertEquals(list(unerrored), list(History(
+            self.directory, 'modem').series('stats', 'unerrored', 0, n=3)))
+
+    def test_ring(self):
+        history = History(self.directory, 'modem', slots=4)
+        for sample in self.samples[:6]:
+            history.append(sample)
+        self.assertEquals(4, len(history))
+        self.assertEquals([2, 3, 4, 5], map(int, history.timestamps()))
+        self.assertEquals([4, 5], map(int, history.timestamps(2)))
+
+        timestamps, channels = history.window('up', 'power', since=3)
+        self.assertEquals([4, 5], map(int, timestamps))
+        self.assertEquals(['A', 'B', 'C'], sorted(channels))
+        self.assertEquals([s.up_by_column()[2].get('power')
+                           for s in self.samples[4:6]],
+                          history_values(channels['C']))
+        self.assertTrue(isnan(history.series('up', 'power', 7)[0]))
+
+    def test_layout_mismatch(self):
+        History(self.directory, 'modem', slots=4).close()
+        self.assertRaises(ValueError, History, self.directory, 'modem',
+                          slots=8)
+
+    def test_poll(self):
+        history = History(self.directory, 'modem')
+        poll(corpus('working.htm')[0], Spool(self.directory, 'modem'),
+             count=1, history=history)
+        self.assertEquals(1, len(history))
+
+
+class RatesTestCase(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def stats_sample(self, timestamp, *counters):
+        columns = [{'channel': i, 'unerrored': u, 'correctable': c,
+                    'uncorrectable': e}
+                   for i, (u, c, e) in enumerate(counters)]
+        return Sample.from_by_columns(timestamp, {'down': [], 'up': [],
+                                                  'stats': columns})
+
+    def test_deltas(self):
+        nan = float('nan')
+        self.assertEquals([5, 5, 3, 2], list(deltas([0, 5, 10, 3, 5])))
+        result = deltas([0, nan, 10, 12])
+        self.assertTrue(isnan(result[0]) and isnan(result[1]))
+        self.assertEquals(2, result[2])
+
+    def test_error_rates(self):
+        histories = []
+        for modem in range(3):
+            history = History(self.directory, 'modem{}'.format(modem))
+            history.append(self.stats_sample(0, (0, 0, 0), (0, 0, 0)))
+            history.append(self.stats_sample(10, (90, 8, 2), (100, 0, 0)))
+            # Rebooted, counters reset
+            history.append(self.stats_sample(20, (45, 4, 1), (50, 0, 0)))
+            histories.append(history)
+
+        for rates in error_rates(histories):
+            ratios = rates.ratio_by_column()
+            self.assertEquals(4, len(ratios)) # Padded like stats
+            self.assertAlmostEquals(0.1, ratios[0]['pre_fec'])
+            self.assertAlmostEquals(0.02, ratios[0]['post_fec'])
+            self.assertEquals(0, ratios[1]['post_fec'])
+            self.assertEquals({}, ratios[2])
+            self.assertAlmostEquals(0.6, rates.rate_by_column()[0][
+                'correctable'])
+
+        rates, = error_rates(histories[:1], since=10)
+        self.assertEquals(None, rates.ratio_by_column()[0]['pre_fec'])
+
+
+class ExporterTestCase(TestCase):
+    source = corpus('working.htm')[0]
+
+    def test_metrics(self):
+        exporter = Exporter(self.source, interval=60)
+        self.assertTrue('surfboard_up 0\n' in exporter.metrics())
+        exporter.refresh()
+        metrics = exporter.metrics()
+        self.assertTrue('surfboard_snr_db{direction="down",channel="144"} 34\n'
+                        in metrics)
+        self.assertTrue('surfboard_codewords_total{direction="down"'
+                        ',channel="144",type="correctable"} ' in metrics)
+        self.assertTrue('surfboard_up 1\n' in metrics)
+        self.assertEquals(1, metrics.count('# TYPE surfboard_snr_db '))
+
+        # Scrapes never refresh, they're served the latest sample
+        exporter.metrics()
+        self.assertEquals(1, exporter.refreshes.count)
+        self.assertEquals(3, exporter.scrapes.count)
+        self.assertTrue('surfboard_refresh_duration_seconds_count 1\n'
+                        in exporter.metrics())
+
+    def test_main(self):
+        # surfboard.exporter is the submodule, not shadowed by main()'s
+        # helper (which imports serve from it)
+        exporter_module = sys.modules['surfboard.exporter']
+        serve, served = exporter_module.serve, []
+        exporter_module.serve = lambda exporter, host, port: served.append(
+            (exporter.source, host, port))
+        argv = sys.argv
+        sys.argv = ['surfboard.py', 'exporter', self.source,
+                    '--listen', '127.0.0.1:9999']
+        try:
+            for i in range(2):
+                main()
+        finally:
+            exporter_module.serve, sys.argv = serve, argv
+        self.assertEquals([(self.source, '127.0.0.1', 9999)] * 2, served)
+
+    def test_failed_refresh(self):
+        exporter = Exporter('/nonexistent/cmSignalData.htm', interval=0)
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            exporter.refresh()
+        finally:
+            sys.stderr = stderr
+        metrics = exporter.metrics()
+        self.assertTrue('surfboard_up 0\n' in metrics)
+        self.assertTrue('surfboard_refresh_failures_total 1\n' in metrics)
+        self.assertFalse('surfboard_snr_db' in metrics)
+
+    def test_background_refresh(self):
+        modem = FakeModem(testdata_pages(), rotate=False, latency=1).start()
+        exporter = Exporter(modem.url, interval=60).start()
+        try:
+            # Answered while the first refresh waits on the modem
+            start = time()
+            self.assertTrue('surfboard_up 0\n' in exporter.metrics())
+            self.assertTrue(time() - start < .5)
+            while exporter.refreshes.count == 0:
+                sleep(.05)
+            start = time()
+            metrics = exporter.metrics()
+            self.assertTrue(time() - start < .5)
+            self.assertTrue('surfboard_up 1\n' in metrics)
+            self.assertTrue('surfboard_snr_db' in metrics)
+            self.assertEquals(1, modem.requests)
+        finally:
+            modem.stop()
+            exporter.stop()
+
+    def test_server(self):
+        exporter = Exporter(self.source, interval=60)
+        exporter.refresh()
+        server = ExporterServer(('127.0.0.1', 0), exporter)
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:{}'.format(server.server_port)
+            response = urlopen(url + '/metrics')
+            self.assertTrue(response.info()['content-type'].startswith(
+                'text/plain; version=0.0.4'))
+            self.assertTrue('surfboard_power_dbmv' in response.read())
+            self.assertRaises(HTTPError, urlopen, url + '/other')
+        finally:
+            server.shutdown()
+            server.server_close()